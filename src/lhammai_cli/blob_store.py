@@ -0,0 +1,125 @@
+import hashlib
+import json
+import time
+from collections import Counter
+from pathlib import Path
+
+from lhammai_cli.utils import locked, logger, temp_path
+
+# Blobs younger than this are never collected, as a concurrent writer may not have saved its history yet
+GC_MIN_AGE = 3600.0
+
+
+class BlobStore:
+    """Content-addressed store of large message bodies.
+
+    Each body is stored once, in `<directory>/<first two hex digits>/<sha256 hex digest>`, however
+    many messages reference it. `refs.json` holds the number of stored messages referencing each
+    blob; it is rewritten with the history, and `gc` removes the blobs no message references.
+    Both hold an exclusive lock on `lock_file`, across threads and processes.
+    """
+
+    def __init__(self, directory: Path, threshold: int, lock_file: Path | None = None):
+        """Initialize the store.
+
+        Args:
+            directory: Directory holding the blobs
+            threshold: Minimum length, in characters, of the message bodies kept in the store
+            lock_file: The lock serializing updates of the reference counts, e.g. that of the history
+                they are counted from, `<directory>/refs.lock` by default
+        """
+        self.directory = directory
+        self.threshold = threshold
+        self._refs_file = directory / "refs.json"
+        self._lock_file = lock_file or directory / "refs.lock"
+
+    def _path(self, digest: str) -> Path:
+        """Return the path of a blob."""
+        return self.directory / digest[:2] / digest
+
+    def put(self, content: str) -> str:
+        """Store a message body, unless an identical one is already stored.
+
+        Args:
+            content: The message body
+
+        Returns:
+            The digest referencing the body
+        """
+        data = content.encode("utf-8")
+        digest = hashlib.sha256(data).hexdigest()
+        path = self._path(digest)
+        if path.exists():
+            # Refresh the age of the blob, so it survives a garbage collection racing with this save
+            path.touch()
+            return digest
+
+        path.parent.mkdir(parents=True, exist_ok=True)
+        temp_file = temp_path(path)
+        temp_file.write_bytes(data)
+        temp_file.replace(path)
+        logger.debug("Stored blob {} ({} bytes)", digest, len(data))
+        return digest
+
+    def get(self, digest: str) -> str:
+        """Read a message body.
+
+        Args:
+            digest: The digest referencing the body
+
+        Returns:
+            The message body
+
+        Raises:
+            FileNotFoundError: If the blob does not exist
+        """
+        return self._path(digest).read_text(encoding="utf-8")
+
+    def refcounts(self) -> dict[str, int]:
+        """Return the number of stored messages referencing each blob."""
+        try:
+            with self._refs_file.open(encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def set_refcounts(self, counts: Counter[str]) -> None:
+        """Replace the reference counts, after the history was rewritten.
+
+        Args:
+            counts: The number of stored messages referencing each blob
+        """
+        with locked(self._lock_file):
+            if not counts and not self._refs_file.exists():
+                return  # nothing was ever stored
+            self.directory.mkdir(parents=True, exist_ok=True)
+            temp_file = temp_path(self._refs_file)
+            with temp_file.open("w", encoding="utf-8") as f:
+                json.dump(dict(sorted(counts.items())), f)
+            temp_file.replace(self._refs_file)
+
+    def gc(self, min_age: float = GC_MIN_AGE) -> tuple[int, int]:
+        """Remove the blobs that no stored message references.
+
+        Args:
+            min_age: Only remove blobs that were last stored at least this many seconds ago
+
+        Returns:
+            The number of removed blobs and the number of bytes they took
+        """
+        cutoff = time.time() - min_age
+        removed = freed = 0
+        with locked(self._lock_file):
+            refcounts = self.refcounts()
+            for path in self.directory.glob("??/*"):
+                if path.suffix == ".tmp" or refcounts.get(path.name, 0) > 0:
+                    continue
+                stat = path.stat()
+                if stat.st_mtime > cutoff:
+                    continue
+                path.unlink(missing_ok=True)
+                removed += 1
+                freed += stat.st_size
+
+        logger.debug("Removed {} unreferenced blobs ({} bytes)", removed, freed)
+        return removed, freed
@@ -1,55 +1,322 @@
+import atexit
 import json
+import os
+import signal
 import threading
+import weakref
+from collections import Counter
+from collections.abc import Iterable, Iterator, Mapping
 from datetime import datetime
+from pathlib import Path
+from typing import TextIO
 from uuid import UUID, uuid4
 
-from lhammai_cli.schema import Conversation, ConversationMetadata, HistoryFile, Message, Role
+from lhammai_cli.blob_store import GC_MIN_AGE, BlobStore
+from lhammai_cli.schema import (
+    Conversation,
+    ConversationMetadata,
+    ConversationParent,
+    HistoryFile,
+    Message,
+    MessageLog,
+    Role,
+    TokenUsage,
+)
 from lhammai_cli.settings import settings
-from lhammai_cli.utils import logger
+from lhammai_cli.usage import UsageRollups
+from lhammai_cli.utils import locked, logger, temp_path
+from lhammai_cli.vector_index import VectorIndex
 
 HISTORY_FILE = settings.history_file
 
+# Characters read from the history file at a time when streaming it
+READ_CHUNK_SIZE = 1 << 16
+
+_decoder = json.JSONDecoder()
+
+
+# Histories in write-behind mode, flushed when the interpreter exits or is terminated
+_write_behind_histories: "weakref.WeakSet[ConversationHistory]" = weakref.WeakSet()
+_exit_handlers_installed = False
+
+
+def _history_lock() -> Path:
+    """Return the lock file serializing the read-modify-write cycles of the history file.
+
+    Held across threads and processes, e.g. the flusher threads of write-behind histories or CLI
+    runs that received a coalesced answer at the same moment, so none of them loses the
+    conversations the others saved.
+    """
+    return HISTORY_FILE.with_suffix(f"{HISTORY_FILE.suffix}.lock")
+
+
+def _flush_write_behind_histories() -> None:
+    """Flush and stop every history in write-behind mode."""
+    for conversation_history in list(_write_behind_histories):
+        conversation_history.close()
+
+
+def _handle_termination(signum: int, frame: object, previous: object) -> None:
+    """Exit through the normal interpreter shutdown, so pending messages are flushed by the atexit hook.
+
+    Flushing from the handler itself could deadlock on a lock held by the interrupted code.
+    """
+    if callable(previous):
+        previous(signum, frame)
+    else:
+        raise SystemExit(128 + signum)
+
+
+def _install_exit_handlers() -> None:
+    """Flush write-behind histories at exit and on SIGTERM/SIGHUP, once per process."""
+    global _exit_handlers_installed
+    if _exit_handlers_installed:
+        return
+    _exit_handlers_installed = True
+
+    atexit.register(_flush_write_behind_histories)
+    for name in ("SIGTERM", "SIGHUP"):
+        signum = getattr(signal, name, None)
+        if signum is None:
+            continue
+        try:
+            previous = signal.getsignal(signum)
+            if previous == signal.SIG_IGN:
+                continue
+            signal.signal(signum, lambda s, f, previous=previous: _handle_termination(s, f, previous))
+        except ValueError:
+            # Signal handlers can only be installed from the main thread; atexit still covers normal exits
+            logger.debug("Could not install a {} handler outside the main thread", name)
+
+
+def _iter_object_items(f: TextIO) -> Iterator[tuple[str, object]]:
+    """Incrementally decode the members of the top-level JSON object in a file.
+
+    Only the member being decoded is held in memory. When a member does not fit in the buffered
+    text, the buffer is at least doubled before decoding again, so large members are read in
+    amortized linear time.
+
+    Args:
+        f: A text file containing a single JSON object
+
+    Yields:
+        The key and decoded value of each member, in file order
+
+    Raises:
+        json.JSONDecodeError: If the file is not a valid JSON object
+    """
+    buffer = ""
+    pos = 0
+    eof = False
+
+    def fill(min_size: int = READ_CHUNK_SIZE) -> bool:
+        nonlocal buffer, pos, eof
+        chunk = "" if eof else f.read(max(min_size, READ_CHUNK_SIZE))
+        eof = not chunk
+        buffer = buffer[pos:] + chunk
+        pos = 0
+        return not eof
+
+    def skip_whitespace() -> str:
+        nonlocal pos
+        while True:
+            while pos < len(buffer) and buffer[pos].isspace():
+                pos += 1
+            if pos < len(buffer) or not fill():
+                return buffer[pos] if pos < len(buffer) else ""
+
+    def decode() -> object:
+        nonlocal pos
+        while True:
+            try:
+                value, end = _decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError:
+                if not fill(len(buffer) - pos):
+                    raise
+                continue
+            # A number may continue in the next chunk; anything else is delimited by its last character
+            if end == len(buffer) and not eof and not isinstance(value, (str, dict, list)):
+                fill(len(buffer) - pos)
+                continue
+            pos = end
+            return value
+
+    def expect(char: str) -> None:
+        nonlocal pos
+        if skip_whitespace() != char:
+            raise json.JSONDecodeError(f"Expecting '{char}'", buffer, pos)
+        pos += 1
+
+    expect("{")
+    if skip_whitespace() == "}":
+        return
+    while True:
+        if skip_whitespace() != '"':
+            raise json.JSONDecodeError("Expecting property name enclosed in double quotes", buffer, pos)
+        key = decode()
+        expect(":")
+        skip_whitespace()
+        yield key, decode()  # type: ignore[misc]
+
+        separator = skip_whitespace()
+        pos += 1
+        if separator == "}":
+            return
+        if separator != ",":
+            raise json.JSONDecodeError("Expecting ',' delimiter", buffer, pos - 1)
+
+
+def _count_blob_refs(history_data: dict[str, dict]) -> Counter[str]:
+    """Count the messages referencing each blob in a serialized history."""
+    return Counter(
+        message["content_ref"]
+        for conversation in history_data.values()
+        for message in conversation["messages"]
+        if "content_ref" in message
+    )
+
+
+def _resolve_thread(conversations: Mapping[str, Conversation], uuid_str: str) -> list[Message]:
+    """Assemble every message of a conversation, including those inherited from the conversations it was forked from.
+
+    The returned list references the stored messages, so assembling a thread copies no message.
+
+    Args:
+        conversations: Conversations keyed by UUID
+        uuid_str: UUID of the conversation
+
+    Returns:
+        The inherited messages followed by the messages of the conversation itself
+
+    Raises:
+        ValueError: If the conversation or one of its ancestors is missing, or the fork points are inconsistent
+    """
+    lineage: list[Conversation] = []
+    seen: set[str] = set()
+    current: str | None = uuid_str
+    while current is not None:
+        if current in seen:
+            raise ValueError(f"Conversation {uuid_str} is forked from itself")
+        seen.add(current)
+        conversation = conversations.get(current)
+        if conversation is None:
+            raise ValueError(f"Conversation {current} not found in history")
+        lineage.append(conversation)
+        current = conversation.parent.uuid if conversation.parent else None
+
+    messages: list[Message] = []
+    for conversation in reversed(lineage):
+        if conversation.parent is not None:
+            if conversation.parent.message_count > len(messages):
+                raise ValueError(
+                    f"Conversation {conversation.parent.uuid} has {len(messages)} messages, "
+                    f"cannot fork it at message {conversation.parent.message_count}"
+                )
+            messages = messages[: conversation.parent.message_count]
+        messages.extend(conversation.messages)
+    return messages
+
+
+def _reparent(fork: Conversation, parent: Conversation) -> Conversation:
+    """Attach a fork to its grandparent, moving the messages it inherits from its parent into it.
+
+    Args:
+        fork: The fork of `parent`
+        parent: The conversation about to be deleted
+
+    Returns:
+        The fork, now independent of `parent`
+    """
+    fork_point = fork.parent.message_count if fork.parent else 0
+    inherited = parent.parent.message_count if parent.parent else 0
+    if fork_point <= inherited:
+        # The fork point is within what the parent itself inherits
+        new_parent = parent.parent.model_copy(update={"message_count": fork_point}) if parent.parent else None
+        messages = list(fork.messages)
+    else:
+        new_parent = parent.parent
+        messages = [*parent.messages[: fork_point - inherited], *fork.messages]
+    metadata = fork.metadata.model_copy(update={"message_count": len(messages)})
+    return Conversation(metadata=metadata, messages=messages, parent=new_parent)
+
 
 class ConversationHistory:
     """Manages conversation history with LLMs, supporting persistence and retrieval."""
 
-    def __init__(self, conversation_uuid: UUID, conversation: Conversation):
+    def __init__(
+        self,
+        conversation_uuid: UUID,
+        conversation: Conversation,
+        write_behind: bool = False,
+        context: list[Message] | None = None,
+    ):
         """Initialize the conversation history manager.
 
+        In write-behind mode, messages are persisted by a background thread instead of by explicit
+        `save_to_disk` calls. Successive `add_message` calls are coalesced into a single write every
+        `HISTORY_FLUSH_INTERVAL` seconds, or as soon as `HISTORY_FLUSH_MESSAGES` messages are
+        pending. Pending messages are flushed by `flush`, `close`, at interpreter exit and on
+        SIGTERM/SIGHUP. `HISTORY_FSYNC` controls whether writes are fsynced: `never`, `close` (only
+        the final flush) or `always`.
+
         Args:
             conversation_uuid: UUID of the current conversation
             conversation: The current conversation object
+            write_behind: Whether to persist new messages in the background
+            context: The messages a forked conversation inherits, which are not stored with it
         """
         self._lock = threading.Lock()
         self._current_uuid: UUID = conversation_uuid
-        self._current_conversation: Conversation = conversation
+
+        # Messages are only ever appended. The current conversation is an immutable snapshot viewing
+        # them, which is replaced rather than modified, so it can be read without taking the lock.
+        self._messages: list[Message] = list(conversation.messages)
+        self._current_conversation: Conversation = Conversation.model_construct(
+            metadata=conversation.metadata, messages=MessageLog(self._messages), parent=conversation.parent
+        )
+        self._context: list[Message] = list(context or [])
+
+        self._write_behind = write_behind
+        self._pending = 0
+        self._closed = False
+        self._wake = threading.Condition(self._lock)
+        self._flush_lock = threading.Lock()
+        self._flusher: threading.Thread | None = None
+        if write_behind:
+            _install_exit_handlers()
+            _write_behind_histories.add(self)
+            self._flusher = threading.Thread(target=self._flush_loop, name="history-flusher", daemon=True)
+            self._flusher.start()
 
     @staticmethod
     def init_history() -> None:
         """Initialize the conversation history file."""
-        if not HISTORY_FILE.exists() or (HISTORY_FILE.exists() and HISTORY_FILE.stat().st_size == 0):
-            with HISTORY_FILE.open("w", encoding="utf-8") as f:
-                json.dump({}, f)
+        with locked(_history_lock()):
+            if not HISTORY_FILE.exists() or (HISTORY_FILE.exists() and HISTORY_FILE.stat().st_size == 0):
+                with HISTORY_FILE.open("w", encoding="utf-8") as f:
+                    json.dump({}, f)
 
     @classmethod
     def clear_all_history(cls) -> None:
         """Clear all conversation history from disk and memory.
-        
+
         Raises:
             FileNotFoundError: If the history file does not exist
         """
         try:
-            if HISTORY_FILE.exists():
-                HISTORY_FILE.unlink()
+            with locked(_history_lock()):
+                if HISTORY_FILE.exists():
+                    HISTORY_FILE.unlink()
 
-            logger.debug("Cleared all conversation history. Creating new history file.")
-            cls.init_history()
+                logger.debug("Cleared all conversation history. Creating new history file.")
+                cls.init_history()
+                cls.get_blob_store().set_refcounts(Counter())
 
         except FileNotFoundError:
             logger.warning("History file not found. Initializing new history file.")
             cls.init_history()
         except Exception as e:
-            logger.error(f"Failed to clear history: {e}")
+            logger.error("Failed to clear history: {}", e)
             raise
 
     @classmethod
@@ -58,7 +325,7 @@ class ConversationHistory:
 
         Returns:
             Dictionary mapping UUIDs to conversation objects
-        
+
         Raises:
             FileNotFoundError: If the history file does not exist
             json.JSONDecodeError: If the history file is not valid JSON
@@ -66,8 +333,8 @@ class ConversationHistory:
         try:
             with HISTORY_FILE.open(encoding="utf-8") as f:
                 raw_data = json.load(f)
-        
-            history_file = HistoryFile.model_validate(raw_data)
+
+            history_file = HistoryFile.model_validate(raw_data, context={"blobs": cls.get_blob_store()})
             return history_file.root
 
         except FileNotFoundError as e:
@@ -75,12 +342,112 @@ class ConversationHistory:
             cls.init_history()
             return {}
         except json.JSONDecodeError as e:
-            logger.error(f"Could not parse history file: {e}")
+            logger.error("Could not parse history file: {}", e)
             raise json.JSONDecodeError("Failed to parse history file, invalid JSON.", doc=e.doc, pos=e.pos) from e
         except Exception as e:
-            logger.error(f"Failed to load history from disk: {e}")
+            logger.error("Failed to load history from disk: {}", e)
             raise
 
+    @classmethod
+    def iter_history_from_disk(cls, uuids: Iterable[str] | None = None) -> Iterator[tuple[str, Conversation]]:
+        """Stream conversations from disk one at a time.
+
+        Unlike `load_history_from_disk`, memory use is bounded by the largest conversation rather
+        than the whole history, and conversations that are filtered out are never validated.
+
+        Args:
+            uuids: Only yield the conversations with these UUIDs, if given
+
+        Yields:
+            Pairs of conversation UUID and conversation, in file order
+
+        Raises:
+            json.JSONDecodeError: If the history file is not valid JSON
+            pydantic.ValidationError: If a conversation does not match the schema
+        """
+        wanted = set(uuids) if uuids is not None else None
+        context = {"blobs": cls.get_blob_store()}
+        try:
+            f = HISTORY_FILE.open(encoding="utf-8")
+        except FileNotFoundError:
+            logger.warning("History file not found. Initializing new history file.")
+            cls.init_history()
+            return
+
+        with f:
+            if f.read(1) == "":
+                return  # an empty file is an empty history, as in `init_history`
+            f.seek(0)
+            for uuid_str, raw_conversation in _iter_object_items(f):
+                if wanted is not None and uuid_str not in wanted:
+                    continue
+                yield uuid_str, Conversation.model_validate(raw_conversation, context=context)
+
+    @classmethod
+    def import_conversations(cls, conversations: Iterable[tuple[str, Conversation]]) -> tuple[int, int]:
+        """Merge conversations into the history file, keeping the existing ones.
+
+        Both the existing history and the imported conversations are streamed into a temporary file,
+        which then replaces the history file, so memory use does not grow with either of them and an
+        interrupted import leaves the history untouched.
+
+        Args:
+            conversations: Pairs of conversation UUID and conversation to import
+
+        Returns:
+            The number of imported conversations and the number skipped because their UUID already exists
+
+        Raises:
+            ValueError: If a UUID is not valid
+        """
+        cls.init_history()
+        seen: set[str] = set()
+        imported = skipped = 0
+        context = {"blobs": cls.get_blob_store()}
+        refcounts: Counter[str] = Counter()
+
+        temp_file = temp_path(HISTORY_FILE)
+        with locked(_history_lock()):
+            try:
+                with temp_file.open("w", encoding="utf-8") as f:
+                    # Same layout as `json.dump(..., indent=2)` of the whole history
+                    f.write("{")
+                    separator = "\n"
+
+                    def write(uuid_str: str, conversation: Conversation) -> None:
+                        nonlocal separator
+                        data = conversation.model_dump(context=context)
+                        refcounts.update(_count_blob_refs({uuid_str: data}))
+                        value = json.dumps(data, indent=2, ensure_ascii=False, default=str)
+                        value = value.replace("\n", "\n  ")
+                        f.write(f"{separator}  {json.dumps(uuid_str)}: {value}")
+                        separator = ",\n"
+
+                    for uuid_str, conversation in cls.iter_history_from_disk():
+                        seen.add(uuid_str)
+                        write(uuid_str, conversation)
+
+                    for uuid_str, conversation in conversations:
+                        try:
+                            UUID(uuid_str)
+                        except ValueError as e:
+                            raise ValueError(f"Invalid UUID format: {uuid_str}") from e
+                        if uuid_str in seen:
+                            skipped += 1
+                            continue
+                        seen.add(uuid_str)
+                        write(uuid_str, conversation)
+                        imported += 1
+
+                    f.write("}" if separator == "\n" else "\n}")
+                temp_file.replace(HISTORY_FILE)
+                context["blobs"].set_refcounts(refcounts)
+            finally:
+                temp_file.unlink(missing_ok=True)
+
+        logger.debug("Imported {} conversations, skipped {} existing ones", imported, skipped)
+        return imported, skipped
+
     @classmethod
     def delete_conversation(cls, conversation_uuid: str) -> bool:
         """Delete a conversation by its UUID.
@@ -100,46 +467,120 @@ class ConversationHistory:
             raise ValueError(f"Invalid UUID format: {conversation_uuid}") from e
 
         try:
-            history = cls.load_history_from_disk()
+            with locked(_history_lock()):
+                history = cls.load_history_from_disk()
 
-            if conversation_uuid not in history:
-                return False
+                if conversation_uuid not in history:
+                    return False
 
-            # Remove conversation
-            del history[conversation_uuid]
+                # Remove conversation, moving the messages its forks inherit from it into them
+                deleted = history.pop(conversation_uuid)
+                forks = {}
+                for uuid_str, conversation in history.items():
+                    if conversation.parent is not None and conversation.parent.uuid == conversation_uuid:
+                        history[uuid_str] = forks[uuid_str] = _reparent(conversation, deleted)
 
-            # Save back to disk using Pydantic serialization
-            history_file = HistoryFile(root=history)
-            with HISTORY_FILE.open("w", encoding="utf-8") as f:
-                json.dump(history_file.model_dump(), f, indent=2, ensure_ascii=False, default=str)
+                # Save back to disk using Pydantic serialization
+                cls._write_history_file(history)
+            cls._reindex_conversations(conversation_uuid, forks)
 
-            logger.debug(f"Deleted conversation {conversation_uuid}")
+            logger.debug("Deleted conversation {}", conversation_uuid)
             return True
 
         except Exception as e:
-            logger.error(f"Failed to delete conversation {conversation_uuid}: {e}")
+            logger.error("Failed to delete conversation {}: {}", conversation_uuid, e)
             raise Exception(f"Failed to delete conversation {conversation_uuid}") from e
 
     @classmethod
-    def start_new(cls, model: str, api_base: str) -> "ConversationHistory":
+    def start_new(
+        cls, model: str, api_base: str, cold_start: bool | None = None, cached: bool = False, write_behind: bool = False
+    ) -> "ConversationHistory":
         """Start a new conversation, saving the current one if it exists.
 
         Args:
             model: The LLM model to use (e.g., 'ollama:gemma3:4b')
             api_base: The API endpoint to use
+            cold_start: Whether the model had to be loaded before answering, if known
+            cached: Whether the answer is served from the response cache
+            write_behind: Whether to persist new messages in the background, see `ConversationHistory`
 
         Returns:
             The UUID of the new conversation as a string
         """
         uuid = uuid4()
-        metadata = ConversationMetadata(model=model, api_base=api_base, start_time=datetime.now(), message_count=0)
+        metadata = ConversationMetadata(
+            model=model,
+            api_base=api_base,
+            start_time=datetime.now(),
+            message_count=0,
+            cold_start=cold_start,
+            cached=cached,
+        )
         conversation = Conversation(metadata=metadata, messages=[])
 
         cls.init_history()
 
-        logger.debug(f"Started new conversation {uuid}")
+        logger.debug("Started new conversation {}", uuid)
+
+        return cls(conversation_uuid=uuid, conversation=conversation, write_behind=write_behind)
+
+    @classmethod
+    def fork(
+        cls,
+        parent_uuid: UUID,
+        message_count: int,
+        model: str,
+        api_base: str,
+        cold_start: bool | None = None,
+        cached: bool = False,
+        write_behind: bool = False,
+        thread: list[Message] | None = None,
+    ) -> "ConversationHistory":
+        """Start a new conversation that continues the first messages of a stored one.
+
+        Only a reference to the parent conversation is stored with the fork, not the messages it
+        inherits; `get_thread` returns them together with the new messages.
+
+        Args:
+            parent_uuid: UUID of the conversation to fork
+            message_count: Number of leading messages of that conversation to keep
+            model: The LLM model to use (e.g., 'ollama:gemma3:4b')
+            api_base: The API endpoint to use
+            cold_start: Whether the model had to be loaded before answering, if known
+            cached: Whether the answer is served from the response cache
+            write_behind: Whether to persist new messages in the background, see `ConversationHistory`
+            thread: Every message of the conversation to fork, as returned by `load_thread`, if already loaded
+
+        Returns:
+            The forked ConversationHistory object
 
-        return cls(conversation_uuid=uuid, conversation=conversation)
+        Raises:
+            ValueError: If the conversation does not exist or has fewer than `message_count` messages
+        """
+        if thread is None:
+            thread = cls.load_thread(parent_uuid)
+        if not 0 <= message_count <= len(thread):
+            raise ValueError(
+                f"Cannot fork conversation {parent_uuid} at message {message_count}, it has {len(thread)} messages"
+            )
+
+        uuid = uuid4()
+        metadata = ConversationMetadata(
+            model=model,
+            api_base=api_base,
+            start_time=datetime.now(),
+            message_count=0,
+            cold_start=cold_start,
+            cached=cached,
+        )
+        parent = ConversationParent(uuid=str(parent_uuid), message_count=message_count)
+        conversation = Conversation(metadata=metadata, messages=[], parent=parent)
+
+        logger.debug("Forked conversation {} at message {} into {}", parent_uuid, message_count, uuid)
+
+        return cls(
+            conversation_uuid=uuid, conversation=conversation, write_behind=write_behind, context=thread[:message_count]
+        )
 
     @classmethod
     def load_from_disk(cls, uuid: UUID) -> "ConversationHistory":
@@ -150,13 +591,88 @@ class ConversationHistory:
 
         Returns:
             The loaded ConversationHistory object
+
+        Raises:
+            ValueError: If the conversation, or one it was forked from, does not exist
         """
         history = cls.load_history_from_disk()
-        if uuid not in history:
+        if str(uuid) not in history:
             raise ValueError(f"Conversation {uuid} not found in history")
 
         conversation = history[str(uuid)]
-        return cls(conversation_uuid=uuid, conversation=conversation)
+        context: list[Message] = []
+        if conversation.parent is not None:
+            context = _resolve_thread(history, conversation.parent.uuid)[: conversation.parent.message_count]
+        return cls(conversation_uuid=uuid, conversation=conversation, context=context)
+
+    @classmethod
+    def load_thread(cls, uuid: UUID) -> list[Message]:
+        """Load every message of a conversation, including those inherited from the conversations it was forked from.
+
+        Args:
+            uuid: The UUID of the conversation
+
+        Returns:
+            The messages of the conversation, from the first message of the root conversation on
+
+        Raises:
+            ValueError: If the conversation, or one it was forked from, does not exist
+        """
+        return _resolve_thread(cls.load_history_from_disk(), str(uuid))
+
+    @staticmethod
+    def get_vector_index() -> VectorIndex:
+        """Get the semantic index of the messages stored next to the history file.
+
+        Returns:
+            The vector index for the configured embedding model
+
+        Raises:
+            ImportError: If NumPy is not installed
+        """
+        return VectorIndex(HISTORY_FILE.parent / "index", settings.embedding_model)
+
+    @staticmethod
+    def get_blob_store() -> BlobStore:
+        """Get the store of large message bodies kept next to the history file.
+
+        Returns:
+            The blob store, holding bodies of at least `BLOB_THRESHOLD` characters
+        """
+        return BlobStore(HISTORY_FILE.parent / "blobs", settings.blob_threshold, _history_lock())
+
+    @classmethod
+    def collect_garbage(cls, min_age: float = GC_MIN_AGE) -> tuple[int, int]:
+        """Remove the blobs that no stored message references.
+
+        The references are recounted from the history file first, so counts left stale by an
+        interrupted write can never cause a referenced blob to be removed.
+
+        Args:
+            min_age: Only remove blobs that were last stored at least this many seconds ago
+
+        Returns:
+            The number of removed blobs and the number of bytes they took
+        """
+        blobs = cls.get_blob_store()
+        with locked(_history_lock()):
+            refcounts = Counter(
+                message.content_ref
+                for _, conversation in cls.iter_history_from_disk()
+                for message in conversation.messages
+                if message.content_ref is not None
+            )
+            blobs.set_refcounts(refcounts)
+            return blobs.gc(min_age)
+
+    @staticmethod
+    def get_usage_rollups() -> UsageRollups:
+        """Get the per-day, per-model token usage rollups stored next to the history file.
+
+        Returns:
+            The usage rollups
+        """
+        return UsageRollups(HISTORY_FILE.parent / "usage.json")
 
     @classmethod
     def list_conversation_uuids(cls) -> list[str]:
@@ -168,12 +684,14 @@ class ConversationHistory:
         history = cls.load_history_from_disk()
         return list(history.keys())
 
-    def add_message(self, role: Role, content: str) -> None:
+    def add_message(self, role: Role, content: str, usage: TokenUsage | None = None, truncated: bool = False) -> None:
         """Add a message to the current conversation.
 
         Args:
             role: The role of the message sender ('user', 'assistant' or 'system')
             content: The content of the message
+            usage: The tokens consumed to generate the message, added to the usage rollups
+            truncated: Whether the generation of the message was cut short
 
         Raises:
             ValueError: If role is not 'user', 'assistant' or 'system'
@@ -183,27 +701,62 @@ class ConversationHistory:
             raise RuntimeError("No conversation started. Call `ConversationHistory.start_new()` first.")
 
         # Validate the message using Pydantic model
-        message = Message(role=role, content=content)
+        message = Message(role=role, content=content, usage=usage, truncated=truncated)
 
         with self._lock:
-            self._current_conversation.messages.append(message)
-            self._current_conversation.metadata.message_count += 1
-            logger.debug(f"Added {role} message to conversation {self._current_uuid}")
+            self._messages.append(message)
+            metadata = self._current_conversation.metadata
+            self._current_conversation = Conversation.model_construct(
+                metadata=metadata.model_copy(update={"message_count": metadata.message_count + 1}),
+                messages=MessageLog(self._messages),
+                parent=self._current_conversation.parent,
+            )
+            logger.debug("Added {} message to conversation {}", message.role.value, self._current_uuid)
+
+            if self._write_behind:
+                self._pending += 1
+                if self._pending >= settings.history_flush_messages:
+                    self._wake.notify()
+
+        if usage is not None:
+            self._record_usage(usage)
+
+    def _record_usage(self, usage: TokenUsage) -> None:
+        """Add the usage of a message to the rollups.
+
+        Accounting is best-effort: failing to update the rollups must not lose the message, so
+        failures are only logged. `lhammai usage --rebuild` recomputes the rollups from the history.
+
+        Args:
+            usage: The tokens consumed to generate the message
+        """
+        try:
+            self.get_usage_rollups().record(self._current_conversation.metadata.model, usage)
+        except Exception as e:
+            logger.warning("Failed to record token usage for conversation {}: {}", self._current_uuid, e)
 
     def get_current_conversation(self) -> Conversation:
-        """Get the current conversation messages as a list of dictionaries.
+        """Get a snapshot of the current conversation.
 
-        The method returns a copy of the current conversation messages to prevent unintended
-        external modifications to the internal state of the conversation object.
+        The snapshot is immutable and shares its messages with the conversation, so taking it is O(1)
+        and does not wait for writers. Messages added later are not visible through it.
 
         Returns:
-            List of message dictionaries with 'role' and 'content' keys, empty list if no conversation
+            The conversation as it was when the method was called
         """
-        if not self._current_conversation:
+        conversation = self._current_conversation
+        if not conversation:
             raise RuntimeError("No conversation started. Call `ConversationHistory.start_new()` first.")
 
-        with self._lock:
-            return self._current_conversation.model_copy()
+        return conversation.model_copy()
+
+    def get_thread(self) -> list[Message]:
+        """Get every message of the current conversation, including those a fork inherits.
+
+        Returns:
+            The inherited messages followed by the messages of the conversation itself
+        """
+        return [*self._context, *self._current_conversation.messages]
 
     def get_current_uuid(self) -> UUID:
         """Get the UUID of the current conversation.
@@ -223,41 +776,173 @@ class ConversationHistory:
         Returns:
             Dictionary containing conversation metadata, or None if no current conversation
         """
-        if not self._current_conversation:
+        conversation = self._current_conversation
+        if not conversation:
             raise RuntimeError("No conversation started. Call `ConversationHistory.start_new()` first.")
 
-        with self._lock:
-            return self._current_conversation.metadata.model_dump()
+        return conversation.metadata.model_dump()
 
     def save_to_disk(self) -> None:
         """Save the current conversation to disk."""
         if not self._current_conversation:
             raise RuntimeError("No conversation started. Call `ConversationHistory.start_new()` first.")
 
-        with self._lock:
-            self._save_conversation_to_disk(self._current_uuid, self._current_conversation)
+        with self._flush_lock:
+            with self._lock:
+                self._pending = 0
+                conversation = self._current_conversation
+            self._save_conversation_to_disk(self._current_uuid, conversation, fsync=settings.history_fsync == "always")
+
+    def _flush(self, fsync: bool) -> None:
+        """Write the messages added since the last write, if there are any.
+
+        Flushes are serialized, so an older snapshot of the conversation can never overwrite a newer
+        one. Snapshots are immutable, so they are written without the lock and adding messages does
+        not wait for the disk.
+        """
+        with self._flush_lock:
+            with self._lock:
+                if not self._pending or not self._current_conversation:
+                    return
+                conversation = self._current_conversation
+                pending, self._pending = self._pending, 0
+
+            try:
+                self._save_conversation_to_disk(self._current_uuid, conversation, fsync=fsync)
+            except Exception:
+                with self._lock:
+                    self._pending += pending
+                raise
+
+    def _flush_loop(self) -> None:
+        """Write the pending messages every flush interval, or earlier when enough of them accumulate."""
+        while True:
+            with self._lock:
+                if not self._closed and self._pending < settings.history_flush_messages:
+                    self._wake.wait(timeout=settings.history_flush_interval)
+                if self._closed:
+                    return
+
+            try:
+                self._flush(fsync=settings.history_fsync == "always")
+            except Exception as e:
+                logger.error("Background flush of conversation {} failed, will retry: {}", self._current_uuid, e)
+
+    def flush(self) -> None:
+        """Write the messages added since the last write, without waiting for the background flusher."""
+        self._flush(fsync=settings.history_fsync == "always")
+
+    def close(self) -> None:
+        """Stop the background flusher and write any pending messages.
+
+        Safe to call more than once, and a no-op for histories that are not in write-behind mode.
+        """
+        if not self._write_behind:
+            return
 
-    def _save_conversation_to_disk(self, conversation_uuid: UUID, conversation: Conversation) -> None:
+        with self._lock:
+            self._closed = True
+            self._wake.notify()
+        _write_behind_histories.discard(self)
+        if self._flusher is not None and self._flusher is not threading.current_thread():
+            self._flusher.join()
+        self._flush(fsync=settings.history_fsync != "never")
+
+    def __enter__(self) -> "ConversationHistory":
+        """Use the history as a context manager that closes it on exit."""
+        return self
+
+    def __exit__(self, *exc_info: object) -> None:
+        """Flush the pending messages and stop the background flusher."""
+        self.close()
+
+    def _save_conversation_to_disk(
+        self, conversation_uuid: UUID, conversation: Conversation, fsync: bool = False
+    ) -> None:
         """Save a specific conversation to disk.
 
         Args:
             conversation_uuid: UUID of the conversation
             conversation: Conversation object to save
+            fsync: Whether to wait for the data to reach the disk
         """
         try:
-            # Load existing history
-            existing_history = self.load_history_from_disk()
+            with locked(_history_lock()):
+                # Load existing history
+                existing_history = self.load_history_from_disk()
 
-            # Add/update conversation
-            existing_history[str(conversation_uuid)] = conversation
+                # Add/update conversation
+                existing_history[str(conversation_uuid)] = conversation
 
-            # Save back to disk using Pydantic serialization
-            history_file = HistoryFile(root=existing_history)
-            with HISTORY_FILE.open("w", encoding="utf-8") as f:
-                json.dump(history_file.model_dump(), f, indent=2, ensure_ascii=False, default=str)
+                # Save back to disk using Pydantic serialization
+                self._write_history_file(existing_history, fsync=fsync)
 
-            logger.debug(f"Saved conversation {conversation_uuid} to disk")
+            logger.debug("Saved conversation {} to disk", conversation_uuid)
 
         except Exception as e:
-            logger.error(f"Failed to save conversation to disk: {e}")
+            logger.error("Failed to save conversation to disk: {}", e)
             raise
+
+        if settings.semantic_index:
+            self._index_conversation(conversation_uuid, conversation)
+
+    @classmethod
+    def _write_history_file(cls, history: dict[str, Conversation], fsync: bool = False) -> None:
+        """Replace the history file, moving large message bodies to the blob store.
+
+        Writing a temporary file and replacing the history with it means an interrupted write never
+        leaves a truncated history behind. The blob reference counts are updated afterwards. Called
+        with the history lock held, see `_history_lock`.
+
+        Args:
+            history: Conversations keyed by UUID
+            fsync: Whether to wait for the data to reach the disk
+        """
+        blobs = cls.get_blob_store()
+        data = HistoryFile(root=history).model_dump(context={"blobs": blobs})
+        temp_file = temp_path(HISTORY_FILE)
+        with temp_file.open("w", encoding="utf-8") as f:
+            json.dump(data, f, indent=2, ensure_ascii=False, default=str)
+            if fsync:
+                f.flush()
+                os.fsync(f.fileno())
+        temp_file.replace(HISTORY_FILE)
+        blobs.set_refcounts(_count_blob_refs(data))
+
+    @classmethod
+    def _reindex_conversations(cls, deleted_uuid: str, forks: dict[str, Conversation]) -> None:
+        """Drop a deleted conversation and its reparented forks from the semantic index.
+
+        Reparenting moves inherited messages to the front of the forks, which shifts the message
+        index their entries are keyed by, so these are dropped too. They are indexed again right
+        away when `SEMANTIC_INDEX` is set, and otherwise by the next `lhammai history index`.
+        Failures are only logged, as the history itself is already up to date.
+
+        Args:
+            deleted_uuid: UUID of the deleted conversation
+            forks: The reparented forks, keyed by UUID
+        """
+        if not (HISTORY_FILE.parent / "index").exists():
+            return
+        try:
+            vector_index = cls.get_vector_index()
+            vector_index.remove({deleted_uuid, *forks})
+            if settings.semantic_index and forks:
+                vector_index.index_conversations(forks, settings.api_base)
+        except Exception as e:
+            logger.warning("Failed to update the semantic index after deleting {}: {}", deleted_uuid, e)
+
+    def _index_conversation(self, conversation_uuid: UUID, conversation: Conversation) -> None:
+        """Add the new messages of a conversation to the semantic index.
+
+        Indexing is best-effort: a missing embedding model or unreachable endpoint must not lose the
+        conversation, which is already on disk, so failures are only logged.
+
+        Args:
+            conversation_uuid: UUID of the conversation
+            conversation: Conversation object to index
+        """
+        try:
+            self.get_vector_index().index_conversations({str(conversation_uuid): conversation}, settings.api_base)
+        except Exception as e:
+            logger.warning("Failed to index conversation {}: {}", conversation_uuid, e)
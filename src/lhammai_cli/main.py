@@ -1,26 +1,593 @@
+import csv
+import json
 import sys
+import threading
+from collections.abc import Iterator
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
+from contextlib import nullcontext
+from datetime import date, datetime, timedelta
+from enum import Enum
+from pathlib import Path
+from typing import NamedTuple, TextIO
+from uuid import UUID
 
 import click
+from any_llm.types.completion import CompletionUsage
+from halo import Halo
 from rich.console import Console
 from rich.markdown import Markdown
 from rich.panel import Panel
+from rich.table import Table
 
+from lhammai_cli.blob_store import GC_MIN_AGE
 from lhammai_cli.history import ConversationHistory
-from lhammai_cli.schema import Role
-from lhammai_cli.settings import settings
-from lhammai_cli.utils import get_llm_response
+from lhammai_cli.response_cache import ResponseCache
+from lhammai_cli.schema import Conversation, Message, Role, TokenUsage
+from lhammai_cli.settings import APP_DIR, settings
+from lhammai_cli.usage import UsageTotals
+from lhammai_cli.utils import (
+    AdaptiveLimiter,
+    Cassette,
+    GenerationCancelledError,
+    LimiterStore,
+    SingleFlight,
+    Slot,
+    get_embeddings,
+    get_llm_response,
+    is_model_loaded,
+    load_context,
+    logger,
+    preload_model,
+)
+from lhammai_cli.utils.ollama_utils import PRELOAD_TIMEOUT, REFRESH_TIMEOUT
 
 console = Console()
+err_console = Console(stderr=True)
+# Identical requests in flight, from this or other processes, are sent once
+single_flight = SingleFlight(APP_DIR / "inflight") if settings.coalesce_requests else None
+# The concurrency limit and latency baselines of each host, carried over between runs
+limiter_store = LimiterStore(APP_DIR / "limits.json")
 
 
-@click.command
+class OutputMode(Enum):
+    """Defines how responses are written to stdout."""
+
+    RICH = "rich"
+    RAW = "raw"
+    JSON = "json"
+
+
+def _output_mode(raw: bool, as_json: bool) -> OutputMode:
+    """Pick the output mode; plain text is the default when stdout is not a terminal."""
+    if as_json:
+        return OutputMode.JSON
+    if raw or not sys.stdout.isatty():
+        return OutputMode.RAW
+    return OutputMode.RICH
+
+
+def _print_error(message: str, mode: OutputMode) -> None:
+    """Print an error, keeping it out of stdout unless the output is decorated."""
+    (console if mode is OutputMode.RICH else err_console).print(message)
+
+
+def _write_token(token: str) -> None:
+    """Write a piece of streamed text straight to stdout."""
+    click.echo(token, nl=False)
+
+
+def _resolve_targets(models: tuple[str, ...], api_bases: tuple[str, ...]) -> list[tuple[str, str]]:
+    """Pair the requested models with the requested API endpoints.
+
+    A single model is sent to every endpoint, a single endpoint serves every model, and
+    otherwise models and endpoints are paired positionally.
+
+    Args:
+        models: The models passed with `--model`.
+        api_bases: The endpoints passed with `--api-base`.
+
+    Returns:
+        A list of `(model, api_base)` pairs to query.
+
+    Raises:
+        click.UsageError: If models and endpoints cannot be paired.
+    """
+    if len(api_bases) == 1:
+        return [(model, api_bases[0]) for model in models]
+    if len(models) == 1:
+        return [(models[0], api_base) for api_base in api_bases]
+    if len(models) == len(api_bases):
+        return list(zip(models, api_bases, strict=True))
+
+    raise click.UsageError("Pass a single --api-base, a single --model, or the same number of each.")
+
+
+def _print_response(response: str, title: str) -> None:
+    """Render an LLM response as a Markdown panel."""
+    response_panel = Panel(Markdown(response), title=title, title_align="left", border_style="cyan", padding=(1, 1))
+    console.print(response_panel)
+
+
+def _print_json(response: str, model: str, api_base: str, history: ConversationHistory) -> None:
+    """Write an LLM response as a single JSON line."""
+    conversation = history.get_current_conversation()
+    message = conversation.messages[-1]
+    record = {
+        "conversation_uuid": str(history.get_current_uuid()),
+        "model": model,
+        "api_base": api_base,
+        "cold_start": history.get_current_metadata()["cold_start"],
+        "cached": history.get_current_metadata()["cached"],
+        "usage": message.usage.model_dump() if message.usage else None,
+        "truncated": message.truncated,
+        "parent": conversation.parent.model_dump() if conversation.parent else None,
+        "content": response,
+    }
+    click.echo(json.dumps(record, ensure_ascii=False))
+
+
+def _model_state(cold_start: bool | None, cached: bool = False) -> str:
+    """Describe whether a model was already loaded, or whether it was not asked at all."""
+    if cached:
+        return " [magenta](cached)[/magenta]"
+    if cold_start is None:
+        return ""
+    return " [yellow](cold start)[/yellow]" if cold_start else " [green](warm)[/green]"
+
+
+def _truncation_state(truncated: bool) -> str:
+    """Flag a response that was cut short by a timeout or by the user."""
+    return " [red](truncated)[/red]" if truncated else ""
+
+
+def _open_cache() -> ResponseCache:
+    """Open the response cache with the configured embedding model and limits."""
+    return ResponseCache(
+        APP_DIR / "cache",
+        settings.embedding_model,
+        settings.api_base,
+        threshold=settings.cache_threshold,
+        max_entries=settings.cache_max_entries,
+        mask_ids=settings.cache_mask_ids,
+    )
+
+
+def _cache_get(cache: ResponseCache | None, prompt: str, model: str) -> str | None:
+    """Look up a cached answer; the cache is an optimization, so failures count as misses."""
+    if cache is None:
+        return None
+    try:
+        return cache.get(prompt, model)
+    except Exception as e:
+        logger.warning("Response cache lookup failed: {}", e)
+        return None
+
+
+def _cache_put(cache: ResponseCache | None, prompt: str, model: str, response: str | None) -> None:
+    """Store an answer in the response cache, ignoring failures."""
+    if cache is None or not response:
+        return
+    try:
+        cache.put(prompt, model, response)
+    except Exception as e:
+        logger.warning("Failed to store response in cache: {}", e)
+
+
+def _probe_cold_start(model: str, api_base: str) -> bool | None:
+    """Return whether the model has to be loaded before it can answer, if that can be determined."""
+    loaded = is_model_loaded(model, api_base)
+    return None if loaded is None else not loaded
+
+
+def _refresh_keep_alive(
+    model: str, api_base: str, keep_alive: str | None, warm_up: threading.Thread | None = None
+) -> None:
+    """Keep the model resident after a request; each request resets the expiry to the server default.
+
+    Only called after complete answers: refreshing after an interrupted or timed-out request would
+    reload a model the user just gave up on. A warm-up of the model still running is waited for,
+    briefly, as the model that just answered is loaded, so that the refresh is sent last.
+    """
+    if not keep_alive:
+        return
+    if warm_up is not None:
+        warm_up.join(REFRESH_TIMEOUT)
+    try:
+        preload_model(model, api_base, keep_alive, timeout=REFRESH_TIMEOUT)
+    except Exception as e:
+        logger.warning("Failed to refresh keep-alive for {} at {}: {}", model, api_base, e)
+
+
+def _warm_up(targets: list[tuple[str, str]], keep_alive: str | None) -> dict[tuple[str, str], threading.Thread]:
+    """Start loading the models that are not resident yet, in the background.
+
+    Used while stdin is read, so a model loads while the upstream command is still producing the
+    input instead of after it. The threads are daemons and are never waited for, except briefly
+    by `_refresh_keep_alive`, so an interrupted or timed-out request exits at once.
+
+    Returns:
+        The warm-up thread of each `(model, api_base)` target
+    """
+
+    def warm(model: str, api_base: str) -> None:
+        if is_model_loaded(model, api_base) is not False:
+            return  # loaded already, or not an Ollama endpoint
+        try:
+            preload_model(model, api_base, keep_alive, timeout=PRELOAD_TIMEOUT)
+        except Exception as e:
+            logger.debug("Failed to preload {} at {}: {}", model, api_base, e)
+
+    threads = {
+        target: threading.Thread(target=warm, args=target, name=f"warm-up-{target[0]}", daemon=True)
+        for target in dict.fromkeys(targets)
+    }
+    for thread in threads.values():
+        thread.start()
+    return threads
+
+
+class Fork(NamedTuple):
+    """A stored conversation to continue, and the messages kept from it."""
+
+    uuid: UUID
+    message_count: int
+    thread: list[Message]
+
+
+def _parse_fork(ctx: click.Context, param: click.Parameter, value: str | None) -> tuple[UUID, int] | None:
+    """Parse a `UUID:N` fork point."""
+    if value is None:
+        return None
+    uuid_str, _, message_count = value.rpartition(":")
+    try:
+        uuid, count = UUID(uuid_str), int(message_count)
+    except ValueError:
+        raise click.BadParameter("expected UUID:N, e.g. 0b6f…:2 to keep the first two messages") from None
+    if count < 0:
+        raise click.BadParameter("the number of messages to keep cannot be negative")
+    return uuid, count
+
+
+def _start_conversation(
+    model: str, api_base: str, fork: Fork | None, cold_start: bool | None, cached: bool
+) -> ConversationHistory:
+    """Start a new conversation, or a new branch of a stored one."""
+    if fork is None:
+        return ConversationHistory.start_new(model, api_base, cold_start=cold_start, cached=cached)
+    return ConversationHistory.fork(
+        fork.uuid, fork.message_count, model, api_base, cold_start=cold_start, cached=cached, thread=fork.thread
+    )
+
+
+def _llm_context(fork: Fork | None) -> list[dict[str, str]] | None:
+    """Convert the messages kept from a forked conversation to the messages sent before the prompt."""
+    if fork is None:
+        return None
+    return [{"role": m.role.value, "content": m.content} for m in fork.thread[: fork.message_count]]
+
+
+class QueryResult(NamedTuple):
+    """The outcome of querying one model."""
+
+    response: str | None
+    cold_start: bool | None
+    cached: bool
+    usage: TokenUsage | None
+    truncated: bool = False
+
+
+def _replaying(cassette: Cassette | None) -> bool:
+    """Return whether responses are replayed, so the endpoint must not be contacted."""
+    return cassette is not None and cassette.mode == "replay"
+
+
+def _token_usage(usage: CompletionUsage | None) -> TokenUsage | None:
+    """Convert the usage reported by the provider to the history schema."""
+    if usage is None:
+        return None
+    return TokenUsage(prompt_tokens=usage.prompt_tokens, completion_tokens=usage.completion_tokens)
+
+
+def _query(
+    prompt: str,
+    model: str,
+    api_base: str,
+    keep_alive: str | None,
+    cache: ResponseCache | None,
+    timeout: float | None = None,
+    cancel_event: threading.Event | None = None,
+    context: list[dict[str, str]] | None = None,
+    cassette: Cassette | None = None,
+    limiter: AdaptiveLimiter | None = None,
+    warm_up: threading.Thread | None = None,
+) -> QueryResult:
+    """Query a model without a spinner, reporting how the response was obtained.
+
+    A response cut short by the timeout or the cancel event is returned as far as it was generated.
+    With a limiter, the request waits for a slot, and its time to the first token adjusts the limit.
+    """
+    cached_response = _cache_get(cache, prompt, model)
+    if cached_response is not None:
+        return QueryResult(cached_response, None, True, None)
+
+    cold_start = None if _replaying(cassette) else _probe_cold_start(model, api_base)
+    parts: list[str] = []
+    usages: list[CompletionUsage] = []
+    truncated = False
+    with limiter.acquire(model, cancel_event) if limiter else nullcontext(Slot(model)) as slot:
+        # Loading the model says nothing about how busy the server is
+        slot.sample = not cold_start
+
+        def on_token(token: str) -> None:
+            slot.first_token()
+            parts.append(token)
+
+        def on_shared() -> None:
+            # The response of another request says nothing about how this one was served
+            slot.sample = False
+
+        try:
+            response = get_llm_response(
+                prompt,
+                model,
+                api_base,
+                show_spinner=False,
+                on_token=on_token,
+                on_usage=usages.append,
+                timeout=timeout,
+                cancel_event=cancel_event,
+                context=context,
+                cassette=cassette,
+                single_flight=single_flight,
+                on_shared=on_shared,
+            )
+        except (TimeoutError, GenerationCancelledError):
+            if not parts:
+                raise
+            response, truncated = "".join(parts), True
+
+    if not truncated:
+        _refresh_keep_alive(model, api_base, keep_alive, warm_up)
+        _cache_put(cache, prompt, model, response)
+    return QueryResult(response, cold_start, False, _token_usage(usages[-1] if usages else None), truncated)
+
+
+def _report_result(
+    prompt: str, model: str, api_base: str, future: Future[QueryResult], mode: OutputMode, fork: Fork | None
+) -> None:
+    """Store and render the outcome of querying one model."""
+    try:
+        result = future.result()
+        if result.response:
+            history = _start_conversation(model, api_base, fork, result.cold_start, result.cached)
+            history.add_message(Role.USER, prompt)
+            history.add_message(Role.ASSISTANT, result.response, usage=result.usage, truncated=result.truncated)
+            history.save_to_disk()
+
+            if mode is OutputMode.JSON:
+                _print_json(result.response, model, api_base, history)
+            elif mode is OutputMode.RAW:
+                click.echo(f"# {model}{' (truncated)' if result.truncated else ''}\n\n{result.response}\n")
+            else:
+                state = _model_state(result.cold_start, result.cached) + _truncation_state(result.truncated)
+                _print_response(result.response, f"🤖 {model}{state}")
+        else:
+            _print_error(f"❌ LLM response: [red]No response received from {model}[/red]\n", mode)
+    except Exception as e:
+        _print_error(f"❌ An error occurred with [cyan]'{model}'[/cyan]: [red]{e}[/red]\n", mode)
+
+
+def _concurrency_state(limiters: dict[str, AdaptiveLimiter]) -> str:
+    """Describe the concurrency limits of the fan-out hosts, and the requests waiting for them."""
+    queued = sum(limiter.queue_depth for limiter in limiters.values())
+    for api_base, limiter in limiters.items():
+        logger.bind(api_base=api_base, limit=limiter.limit, queue_depth=limiter.queue_depth).debug(
+            "{} requests running on {} (limit {})", limiter.in_flight, api_base, limiter.limit
+        )
+    if not queued:
+        return ""
+    limits = ", ".join(str(limiter.limit) for limiter in limiters.values())
+    return f" ({queued} queued, limit {limits})"
+
+
+def _fan_out(
+    prompt: str,
+    targets: list[tuple[str, str]],
+    mode: OutputMode,
+    keep_alive: str | None,
+    cache: ResponseCache | None,
+    timeout: float | None = None,
+    fork: Fork | None = None,
+    cassette: Cassette | None = None,
+    warm_ups: dict[tuple[str, str], threading.Thread] | None = None,
+) -> bool:
+    """Send the same prompt to several models concurrently.
+
+    Each response is rendered as soon as it arrives and stored as its own conversation. Requests to
+    the same host share an adaptive concurrency limit, so a host is not overloaded by many models
+    at once. The limit starts from where the previous run left it, with the latencies that run
+    observed as the baselines, as a single run rarely sends a model more than one request. On
+    Ctrl-C the requests still running, or waiting for a slot, are cancelled, and what they
+    generated so far is stored as well.
+
+    Args:
+        prompt: The prompt to send.
+        targets: The `(model, api_base)` pairs to query.
+        mode: How to write the responses.
+        keep_alive: How long Ollama should keep each model loaded after answering.
+        cache: The response cache to consult before querying, if enabled.
+        timeout: Deadline for each request in seconds.
+        fork: The stored conversation each answer continues, if any.
+        cassette: The cassette to record the responses to, or to replay them from.
+        warm_ups: The threads loading the models in the background, see `_warm_up`.
+
+    Returns:
+        Whether the requests were interrupted with Ctrl-C.
+    """
+    if mode is OutputMode.RICH:
+        console.print(f"\n✨ Sending prompt to [cyan]{len(targets)}[/cyan] models\n")
+        for model, api_base in targets:
+            console.print(f"   • [cyan]'{model}'[/cyan] at [cyan]'{api_base}'[/cyan]")
+        console.print()
+
+    spinner = Halo(text="🤖 Thinking...", spinner="dots", color="cyan", enabled=mode is OutputMode.RICH)
+
+    cancel_event = threading.Event()
+    limiters = {api_base: AdaptiveLimiter(settings.concurrency, settings.max_concurrency) for _, api_base in targets}
+    # Replayed latencies say nothing about the hosts
+    persist_limits = not _replaying(cassette)
+    if persist_limits:
+        for api_base, limiter in limiters.items():
+            limiter_store.restore(api_base, limiter)
+
+    with ThreadPoolExecutor(max_workers=len(targets)) as executor:
+        context = _llm_context(fork)
+        futures: dict[Future[QueryResult], tuple[str, str]] = {}
+        for model, api_base in targets:
+            future = executor.submit(
+                _query,
+                prompt,
+                model,
+                api_base,
+                keep_alive,
+                cache,
+                timeout,
+                cancel_event,
+                context,
+                cassette,
+                limiters[api_base],
+                (warm_ups or {}).get((model, api_base)),
+            )
+            futures[future] = (model, api_base)
+        pending = set(futures)
+        spinner.start()
+        try:
+            for future in as_completed(futures):
+                pending.discard(future)
+                spinner.stop()
+                _report_result(prompt, *futures[future], future, mode, fork)
+                spinner.text = f"🤖 Thinking...{_concurrency_state(limiters)}"
+                spinner.start()
+        except KeyboardInterrupt:
+            # The workers notice the event within a poll interval and hand back their partial responses
+            cancel_event.set()
+            spinner.stop()
+            for future in as_completed(pending):
+                _report_result(prompt, *futures[future], future, mode, fork)
+            return True
+        finally:
+            spinner.stop()
+            if persist_limits:
+                _save_limits(limiters)
+    return False
+
+
+def _save_limits(limiters: dict[str, AdaptiveLimiter]) -> None:
+    """Store the state of each host's limiter for the next run, logging failures."""
+    for api_base, limiter in limiters.items():
+        try:
+            limiter_store.save(api_base, limiter)
+        except OSError as e:
+            logger.warning("Failed to store the concurrency limit of {}: {}", api_base, e)
+
+
+@click.group(invoke_without_command=True)
 @click.option("--prompt", "-p", help="Prompt to send to the LLM")
-@click.option("--model", "-m", default=settings.model, help="LLM model to use")
-@click.option("--api-base", default=settings.api_base, help="Host to connect to")
-def main(prompt: str | None, model: str, api_base: str) -> None:
+@click.option(
+    "--model", "-m", "models", multiple=True, default=[settings.model], help="LLM model to use (repeat to fan out)"
+)
+@click.option(
+    "--api-base", "api_bases", multiple=True, default=[settings.api_base], help="Host to connect to (repeatable)"
+)
+@click.option("--raw", is_flag=True, help="Stream plain text to stdout (default when stdout is not a terminal)")
+@click.option("--json", "as_json", is_flag=True, help="Write each response as a JSON line")
+@click.option(
+    "--keep-alive", default=settings.keep_alive, help="Keep Ollama models loaded for this long, e.g. '30m' or '-1'"
+)
+@click.option(
+    "--cache/--no-cache", "use_cache", default=settings.response_cache, help="Reuse answers to near-identical prompts"
+)
+@click.option("--file", "-f", "files", multiple=True, help="File, directory or glob pattern to add to the prompt")
+@click.option(
+    "--context-budget",
+    default=settings.context_budget,
+    show_default=True,
+    type=click.IntRange(min=1),
+    help="Maximum number of tokens taken by the files",
+)
+@click.option(
+    "--timeout",
+    default=settings.request_timeout,
+    type=click.FloatRange(min=0, min_open=True),
+    help="Stop waiting for a response after this many seconds, keeping what was generated",
+)
+@click.option(
+    "--fork",
+    "fork_point",
+    callback=_parse_fork,
+    metavar="UUID:N",
+    help="Continue a stored conversation after its first N messages, as a new branch",
+)
+@click.option(
+    "--record",
+    "record_dir",
+    type=click.Path(file_okay=False, path_type=Path),
+    help="Record the responses, with their timing, to cassettes in this directory",
+)
+@click.option(
+    "--replay",
+    "replay_dir",
+    type=click.Path(exists=True, file_okay=False, path_type=Path),
+    help="Replay responses recorded with --record instead of querying the provider",
+)
+@click.option(
+    "--replay-speed",
+    default=1.0,
+    show_default=True,
+    type=click.FloatRange(min=0),
+    help="Replay this many times faster than recorded, 0 for no delays",
+)
+@click.pass_context
+def main(
+    ctx: click.Context,
+    prompt: str | None,
+    models: tuple[str, ...],
+    api_bases: tuple[str, ...],
+    raw: bool,
+    as_json: bool,
+    keep_alive: str | None,
+    use_cache: bool,
+    files: tuple[str, ...],
+    context_budget: int,
+    timeout: float | None,
+    fork_point: tuple[UUID, int] | None,
+    record_dir: Path | None,
+    replay_dir: Path | None,
+    replay_speed: float,
+) -> None:
     """Interact with any LLM."""
+    if ctx.invoked_subcommand is not None:
+        return
+    if record_dir and replay_dir:
+        raise click.UsageError("Pass either --record or --replay, not both.")
+
+    cassette = None
+    if record_dir:
+        cassette = Cassette(record_dir, "record")
+    elif replay_dir:
+        cassette = Cassette(replay_dir, "replay", speed=replay_speed)
+        # Replays work without a running endpoint, so nothing else may contact it
+        keep_alive, use_cache = None, False
+
+    targets = _resolve_targets(models, api_bases)
+    mode = _output_mode(raw, as_json)
+
     stdin_content = ""
+    warm_ups: dict[tuple[str, str], threading.Thread] = {}
     if not sys.stdin.isatty():
+        # Load the models while the producer is still writing; the cache may answer without them
+        if not use_cache and not _replaying(cassette):
+            warm_ups = _warm_up(targets, keep_alive)
         stdin_content = sys.stdin.read().strip()
 
     if stdin_content and prompt:
@@ -30,25 +597,450 @@ def main(prompt: str | None, model: str, api_base: str) -> None:
     elif prompt:
         final_prompt = prompt
     else:
-        console.print("\n❌ Error: [red]No input provided. Use -p/--prompt option or pipe content to stdin[/red]")
+        final_prompt = ""
+
+    if files:
+        try:
+            context = load_context(files, context_budget)
+        except OSError as e:
+            _print_error(f"\n❌ Error: [red]{e}[/red]", mode)
+            sys.exit(1)
+
+        if mode is OutputMode.RICH:
+            console.print(
+                f"\n📎 Attached [cyan]{context.files}[/cyan] files (~{context.tokens:,} tokens), "
+                f"{context.truncated} truncated, {context.duplicates} duplicates skipped"
+            )
+        final_prompt = f"{final_prompt}\n\n{context.text}" if final_prompt else context.text
+
+    if not final_prompt:
+        _print_error(
+            "\n❌ Error: [red]No input provided. Use -p/--prompt or -f/--file, or pipe content to stdin[/red]", mode
+        )
         sys.exit(1)
 
-    console.print(f"\n✨ Connected to [cyan]'{model}'[/cyan] at [cyan]'{api_base}'[/cyan]\n")
+    fork = None
+    if fork_point is not None:
+        uuid, message_count = fork_point
+        try:
+            thread = ConversationHistory.load_thread(uuid)
+        except ValueError as e:
+            _print_error(f"\n❌ Error: [red]{e}[/red]", mode)
+            sys.exit(1)
+        if message_count > len(thread):
+            _print_error(f"\n❌ Error: [red]Conversation {uuid} only has {len(thread)} messages[/red]", mode)
+            sys.exit(1)
+        fork = Fork(uuid, message_count, thread)
+        if mode is OutputMode.RICH:
+            console.print(f"\n🌿 Forking [cyan]{uuid}[/cyan] after {message_count} of {len(thread)} messages")
+
+    cache = None
+    # Cached answers were given without the messages of a forked conversation
+    if use_cache and fork is None:
+        try:
+            cache = _open_cache()
+        except ImportError as e:
+            _print_error(f"\n⚠️  Response cache disabled: [yellow]{e}[/yellow]", mode)
+
+    if len(targets) > 1:
+        interrupted = _fan_out(final_prompt, targets, mode, keep_alive, cache, timeout, fork, cassette, warm_ups)
+        if interrupted:
+            sys.exit(130)
+        return
+
+    model, api_base = targets[0]
+    cached_response = _cache_get(cache, final_prompt, model)
+    cached = cached_response is not None
+    cold_start = None if cached or _replaying(cassette) else _probe_cold_start(model, api_base)
+    if mode is OutputMode.RICH:
+        state = _model_state(cold_start, cached)
+        console.print(f"\n✨ Connected to [cyan]'{model}'[/cyan] at [cyan]'{api_base}'[/cyan]{state}\n")
 
     # Initialize conversation history
-    history = ConversationHistory.start_new(model, api_base)
+    history = _start_conversation(model, api_base, fork, cold_start, cached)
+    streamed: list[str] = []
+    usages: list[CompletionUsage] = []
+    interrupted = False
+    truncated = False
+    answered = False
     try:
         history.add_message(Role.USER, final_prompt)
-        response = get_llm_response(final_prompt, model, api_base)
+        if cached:
+            response = cached_response
+        else:
+
+            def on_token(token: str) -> None:
+                streamed.append(token)
+                if mode is OutputMode.RAW:
+                    _write_token(token)
+
+            # The response is always streamed, so a timeout or Ctrl-C keeps what was generated so far
+            try:
+                with Halo(text="🤖 Thinking...", spinner="dots", color="cyan", enabled=mode is OutputMode.RICH):
+                    response = get_llm_response(
+                        final_prompt,
+                        model,
+                        api_base,
+                        show_spinner=False,
+                        on_token=on_token,
+                        on_usage=usages.append,
+                        timeout=timeout,
+                        context=_llm_context(fork),
+                        cassette=cassette,
+                        single_flight=single_flight,
+                    )
+            except KeyboardInterrupt:
+                interrupted = True
+                response, truncated = "".join(streamed) or None, True
+            except TimeoutError:
+                if not streamed:
+                    raise
+                response, truncated = "".join(streamed), True
+            answered = not truncated
+
         if response:
-            history.add_message(Role.ASSISTANT, response)
+            history.add_message(
+                Role.ASSISTANT, response, usage=_token_usage(usages[-1] if usages else None), truncated=truncated
+            )
             history.save_to_disk()
+            if not cached and not truncated:
+                _cache_put(cache, final_prompt, model, response)
 
-            response_panel = Panel(
-                Markdown(response), title="🤖 Assistant", title_align="left", border_style="cyan", padding=(1, 1)
-            )
-            console.print(response_panel)
+            if mode is OutputMode.JSON:
+                _print_json(response, model, api_base, history)
+            elif mode is OutputMode.RAW:
+                # Providers that ignore streaming hand back the whole answer at once
+                click.echo("" if streamed else response)
+            else:
+                _print_response(response, f"🤖 Assistant{_truncation_state(truncated)}")
+
+            if truncated:
+                reason = "Interrupted" if interrupted else f"Timed out after {timeout:g} seconds"
+                _print_error(f"\n⚠️  {reason}, the partial response was saved", mode)
+        elif interrupted:
+            _print_error("\n❌ Interrupted before the model responded", mode)
         else:
-            console.print(f"\n❌ LLM response: [red]No response received from {model}[/red]")
+            _print_error(f"\n❌ LLM response: [red]No response received from {model}[/red]", mode)
     except Exception as e:
-        console.print(f"\n❌ An error occurred: [red]{e}[/red]")
+        _print_error(f"\n❌ An error occurred: [red]{e}[/red]", mode)
+    finally:
+        if answered:
+            _refresh_keep_alive(model, api_base, keep_alive, warm_ups.get((model, api_base)))
+
+    if interrupted:
+        sys.exit(130)
+
+
+@main.command()
+@click.option("--model", "-m", "models", multiple=True, default=[settings.model], help="LLM model to preload")
+@click.option("--api-base", "api_bases", multiple=True, default=[settings.api_base], help="Host to connect to")
+@click.option(
+    "--keep-alive", default=settings.keep_alive, help="Keep the models loaded for this long, e.g. '30m' or '-1'"
+)
+def warm(models: tuple[str, ...], api_bases: tuple[str, ...], keep_alive: str | None) -> None:
+    """Preload models on their Ollama endpoints and keep them resident."""
+    failed = False
+    for model, api_base in _resolve_targets(models, api_bases):
+        cold_start = _probe_cold_start(model, api_base)
+        try:
+            load_seconds = preload_model(model, api_base, keep_alive)
+        except Exception as e:
+            console.print(f"❌ Failed to warm [cyan]'{model}'[/cyan] at [cyan]'{api_base}'[/cyan]: [red]{e}[/red]")
+            failed = True
+            continue
+
+        if load_seconds is None:
+            console.print(f"⏭️  Skipped [cyan]'{model}'[/cyan]: preloading is only supported for Ollama")
+            continue
+
+        residency = f" for [cyan]{keep_alive}[/cyan]" if keep_alive else ""
+        loaded = f" in {load_seconds:.2f}s" if cold_start is not False else ""
+        state = _model_state(cold_start)
+        console.print(f"🔥 [cyan]'{model}'[/cyan] is loaded at [cyan]'{api_base}'[/cyan]{residency}{loaded}{state}")
+
+    if failed:
+        sys.exit(1)
+
+
+@main.group(name="history")
+def history_group() -> None:
+    """Search and manage the conversation history."""
+
+
+def _snippet(text: str, width: int = 100) -> str:
+    """Collapse whitespace and shorten text for display."""
+    text = " ".join(text.split())
+    return text if len(text) <= width else f"{text[: width - 1]}…"
+
+
+@history_group.command()
+@click.argument("query")
+@click.option("--semantic", is_flag=True, help="Rank messages by meaning instead of matching keywords")
+@click.option("--top-k", "-k", default=5, show_default=True, help="Maximum number of results")
+def find(query: str, semantic: bool, top_k: int) -> None:
+    """Find messages in the conversation history."""
+    conversations = ConversationHistory.load_history_from_disk()
+
+    if semantic:
+        try:
+            index = ConversationHistory.get_vector_index()
+            query_vector = get_embeddings([query], settings.embedding_model, settings.api_base)[0]
+            results = index.search(query_vector, top_k)
+        except Exception as e:
+            console.print(f"\n❌ Semantic search failed: [red]{e}[/red]")
+            sys.exit(1)
+    else:
+        needle = query.casefold()
+        results = [
+            ((uuid_str, i), 1.0)
+            for uuid_str, conversation in conversations.items()
+            for i, message in enumerate(conversation.messages)
+            if needle in message.content.casefold()
+        ][:top_k]
+
+    table = Table(title=f"🔎 Results for '{query}'", title_justify="left")
+    if semantic:
+        table.add_column("Score", justify="right", style="green")
+    table.add_column("Conversation", style="cyan", no_wrap=True)
+    table.add_column("#", justify="right")
+    table.add_column("Role")
+    table.add_column("Message")
+
+    for (uuid_str, i), score in results:
+        conversation = conversations.get(uuid_str)
+        if conversation is None or i >= len(conversation.messages):
+            continue  # deleted since it was indexed
+        message = conversation.messages[i]
+        # Number messages within the whole thread, as `--fork` does
+        position = i + (conversation.parent.message_count if conversation.parent else 0)
+        row = [uuid_str, str(position), message.role.value, _snippet(message.content)]
+        table.add_row(*([f"{score:.3f}"] if semantic else []), *row)
+
+    if table.row_count == 0:
+        console.print(f"\nNo messages match [cyan]'{query}'[/cyan]")
+        return
+    console.print(table)
+
+
+@history_group.command()
+@click.option("--rebuild", is_flag=True, help="Discard the index and embed every message again")
+def index(rebuild: bool) -> None:
+    """Add stored messages that are not indexed yet to the semantic index."""
+    try:
+        vector_index = ConversationHistory.get_vector_index()
+        if rebuild:
+            vector_index.clear()
+        added = vector_index.index_conversations(ConversationHistory.load_history_from_disk(), settings.api_base)
+    except Exception as e:
+        console.print(f"\n❌ Indexing failed: [red]{e}[/red]")
+        sys.exit(1)
+
+    console.print(f"\n✨ Indexed [cyan]{added}[/cyan] new messages with [cyan]'{settings.embedding_model}'[/cyan]")
+
+
+EXPORT_CSV_COLUMNS = ["conversation_uuid", "model", "api_base", "start_time", "message_index", "role", "content"]
+
+
+@history_group.command()
+@click.option(
+    "--output", "-o", type=click.File("w", encoding="utf-8"), default="-", help="File to write to, stdout by default"
+)
+@click.option(
+    "--format",
+    "-f",
+    "export_format",
+    type=click.Choice(["jsonl", "csv"]),
+    default="jsonl",
+    show_default=True,
+    help="'jsonl' writes one conversation per line, 'csv' one message per row",
+)
+@click.option("--model", "-m", "models", multiple=True, help="Only export conversations with this model")
+@click.option("--since", type=click.DateTime(), help="Only export conversations started at or after this time")
+@click.option("--until", type=click.DateTime(), help="Only export conversations started before this time")
+@click.option("--uuid", "uuids", multiple=True, help="Only export the conversation with this UUID")
+def export(
+    output: TextIO,
+    export_format: str,
+    models: tuple[str, ...],
+    since: datetime | None,
+    until: datetime | None,
+    uuids: tuple[str, ...],
+) -> None:
+    """Export conversations for offline analysis, reading the history one conversation at a time."""
+    writer = None
+    if export_format == "csv":
+        writer = csv.writer(output)
+        writer.writerow(EXPORT_CSV_COLUMNS)
+
+    exported = 0
+    try:
+        for uuid_str, conversation in ConversationHistory.iter_history_from_disk(uuids or None):
+            metadata = conversation.metadata
+            if (
+                (models and metadata.model not in models)
+                or (since and metadata.start_time < since)
+                or (until and metadata.start_time >= until)
+            ):
+                continue
+
+            if writer is None:
+                record = {"uuid": uuid_str, **conversation.model_dump(mode="json")}
+                output.write(json.dumps(record, ensure_ascii=False) + "\n")
+            else:
+                start_time = metadata.start_time.isoformat()
+                # Number messages within the whole thread, as `history find` and `--fork` do
+                offset = conversation.parent.message_count if conversation.parent else 0
+                for i, message in enumerate(conversation.messages, start=offset):
+                    writer.writerow(
+                        [
+                            uuid_str,
+                            metadata.model,
+                            metadata.api_base,
+                            start_time,
+                            i,
+                            message.role.value,
+                            message.content,
+                        ]
+                    )
+            exported += 1
+    except Exception as e:
+        err_console.print(f"\n❌ Export failed: [red]{e}[/red]")
+        sys.exit(1)
+
+    # Report on stderr so the export itself can be piped
+    err_console.print(f"\n✨ Exported [cyan]{exported}[/cyan] conversations")
+
+
+def _read_export(source: TextIO) -> Iterator[tuple[str, Conversation]]:
+    """Read the conversations of a JSONL export one line at a time."""
+    for line_number, line in enumerate(source, start=1):
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+            uuid_str = record.pop("uuid")
+            conversation = Conversation.model_validate(record)
+        except (ValueError, KeyError, AttributeError) as e:
+            raise ValueError(f"Invalid record on line {line_number}: {e}") from e
+        yield uuid_str, conversation
+
+
+@history_group.command(name="import")
+@click.argument("source", type=click.File("r", encoding="utf-8"))
+def import_history(source: TextIO) -> None:
+    """Import conversations from a JSONL export, keeping those already in the history."""
+    try:
+        imported, skipped = ConversationHistory.import_conversations(_read_export(source))
+    except Exception as e:
+        console.print(f"\n❌ Import failed: [red]{e}[/red]")
+        sys.exit(1)
+
+    console.print(
+        f"\n✨ Imported [cyan]{imported}[/cyan] conversations, skipped [cyan]{skipped}[/cyan] already in the history"
+    )
+
+
+@history_group.command()
+@click.option(
+    "--min-age",
+    default=GC_MIN_AGE,
+    show_default=True,
+    type=click.FloatRange(min=0),
+    help="Only remove blobs stored at least this many seconds ago",
+)
+def gc(min_age: float) -> None:
+    """Remove stored message bodies that no conversation references anymore."""
+    try:
+        removed, freed = ConversationHistory.collect_garbage(min_age)
+    except Exception as e:
+        console.print(f"\n❌ Garbage collection failed: [red]{e}[/red]")
+        sys.exit(1)
+
+    console.print(f"\n✨ Removed [cyan]{removed}[/cyan] unreferenced message bodies ({freed:,} bytes)")
+
+
+@main.command()
+@click.option("--days", "-d", default=30, show_default=True, help="Number of days to report, 0 for all")
+@click.option("--model", "-m", default=None, help="Only report this model")
+@click.option("--rebuild", is_flag=True, help="Recompute the rollups from the conversation history first")
+def usage(days: int, model: str | None, rebuild: bool) -> None:
+    """Show the tokens consumed per day and model."""
+    rollups = ConversationHistory.get_usage_rollups()
+    if rebuild:
+        try:
+            requests = rollups.rebuild(ConversationHistory.iter_history_from_disk())
+        except Exception as e:
+            console.print(f"\n❌ Rebuilding the usage rollups failed: [red]{e}[/red]")
+            sys.exit(1)
+        console.print(f"\n✨ Rebuilt the usage rollups from [cyan]{requests}[/cyan] requests")
+
+    since = date.today() - timedelta(days=days - 1) if days > 0 else None
+    rows = rollups.query(since=since, model=model)
+    if not rows:
+        console.print("\nNo token usage recorded for this period")
+        return
+
+    table = Table(title="📊 Token usage", title_justify="left")
+    table.add_column("Day", style="cyan", no_wrap=True)
+    table.add_column("Model", style="cyan")
+    for column in ("Requests", "Prompt", "Completion", "Total", "Max prompt"):
+        table.add_column(column, justify="right")
+
+    total = UsageTotals()
+    for day, day_model, totals in rows:
+        total.merge(totals)
+        table.add_row(day, day_model, *_usage_columns(totals))
+    if len(rows) > 1:
+        table.add_section()
+        table.add_row("Total", "", *_usage_columns(total), style="bold")
+    console.print(table)
+
+
+def _usage_columns(totals: UsageTotals) -> list[str]:
+    """Format usage totals as table cells."""
+    return [
+        f"{totals.requests:,}",
+        f"{totals.prompt_tokens:,}",
+        f"{totals.completion_tokens:,}",
+        f"{totals.prompt_tokens + totals.completion_tokens:,}",
+        f"{totals.max_prompt_tokens:,}",
+    ]
+
+
+@main.group(name="cache")
+def cache_group() -> None:
+    """Inspect and clear the response cache."""
+
+
+@cache_group.command()
+def stats() -> None:
+    """Show the response cache hit rate, size and similarity threshold."""
+    try:
+        cache_stats = _open_cache().stats()
+    except ImportError as e:
+        console.print(f"\n❌ [red]{e}[/red]")
+        sys.exit(1)
+
+    lookups = cache_stats["hits"] + cache_stats["misses"]
+    hit_rate = f"{cache_stats['hits'] / lookups:.1%}" if lookups else "n/a"
+
+    table = Table(title="🗃️  Response cache", title_justify="left", show_header=False)
+    table.add_row("Enabled", "yes" if settings.response_cache else "no (pass --cache or set RESPONSE_CACHE)")
+    table.add_row("Similarity threshold", f"{cache_stats['threshold']:.3f}")
+    table.add_row("Entries", f"{cache_stats['entries']} / {cache_stats['max_entries']}")
+    table.add_row("Hits", str(cache_stats["hits"]))
+    table.add_row("Misses", str(cache_stats["misses"]))
+    table.add_row("Hit rate", hit_rate)
+    console.print(table)
+
+
+@cache_group.command()
+def clear() -> None:
+    """Remove every cached answer and reset the counters."""
+    try:
+        _open_cache().clear()
+    except ImportError as e:
+        console.print(f"\n❌ [red]{e}[/red]")
+        sys.exit(1)
+
+    console.print("\n✨ Cleared the response cache")
@@ -0,0 +1,286 @@
+import hashlib
+import json
+import re
+import threading
+import time
+from pathlib import Path
+
+try:
+    import numpy as np
+
+    PACKAGES_INSTALLED = True
+except ImportError:
+    PACKAGES_INSTALLED = False
+
+from lhammai_cli.utils import get_embeddings, locked, logger, temp_path
+
+# Identifiers and timestamps that may change between otherwise identical requests, masked on request.
+# Plain numbers are never masked: they are usually what the question is about.
+VOLATILE_PATTERNS = [
+    (re.compile(r"\b[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}\b", re.IGNORECASE), "<uuid>"),
+    (
+        re.compile(r"\b\d{4}-\d{2}-\d{2}(?:[ T]\d{2}:\d{2}(?::\d{2}(?:\.\d+)?)?(?:Z|[+-]\d{2}:?\d{2})?)?\b"),
+        "<timestamp>",
+    ),
+    (re.compile(r"\b\d{2}:\d{2}:\d{2}(?:\.\d+)?\b"), "<time>"),
+    (re.compile(r"\b(?=[0-9a-f]*[a-f])[0-9a-f]{12,}\b", re.IGNORECASE), "<hex>"),
+]
+
+
+def normalize_prompt(prompt: str, mask: bool = False) -> str:
+    """Collapse whitespace and, if requested, mask identifiers and timestamps.
+
+    Args:
+        prompt: The prompt to normalize
+        mask: Whether to replace UUIDs, timestamps and hex digests with placeholders
+
+    Returns:
+        The normalized prompt
+    """
+    if mask:
+        for pattern, placeholder in VOLATILE_PATTERNS:
+            prompt = pattern.sub(placeholder, prompt)
+    return " ".join(prompt.split())
+
+
+def _entry_id(entry: dict) -> str:
+    """Identify a cache entry by the model and the normalized prompt it answers."""
+    return hashlib.sha256(f"{entry['model']}\0{entry['prompt']}".encode()).hexdigest()[:16]
+
+
+class ResponseCache:
+    """Bounded cache of answers, looked up by the similarity of the prompt embeddings.
+
+    A prompt that only differs from a cached one for the same model in whitespace is a hit without
+    calling the embedding endpoint. Otherwise the prompt is embedded, after masking identifiers and
+    timestamps if `mask_ids` is set, and the most similar stored prompt for the same model is a hit
+    if its cosine similarity reaches the threshold, so a threshold of 1.0 disables reuse across
+    different prompts. When the cache is full, the least recently used entries are evicted.
+
+    The cache directory holds `entries.json` (prompts and answers), `vectors.npy` (the
+    L2-normalized prompt embeddings, one row per entry), `last_used.json` (when each entry was last
+    a hit) and `stats.json` (hit and miss counters). Reads and writes hold an exclusive lock on
+    `cache.lock`, across threads and processes, and `put` merges its entry into the entries on
+    disk, so concurrent processes never see the two large files out of step nor drop each other's
+    entries. A hit only rewrites the two small files.
+    """
+
+    def __init__(
+        self,
+        directory: Path,
+        embedding_model: str,
+        api_base: str,
+        threshold: float,
+        max_entries: int,
+        mask_ids: bool = False,
+    ):
+        """Initialize the cache.
+
+        Args:
+            directory: Directory holding the cache files
+            embedding_model: The model used to embed prompts
+            api_base: The API endpoint serving the embedding model
+            threshold: Minimum cosine similarity for a cached answer to be reused
+            max_entries: Maximum number of cached answers
+            mask_ids: Whether to mask UUIDs, timestamps and hex digests before embedding prompts, so
+                prompts that only differ in those are as similar as identical ones
+
+        Raises:
+            ImportError: If NumPy is not installed
+        """
+        if not PACKAGES_INSTALLED:
+            raise ImportError(
+                'The response cache requires NumPy. Install it with `pip install "lhammai-cli[semantic]"`.'
+            )
+
+        self._lock = threading.Lock()
+        self.directory = directory
+        self.embedding_model = embedding_model
+        self.api_base = api_base
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.mask_ids = mask_ids
+
+        self._entries_file = directory / "entries.json"
+        self._vectors_file = directory / "vectors.npy"
+        self._stats_file = directory / "stats.json"
+        self._last_used_file = directory / "last_used.json"
+        self._lock_file = directory / "cache.lock"
+
+        self._loaded = False
+        self._entries: list[dict] = []
+        self._vectors: np.ndarray | None = None
+        self._embeddings: dict[str, np.ndarray] = {}
+
+    def _load(self) -> None:
+        """Read the cache from disk on first use."""
+        if self._loaded:
+            return
+
+        with locked(self._lock_file):
+            self._entries, self._vectors = self._read()
+        self._loaded = True
+
+    def _read(self) -> tuple[list[dict], "np.ndarray | None"]:
+        """Read the entries and vectors from disk. Called with the file lock held."""
+        try:
+            with self._entries_file.open(encoding="utf-8") as f:
+                entries = json.load(f)
+            vectors = np.load(self._vectors_file)
+        except (OSError, ValueError):
+            entries, vectors = [], None
+
+        consistent = vectors is not None and len(vectors) == len(entries)
+        if entries and (not consistent or entries[0]["embedding_model"] != self.embedding_model):
+            logger.warning("Discarding a response cache built with another embedding model or left inconsistent")
+            entries, vectors = [], None
+        return entries, vectors
+
+    def _save(self, entries: list[dict], vectors: "np.ndarray | None") -> None:
+        """Write the entries and vectors to disk, replacing the previous files. Called with the file lock held."""
+        temp_vectors = temp_path(self._vectors_file)
+        with temp_vectors.open("wb") as f:
+            np.save(f, vectors if vectors is not None else np.empty((0, 0), dtype=np.float32))
+        temp_entries = temp_path(self._entries_file)
+        with temp_entries.open("w", encoding="utf-8") as f:
+            json.dump(entries, f, ensure_ascii=False)
+
+        temp_vectors.replace(self._vectors_file)
+        temp_entries.replace(self._entries_file)
+
+    @staticmethod
+    def _read_json(path: Path) -> dict:
+        """Read one of the small JSON files of the cache, or return an empty dictionary."""
+        try:
+            with path.open(encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    @staticmethod
+    def _write_json(path: Path, data: dict) -> None:
+        """Replace one of the small JSON files of the cache. Called with the file lock held."""
+        temp_file = temp_path(path)
+        with temp_file.open("w", encoding="utf-8") as f:
+            json.dump(data, f)
+        temp_file.replace(path)
+
+    def _embed(self, prompt: str) -> "np.ndarray":
+        """Embed a prompt, reusing the embedding computed by a previous lookup."""
+        text = normalize_prompt(prompt, self.mask_ids)
+        if text not in self._embeddings:
+            vector = np.asarray(get_embeddings([text], self.embedding_model, self.api_base)[0], dtype=np.float32)
+            self._embeddings[text] = vector / (np.linalg.norm(vector) or 1)
+        return self._embeddings[text]
+
+    def stats(self) -> dict[str, int | float]:
+        """Return the hit and miss counters, the number of entries and the similarity threshold."""
+        with self._lock:
+            self._load()
+            entries = len(self._entries)
+            counters = self._read_json(self._stats_file)
+
+            return {
+                "hits": counters.get("hits", 0),
+                "misses": counters.get("misses", 0),
+                "entries": entries,
+                "max_entries": self.max_entries,
+                "threshold": self.threshold,
+            }
+
+    def _count(self, outcome: str) -> None:
+        """Increment a hit or miss counter on disk. Called with the file lock held."""
+        counters = self._read_json(self._stats_file)
+        counters[outcome] = counters.get(outcome, 0) + 1
+        self._write_json(self._stats_file, counters)
+
+    def _candidates(self, model: str) -> list[int]:
+        """Return the positions of the entries answered by a model."""
+        return [i for i, entry in enumerate(self._entries) if entry["model"] == model]
+
+    def get(self, prompt: str, model: str) -> str | None:
+        """Look up a cached answer for a prompt.
+
+        Args:
+            prompt: The prompt about to be sent
+            model: The model that would answer it
+
+        Returns:
+            The cached answer, or None on a miss
+        """
+        normalized = normalize_prompt(prompt)
+
+        with self._lock:
+            self._load()
+            candidates = self._candidates(model)
+            best = next((self._entries[i] for i in candidates if self._entries[i]["prompt"] == normalized), None)
+
+        if best is None and candidates:
+            # Embed outside the lock so concurrent lookups do not queue behind the endpoint
+            vector = self._embed(prompt)
+            with self._lock:
+                candidates = self._candidates(model)
+                if candidates and self._vectors is not None:
+                    scores = self._vectors[candidates] @ vector
+                    if scores.max() >= self.threshold:
+                        best = self._entries[candidates[int(scores.argmax())]]
+                        logger.debug("Response cache similarity {:.3f} for {}", float(scores.max()), model)
+
+        with locked(self._lock_file):
+            if best is None:
+                self._count("misses")
+                return None
+
+            last_used = self._read_json(self._last_used_file)
+            last_used[_entry_id(best)] = time.time()
+            self._write_json(self._last_used_file, last_used)
+            self._count("hits")
+            return best["answer"]
+
+    def put(self, prompt: str, model: str, answer: str) -> None:
+        """Store an answer, evicting the least recently used entries if the cache is full.
+
+        Args:
+            prompt: The prompt that was sent
+            model: The model that answered it
+            answer: The answer to cache
+        """
+        normalized = normalize_prompt(prompt)
+        vector = self._embed(prompt)
+
+        with self._lock, locked(self._lock_file):
+            # Merge into what is on disk, which other processes may have added to since it was loaded
+            entries, vectors = self._read()
+            entry = {
+                "model": model,
+                "embedding_model": self.embedding_model,
+                "prompt": normalized,
+                "answer": answer,
+                "last_used": time.time(),
+            }
+            entries = [*entries, entry]
+            vectors = vector[None, :] if vectors is None else np.vstack([vectors, vector])
+
+            last_used = self._read_json(self._last_used_file)
+            if len(entries) > self.max_entries:
+
+                def recency(i: int) -> float:
+                    return last_used.get(_entry_id(entries[i]), entries[i]["last_used"])
+
+                keep = sorted(sorted(range(len(entries)), key=recency)[-self.max_entries :])
+                entries = [entries[i] for i in keep]
+                vectors = vectors[keep]
+
+            self._save(entries, vectors)
+            kept = {_entry_id(entry) for entry in entries}
+            self._write_json(self._last_used_file, {key: t for key, t in last_used.items() if key in kept})
+            self._entries, self._vectors, self._loaded = entries, vectors, True
+            self._embeddings.pop(normalize_prompt(prompt, self.mask_ids), None)
+
+    def clear(self) -> None:
+        """Remove every cached answer and reset the counters."""
+        with self._lock, locked(self._lock_file):
+            for path in (self._entries_file, self._vectors_file, self._stats_file, self._last_used_file):
+                path.unlink(missing_ok=True)
+            self._entries, self._vectors = [], None
+            self._embeddings.clear()
@@ -1,8 +1,24 @@
+from collections.abc import Iterator, Sequence
 from datetime import datetime
 from enum import Enum
+from itertools import islice
+from typing import TYPE_CHECKING, Any, overload
 from uuid import UUID
 
-from pydantic import BaseModel, Field, RootModel, field_validator
+from pydantic import (
+    BaseModel,
+    ConfigDict,
+    Field,
+    ModelWrapValidatorHandler,
+    PrivateAttr,
+    RootModel,
+    ValidationInfo,
+    field_validator,
+    model_validator,
+)
+
+if TYPE_CHECKING:
+    from lhammai_cli.blob_store import BlobStore
 
 
 class Role(Enum):
@@ -13,11 +29,64 @@ class Role(Enum):
     ASSISTANT = "assistant"
 
 
+class TokenUsage(BaseModel):
+    """Represents the number of tokens a request consumed."""
+
+    prompt_tokens: int = Field(..., ge=0, description="Number of tokens in the prompt")
+    completion_tokens: int = Field(..., ge=0, description="Number of tokens in the generated response")
+
+
 class Message(BaseModel):
-    """Represents a single message in a conversation."""
+    """Represents a single message in a conversation.
+
+    Large message bodies are kept in a `BlobStore` and the stored message only references them by
+    digest. Pass the store as `context={"blobs": store}` to `model_validate` and `model_dump`: a
+    validated message then reads its body from the store on first access of `content`, and a dumped
+    message references bodies of at least `store.threshold` characters instead of including them.
+    """
+
+    model_config = ConfigDict(frozen=True)
 
     role: Role = Field(..., description="Role of the message sender (user or assistant)")
-    content: str = Field(..., description="Content of the message")
+    content_ref: str | None = Field(
+        default=None, description="Digest of the content in the blob store, if it is kept there"
+    )
+    usage: TokenUsage | None = Field(default=None, description="Tokens consumed to generate the message, if reported")
+    truncated: bool = Field(default=False, description="Whether the generation was cut short by a timeout or the user")
+
+    _content: str | None = PrivateAttr(default=None)
+    _blobs: "BlobStore | None" = PrivateAttr(default=None)
+
+    @model_validator(mode="wrap")
+    @classmethod
+    def validate_content(
+        cls, data: Any, handler: ModelWrapValidatorHandler["Message"], info: ValidationInfo
+    ) -> "Message":
+        """Keep the content of the message, or the blob store to read it from later."""
+        content = data.get("content") if isinstance(data, dict) else None
+        message = handler(data)
+        if isinstance(data, Message):
+            return message
+
+        if content is not None:
+            if not isinstance(content, str):
+                raise ValueError("Content must be a string")
+            message._content = content
+        elif message.content_ref is None:
+            raise ValueError("A message needs either content or a content_ref")
+        message._blobs = (info.context or {}).get("blobs")
+        return message
+
+    @property
+    def content(self) -> str:
+        """Content of the message, read from the blob store on first access if it is kept there."""
+        if self._content is None:
+            if self._blobs is None:
+                raise RuntimeError(
+                    f"The content of the message is in blob {self.content_ref}, but no store is attached"
+                )
+            self._content = self._blobs.get(self.content_ref)  # type: ignore[arg-type]
+        return self._content
 
     @field_validator("role")
     @classmethod
@@ -27,33 +96,131 @@ class Message(BaseModel):
             raise ValueError(f"Role must be either {Role.USER}, {Role.ASSISTANT} or {Role.SYSTEM}")
         return v
 
+    def __eq__(self, other: object) -> bool:
+        """Compare messages by value, whether or not their content is kept in the blob store."""
+        if not isinstance(other, Message):
+            return NotImplemented
+        if self.content_ref is not None and self.content_ref == other.content_ref:
+            same_content = True
+        else:
+            same_content = self.content == other.content
+        return (self.role, self.usage, self.truncated) == (other.role, other.usage, other.truncated) and same_content
+
+    __hash__ = None  # type: ignore[assignment]
+
     def model_dump(self, **kwargs) -> dict[str, str]:
-        """Return a dictionary with string values for role."""
-        result = super().model_dump(**kwargs)
-        result["role"] = self.role.value
-        return result
+        """Return a dictionary with string values for role, and either the content or its blob reference."""
+        blobs: BlobStore | None = (kwargs.get("context") or {}).get("blobs")
+        rest = super().model_dump(exclude={"role", "content_ref"}, **kwargs)
+        result: dict = {"role": self.role.value}
+        if self.content_ref is not None and blobs is not None:
+            # Still stored: keep the reference without reading the content
+            result["content_ref"] = self.content_ref
+        elif blobs is not None and len(self.content) >= blobs.threshold:
+            result["content_ref"] = blobs.put(self.content)
+        else:
+            result["content"] = self.content
+        return result | rest
 
 
 class ConversationMetadata(BaseModel):
     """Represents metadata for a conversation."""
 
+    model_config = ConfigDict(frozen=True)
+
     model: str = Field(..., description="The LLM model used (e.g., 'ollama:gemma3:4b')")
     api_base: str = Field(..., description="The API endpoint used")
     start_time: datetime = Field(..., description="When the conversation started")
     message_count: int = Field(default=0, description="Number of messages in the conversation")
+    cold_start: bool | None = Field(
+        default=None, description="Whether the model had to be loaded for the first request, if known"
+    )
+    cached: bool = Field(default=False, description="Whether the answer was served from the response cache")
+
+
+class ConversationParent(BaseModel):
+    """Points a forked conversation at the conversation it branches from."""
+
+    model_config = ConfigDict(frozen=True)
+
+    uuid: str = Field(..., description="UUID of the conversation the fork branches from")
+    message_count: int = Field(..., ge=0, description="Number of leading messages of that conversation it inherits")
+
+
+class MessageLog(Sequence[Message]):
+    """Read-only view of the first messages of an append-only list.
+
+    The underlying list is only ever appended to, so what a view contains never changes: views of
+    the same list share its storage, take O(1) to create and can be read from any thread without
+    locking.
+    """
+
+    __slots__ = ("_length", "_messages")
+
+    def __init__(self, messages: list[Message], length: int | None = None):
+        """Initialize the view.
+
+        Args:
+            messages: The append-only list of messages
+            length: The number of leading messages visible through the view, all of them by default
+        """
+        self._messages = messages
+        self._length = len(messages) if length is None else length
+
+    @overload
+    def __getitem__(self, index: int) -> Message: ...
+
+    @overload
+    def __getitem__(self, index: slice) -> list[Message]: ...
+
+    def __getitem__(self, index: int | slice) -> Message | list[Message]:
+        """Return a message, or a list of messages for a slice."""
+        if isinstance(index, slice):
+            return [self._messages[i] for i in range(self._length)[index]]
+        return self._messages[range(self._length)[index]]
+
+    def __len__(self) -> int:
+        """Return the number of visible messages."""
+        return self._length
+
+    def __iter__(self) -> Iterator[Message]:
+        """Iterate over the visible messages."""
+        return islice(self._messages, self._length)
+
+    def __eq__(self, other: object) -> bool:
+        """Compare the visible messages with another sequence of messages."""
+        if not isinstance(other, Sequence):
+            return NotImplemented
+        return len(self) == len(other) and all(a == b for a, b in zip(self, other, strict=True))
+
+    def __repr__(self) -> str:
+        """Return a representation listing the visible messages."""
+        return f"MessageLog({list(self)!r})"
 
 
 class Conversation(BaseModel):
-    """Represents a conversation containing multiple messages and metadata."""
+    """Represents a conversation containing multiple messages and metadata.
+
+    Conversations are immutable. The conversation a `ConversationHistory` is recording holds a
+    `MessageLog` instead of a list, so that snapshots of it share their messages.
+
+    Conversations form a tree: a fork only holds the messages added after the fork point, and
+    `parent` points at the conversation whose leading messages precede them, so branches share
+    their common prefix instead of copying it.
+    """
+
+    model_config = ConfigDict(frozen=True)
 
     metadata: ConversationMetadata = Field(..., description="Conversation metadata")
-    messages: list[Message] = Field(..., description="List of messages in the conversation")
+    messages: list[Message] = Field(..., description="List of messages in the conversation, after the fork point")
+    parent: ConversationParent | None = Field(default=None, description="The conversation this one was forked from")
 
     def model_dump(self, **kwargs) -> dict:
         """Custom serialization to ensure proper role formatting."""
-        result = super().model_dump(**kwargs)
-        # Ensure messages use custom serialization
-        result["messages"] = [msg.model_dump() for msg in self.messages]
+        # Messages are serialized here, as they may be held in a `MessageLog` rather than a list
+        exclude = {"messages", *(kwargs.pop("exclude", None) or ())}
+        result = super().model_dump(exclude=exclude, **kwargs)
+        result["messages"] = [msg.model_dump(context=kwargs.get("context")) for msg in self.messages]
         return result
 
 
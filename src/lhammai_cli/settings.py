@@ -1,5 +1,8 @@
+import hashlib
+import json
 import os
 from pathlib import Path
+from typing import Any, Literal
 
 from any_llm.exceptions import UnsupportedProviderError
 from any_llm.provider import ProviderFactory
@@ -7,8 +10,72 @@ from dotenv import find_dotenv, load_dotenv
 from pydantic import AnyHttpUrl, Field, ValidationError, field_validator
 from pydantic_settings import BaseSettings
 
-load_dotenv(find_dotenv(".default.env", usecwd=True))
-load_dotenv(find_dotenv(".env", usecwd=True), override=True)
+APP_DIR = Path("~/.lhammai").expanduser()
+SETTINGS_SNAPSHOT = APP_DIR / "settings.snapshot.json"
+
+
+def _read_snapshot() -> dict[str, Any] | None:
+    """Read the resolved settings snapshot, if any."""
+    try:
+        with SETTINGS_SNAPSHOT.open(encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _search_dirs(cwd: str) -> list[str]:
+    """Return the directories searched for dotenv files, from the working directory up to the root."""
+    return [str(path) for path in (Path(cwd), *Path(cwd).parents)]
+
+
+def _module_fingerprint() -> str:
+    """Return a hash of this module, which changes with the settings fields and their defaults."""
+    return hashlib.sha256(Path(__file__).read_bytes()).hexdigest()[:16]
+
+
+def _dotenv_fingerprint(paths: list[str]) -> list[tuple[str, int]] | None:
+    """Return the modification times of the given dotenv files, or None if any of them is gone."""
+    try:
+        return [(path, Path(path).stat().st_mtime_ns) for path in paths]
+    except OSError:
+        return None
+
+
+def _load_dotenv_files() -> tuple[list[str], dict[str, Any] | None]:
+    """Load the `.default.env` and `.env` files into the environment.
+
+    If the snapshot written by a previous invocation still matches the working directory and the
+    modification times of the dotenv files it discovered, those files are loaded directly and the
+    directory walks are skipped. Creating a dotenv file in the working directory, or in any of its
+    parents, changes the modification time of that directory, which is also part of the snapshot.
+
+    Returns:
+        The loaded dotenv paths and the candidate snapshot, which is None if it is stale.
+    """
+    snapshot = _read_snapshot()
+    cwd = str(Path.cwd())
+
+    if snapshot is not None:
+        paths = snapshot.get("dotenv_files", [])
+        fingerprint = _dotenv_fingerprint([*_search_dirs(cwd), *paths])
+        if (
+            snapshot.get("cwd") == cwd
+            and fingerprint is not None
+            and [list(f) for f in fingerprint] == snapshot.get("mtimes")
+        ):
+            for path in paths:
+                load_dotenv(path, override=Path(path).name == ".env")
+            return paths, snapshot
+
+    paths = [path for path in (find_dotenv(".default.env", usecwd=True), find_dotenv(".env", usecwd=True)) if path]
+    for path in paths:
+        load_dotenv(path, override=Path(path).name == ".env")
+    return paths, None
+
+
+# Snapshot the environment before dotenv files add to it; dotenv values are covered by their mtimes.
+_process_environ = dict(os.environ)
+_dotenv_files, _snapshot = _load_dotenv_files()
 
 DEFAULT_MODEL = os.getenv("MODEL", "ollama:gemma3:4b")
 DEFAULT_API_BASE = os.getenv("API_BASE", "http://localhost:11434")
@@ -20,16 +87,36 @@ class Settings(BaseSettings):
     # LLM settings
     model: str = Field(validation_alias="MODEL", default=DEFAULT_MODEL)
     api_base: str = Field(validation_alias="API_BASE", default=DEFAULT_API_BASE)
+    keep_alive: str | None = Field(validation_alias="KEEP_ALIVE", default=None)
+    request_timeout: float | None = Field(validation_alias="REQUEST_TIMEOUT", default=None, gt=0)
+    concurrency: int = Field(validation_alias="CONCURRENCY", default=4, gt=0)
+    max_concurrency: int = Field(validation_alias="MAX_CONCURRENCY", default=16, gt=0)
+    coalesce_requests: bool = Field(validation_alias="COALESCE_REQUESTS", default=True)
+    embedding_model: str = Field(validation_alias="EMBEDDING_MODEL", default="ollama:nomic-embed-text")
+    context_budget: int = Field(validation_alias="CONTEXT_BUDGET", default=8192, gt=0)
+
+    # response cache
+    response_cache: bool = Field(validation_alias="RESPONSE_CACHE", default=False)
+    cache_threshold: float = Field(validation_alias="CACHE_THRESHOLD", default=0.95, ge=-1.0, le=1.0)
+    cache_max_entries: int = Field(validation_alias="CACHE_MAX_ENTRIES", default=1000, gt=0)
+    cache_mask_ids: bool = Field(validation_alias="CACHE_MASK_IDS", default=False)
 
     # logging
-    log_level: str = Field(validation_alias="LOG_LEVEL", default="DEBUG")
-    log_file: str = Field(validation_alias="LOG_FILE", default="app.log")
+    log_level: str = Field(validation_alias="LOG_LEVEL", default="WARNING")
+    log_file: Path | None = Field(validation_alias="LOG_FILE", default=APP_DIR / "app.log")
     log_retention: str = Field(validation_alias="LOG_RETENTION", default="10 days")
+    log_format: Literal["text", "json"] = Field(validation_alias="LOG_FORMAT", default="text")
+    log_enqueue: bool = Field(validation_alias="LOG_ENQUEUE", default=True)
 
     # conversation history
     history_file: Path = Field(validation_alias="HISTORY_FILE", default=Path("~/.lhammai/history.json").expanduser())
+    semantic_index: bool = Field(validation_alias="SEMANTIC_INDEX", default=False)
+    history_flush_interval: float = Field(validation_alias="HISTORY_FLUSH_INTERVAL", default=1.0, gt=0)
+    history_flush_messages: int = Field(validation_alias="HISTORY_FLUSH_MESSAGES", default=16, gt=0)
+    history_fsync: Literal["never", "close", "always"] = Field(validation_alias="HISTORY_FSYNC", default="never")
+    blob_threshold: int = Field(validation_alias="BLOB_THRESHOLD", default=4096, gt=0)
 
-    @field_validator("model")
+    @field_validator("model", "embedding_model")
     @classmethod
     def validate_model(cls, v: str) -> str:
         """Validate that the model follows the expected format.
@@ -52,5 +139,77 @@ class Settings(BaseSettings):
         """Convert API base URL string to AnyHttpUrl."""
         return AnyHttpUrl(v)
 
+    @field_validator("log_file", mode="before")
+    @classmethod
+    def validate_log_file(cls, v: str | Path | None) -> Path | None:
+        """Resolve the log file path.
+
+        An empty value disables file logging. Relative paths are placed under the application
+        directory, so the CLI never litters the directory it runs from.
+        """
+        if v is None or str(v).strip() == "":
+            return None
+
+        path = Path(v).expanduser()
+        return path if path.is_absolute() else APP_DIR / path
+
+
+def _environment_fingerprint() -> dict[str, str | None]:
+    """Return the process environment variables that affect the settings."""
+    return {
+        str(field.validation_alias): _process_environ.get(str(field.validation_alias))
+        for field in Settings.model_fields.values()
+    }
+
+
+def load_settings() -> Settings:
+    """Load the application settings, reusing the resolved snapshot when it is still valid.
+
+    The snapshot is invalidated when the working directory, the discovered dotenv files, their
+    modification times or those of the searched directories, the relevant environment variables
+    or this module, which defines the settings fields and their defaults, change.
+
+    Returns:
+        The resolved application settings.
+    """
+    environment = _environment_fingerprint()
+    fields = sorted(Settings.model_fields)
+
+    module = _module_fingerprint()
+
+    if (
+        _snapshot is not None
+        and _snapshot.get("environment") == environment
+        and _snapshot.get("fields") == fields
+        and _snapshot.get("module") == module
+    ):
+        values = _snapshot["values"]
+        values["api_base"] = AnyHttpUrl(values["api_base"])
+        values["history_file"] = Path(values["history_file"])
+        values["log_file"] = Path(values["log_file"]) if values["log_file"] else None
+        return Settings.model_construct(**values)
+
+    resolved = Settings()  # type: ignore
+
+    snapshot = {
+        "cwd": str(Path.cwd()),
+        "dotenv_files": _dotenv_files,
+        "mtimes": _dotenv_fingerprint([*_search_dirs(str(Path.cwd())), *_dotenv_files]),
+        "environment": environment,
+        "fields": fields,
+        "module": module,
+        "values": resolved.model_dump(mode="json", warnings=False),
+    }
+    try:
+        SETTINGS_SNAPSHOT.parent.mkdir(parents=True, exist_ok=True)
+        temp_file = SETTINGS_SNAPSHOT.with_suffix(f".{os.getpid()}.tmp")
+        with temp_file.open("w", encoding="utf-8") as f:
+            json.dump(snapshot, f)
+        temp_file.replace(SETTINGS_SNAPSHOT)
+    except OSError:
+        pass
+
+    return resolved
+
 
-settings = Settings()  # type: ignore
+settings = load_settings()
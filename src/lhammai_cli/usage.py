@@ -0,0 +1,137 @@
+import json
+from collections.abc import Iterable
+from datetime import date
+from pathlib import Path
+
+from pydantic import BaseModel, Field
+
+from lhammai_cli.schema import Conversation, TokenUsage
+from lhammai_cli.utils import locked, logger, temp_path
+
+
+class UsageTotals(BaseModel):
+    """Token usage accumulated over a set of requests."""
+
+    requests: int = Field(default=0, description="Number of requests that reported usage")
+    prompt_tokens: int = Field(default=0, description="Total number of prompt tokens")
+    completion_tokens: int = Field(default=0, description="Total number of completion tokens")
+    max_prompt_tokens: int = Field(default=0, description="Largest prompt of a single request, in tokens")
+
+    def add(self, usage: TokenUsage) -> None:
+        """Account for one more request."""
+        self.requests += 1
+        self.prompt_tokens += usage.prompt_tokens
+        self.completion_tokens += usage.completion_tokens
+        self.max_prompt_tokens = max(self.max_prompt_tokens, usage.prompt_tokens)
+
+    def merge(self, other: "UsageTotals") -> None:
+        """Add the totals of another set of requests."""
+        self.requests += other.requests
+        self.prompt_tokens += other.prompt_tokens
+        self.completion_tokens += other.completion_tokens
+        self.max_prompt_tokens = max(self.max_prompt_tokens, other.max_prompt_tokens)
+
+
+# Day (ISO format) -> model -> totals
+Rollups = dict[str, dict[str, UsageTotals]]
+
+
+class UsageRollups:
+    """Token usage totals per day and model, kept up to date as messages are added.
+
+    Reporting reads a single small file instead of scanning every conversation in the history.
+    Requests are attributed to the day they are recorded on; `rebuild` recomputes the rollups from
+    the history, attributing each conversation to the day it started. Updates read, modify and
+    replace the file while holding an exclusive lock on `<path>.lock`, so concurrent threads and
+    processes never lose each other's requests.
+    """
+
+    def __init__(self, path: Path):
+        """Initialize the rollups.
+
+        Args:
+            path: The JSON file holding the rollups
+        """
+        self.path = path
+        self._lock_file = path.with_suffix(f"{path.suffix}.lock")
+
+    def _read(self) -> Rollups:
+        """Read the rollups from disk, or return empty rollups if there are none yet."""
+        try:
+            with self.path.open(encoding="utf-8") as f:
+                raw = json.load(f)
+        except FileNotFoundError:
+            return {}
+        except json.JSONDecodeError as e:
+            logger.warning("Ignoring unreadable usage rollups {}: {}", self.path, e)
+            return {}
+
+        return {
+            day: {model: UsageTotals.model_validate(totals) for model, totals in models.items()}
+            for day, models in raw.items()
+        }
+
+    def _write(self, rollups: Rollups) -> None:
+        """Write the rollups to disk, replacing the previous file atomically. Called with the lock held."""
+        data = {
+            day: {model: totals.model_dump() for model, totals in sorted(models.items())}
+            for day, models in sorted(rollups.items())
+        }
+        temp_file = temp_path(self.path)
+        with temp_file.open("w", encoding="utf-8") as f:
+            json.dump(data, f, indent=2)
+        temp_file.replace(self.path)
+
+    def record(self, model: str, usage: TokenUsage, day: date | None = None) -> None:
+        """Add the usage of one request to the rollups.
+
+        Args:
+            model: The model that served the request
+            usage: The tokens the request consumed
+            day: The day to attribute the request to, today by default
+        """
+        key = (day or date.today()).isoformat()
+        with locked(self._lock_file):
+            rollups = self._read()
+            rollups.setdefault(key, {}).setdefault(model, UsageTotals()).add(usage)
+            self._write(rollups)
+
+    def rebuild(self, conversations: Iterable[tuple[str, Conversation]]) -> int:
+        """Recompute the rollups from the stored conversations.
+
+        Args:
+            conversations: Pairs of conversation UUID and conversation
+
+        Returns:
+            The number of requests with usage found in the conversations
+        """
+        rollups: Rollups = {}
+        requests = 0
+        for _, conversation in conversations:
+            key = conversation.metadata.start_time.date().isoformat()
+            for message in conversation.messages:
+                if message.usage is not None:
+                    rollups.setdefault(key, {}).setdefault(conversation.metadata.model, UsageTotals()).add(
+                        message.usage
+                    )
+                    requests += 1
+
+        with locked(self._lock_file):
+            self._write(rollups)
+        return requests
+
+    def query(self, since: date | None = None, model: str | None = None) -> list[tuple[str, str, UsageTotals]]:
+        """Return the rollups as `(day, model, totals)` rows, sorted by day and model.
+
+        Args:
+            since: Only include days on or after this one
+            model: Only include this model
+        """
+        rollups = self._read()  # replaced atomically, so reading needs no lock
+        return [
+            (day, day_model, totals)
+            for day, models in sorted(rollups.items())
+            if since is None or day >= since.isoformat()
+            for day_model, totals in sorted(models.items())
+            if model is None or day_model == model
+        ]
@@ -1,4 +1,25 @@
-from lhammai_cli.utils.llm_utils import get_llm_response
+from lhammai_cli.utils.cassette import Cassette
+from lhammai_cli.utils.context_utils import load_context
+from lhammai_cli.utils.limiter import AdaptiveLimiter, LimiterStore, Slot
+from lhammai_cli.utils.llm_utils import GenerationCancelledError, get_embeddings, get_llm_response
+from lhammai_cli.utils.locking import locked, temp_path
 from lhammai_cli.utils.logging import logger
+from lhammai_cli.utils.ollama_utils import is_model_loaded, preload_model
+from lhammai_cli.utils.single_flight import SingleFlight
 
-__all__ = ["get_llm_response", "logger"]
+__all__ = [
+    "AdaptiveLimiter",
+    "Cassette",
+    "GenerationCancelledError",
+    "LimiterStore",
+    "SingleFlight",
+    "Slot",
+    "get_embeddings",
+    "get_llm_response",
+    "is_model_loaded",
+    "load_context",
+    "locked",
+    "logger",
+    "preload_model",
+    "temp_path",
+]
@@ -0,0 +1,207 @@
+import asyncio
+import hashlib
+import json
+import threading
+import time
+from collections.abc import AsyncIterator, Awaitable, Callable
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Literal
+
+from any_llm.types.completion import (
+    ChatCompletion,
+    ChatCompletionChunk,
+    ChatCompletionMessage,
+    Choice,
+    ChoiceDelta,
+    ChunkChoice,
+)
+
+from .logging import logger
+
+CompletionResponse = ChatCompletion | AsyncIterator[ChatCompletionChunk]
+
+
+class Cassette:
+    """Records provider responses, with their timing, to files and replays them.
+
+    Each request is stored in `<directory>/<key>.json`, where the key is a hash of the model, the
+    messages and whether the response is streamed. The endpoint is not part of the key, so
+    recordings can be replayed against any `--api-base`. A streamed response is stored as its
+    chunks, each with the delay since the previous one (or since the request for the first), so
+    replays reproduce the time to the first token and the pace of the generation.
+    """
+
+    def __init__(self, directory: Path, mode: Literal["record", "replay"], speed: float = 1.0):
+        """Initialize the cassette.
+
+        Args:
+            directory: Directory holding the recorded requests
+            mode: Whether to record responses from the provider or replay recorded ones
+            speed: Replay timing multiplier, e.g. 10 to replay ten times faster, or 0 to replay without delays
+        """
+        self.directory = directory
+        self.mode = mode
+        self.speed = speed
+
+    @staticmethod
+    def _key(model: str, messages: list[dict[str, str]], stream: bool) -> str:
+        """Identify a request by what determines its response."""
+        request = json.dumps({"model": model, "messages": messages, "stream": stream}, sort_keys=True)
+        return hashlib.sha256(request.encode("utf-8")).hexdigest()[:32]
+
+    async def complete(
+        self,
+        acompletion: Callable[..., Awaitable[CompletionResponse]],
+        model: str,
+        messages: list[dict[str, str]],
+        api_base: str,
+        stream: bool,
+        **kwargs: Any,
+    ) -> CompletionResponse:
+        """Send a request through the cassette.
+
+        Args:
+            acompletion: The function sending the request to the provider, when recording
+            model: The LLM model to use
+            messages: The messages to send
+            api_base: The provider's API base URL
+            stream: Whether to stream the response
+            **kwargs: Further arguments for `acompletion`
+
+        Returns:
+            The response, as `acompletion` returns it
+
+        Raises:
+            FileNotFoundError: If no response was recorded for the request when replaying
+        """
+        path = self.directory / f"{self._key(model, messages, stream)}.json"
+        request = {"model": model, "api_base": api_base, "messages": messages, "stream": stream}
+
+        if self.mode == "replay":
+            try:
+                with path.open(encoding="utf-8") as f:
+                    recording = json.load(f)
+            except FileNotFoundError:
+                raise FileNotFoundError(f"No response to this request was recorded in {self.directory}") from None
+            logger.debug("Replaying {} at {}x speed", path.name, self.speed)
+            return await self._replay(recording["response"])
+
+        start = time.perf_counter()
+        response = await acompletion(model=model, messages=messages, api_base=api_base, stream=stream, **kwargs)
+        if isinstance(response, ChatCompletion):
+            delay = time.perf_counter() - start
+            self._save(
+                path, request, {"type": "completion", "delay": delay, "completion": response.model_dump(mode="json")}
+            )
+            return response
+        return self._record_stream(response, path, request, start)
+
+    def record_shared(
+        self,
+        model: str,
+        messages: list[dict[str, str]],
+        api_base: str,
+        stream: bool,
+        content: str,
+        delay: float,
+        since: float,
+    ) -> None:
+        """Record the response of an identical request in flight, which never reached `complete`.
+
+        The response is stored as a single completion, or a single chunk when streamed, received
+        after `delay`. A recording of the same request written since `since`, e.g. by the request
+        that was waited on, is kept, as it has the provider's own chunks and timing.
+
+        Args:
+            model: The LLM model the request was for
+            messages: The messages of the request
+            api_base: The provider's API base URL
+            stream: Whether the response was requested as a stream
+            content: The response text
+            delay: How long the request waited for the response, in seconds
+            since: When the request was sent, as a timestamp
+        """
+        path = self.directory / f"{self._key(model, messages, stream)}.json"
+        try:
+            if path.stat().st_mtime >= since:
+                return
+        except FileNotFoundError:
+            pass
+
+        request = {"model": model, "api_base": api_base, "messages": messages, "stream": stream}
+        created = int(time.time())
+        if stream:
+            chunk = ChatCompletionChunk(
+                id="shared",
+                choices=[
+                    ChunkChoice(delta=ChoiceDelta(content=content, role="assistant"), index=0, finish_reason="stop")
+                ],
+                created=created,
+                model=model,
+                object="chat.completion.chunk",
+            )
+            response = {"type": "stream", "chunks": [{"delay": delay, "chunk": chunk.model_dump(mode="json")}]}
+        else:
+            completion = ChatCompletion(
+                id="shared",
+                choices=[
+                    Choice(
+                        finish_reason="stop",
+                        index=0,
+                        message=ChatCompletionMessage(content=content, role="assistant"),
+                    )
+                ],
+                created=created,
+                model=model,
+                object="chat.completion",
+            )
+            response = {"type": "completion", "delay": delay, "completion": completion.model_dump(mode="json")}
+        self._save(path, request, response)
+
+    async def _record_stream(
+        self, chunks: AsyncIterator[ChatCompletionChunk], path: Path, request: dict, start: float
+    ) -> AsyncIterator[ChatCompletionChunk]:
+        """Pass streamed chunks through, saving them with their timing once the stream is complete."""
+        events = []
+        last = start
+        try:
+            async for chunk in chunks:
+                now = time.perf_counter()
+                events.append({"delay": now - last, "chunk": chunk.model_dump(mode="json")})
+                last = now
+                yield chunk
+        finally:
+            aclose = getattr(chunks, "aclose", None)
+            if aclose is not None:
+                await aclose()
+        # Reached only when the stream was read to the end; interrupted responses are not recorded
+        self._save(path, request, {"type": "stream", "chunks": events})
+
+    async def _replay(self, response: dict) -> CompletionResponse:
+        """Recreate a recorded response, waiting as long as the provider did."""
+        if response["type"] == "completion":
+            await self._wait(response["delay"])
+            return ChatCompletion.model_validate(response["completion"])
+
+        async def chunks() -> AsyncIterator[ChatCompletionChunk]:
+            for event in response["chunks"]:
+                await self._wait(event["delay"])
+                yield ChatCompletionChunk.model_validate(event["chunk"])
+
+        return chunks()
+
+    async def _wait(self, delay: float) -> None:
+        """Sleep for a recorded delay, scaled by the replay speed."""
+        if self.speed > 0:
+            await asyncio.sleep(delay / self.speed)
+
+    def _save(self, path: Path, request: dict, response: dict) -> None:
+        """Write a recording, replacing any previous recording of the same request."""
+        self.directory.mkdir(parents=True, exist_ok=True)
+        recording = {"recorded_at": datetime.now().isoformat(), "request": request, "response": response}
+        temp_file = path.with_name(f"{path.name}.{threading.get_ident()}.tmp")
+        with temp_file.open("w", encoding="utf-8") as f:
+            json.dump(recording, f, ensure_ascii=False, default=str)
+        temp_file.replace(path)
+        logger.debug("Recorded {}", path.name)
@@ -0,0 +1,246 @@
+import glob
+import hashlib
+import mmap
+from collections.abc import Callable
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, NamedTuple
+
+from .logging import logger
+
+# Rough number of characters per token, used to estimate prompt sizes without a tokenizer
+CHARS_PER_TOKEN = 4
+
+# Files at least this large are memory-mapped to be hashed, instead of being read into memory
+MMAP_THRESHOLD = 1 << 20
+
+# Maximum number of files read at the same time
+MAX_READ_WORKERS = 8
+
+# Number of leading bytes checked for NUL characters to detect binary files
+BINARY_SNIFF_BYTES = 8192
+
+
+class FileInfo(NamedTuple):
+    """A text file found by the patterns, before any of its content is kept."""
+
+    path: Path
+    digest: str
+    size: int
+
+
+class FileContent(NamedTuple):
+    """The part of a file that may be sent to the model."""
+
+    path: Path
+    text: str
+    digest: str
+    size: int
+    truncated: bool
+
+
+class PackedContext(NamedTuple):
+    """Files packed into a prompt."""
+
+    text: str
+    files: int
+    duplicates: int
+    truncated: int
+    tokens: int
+
+
+def estimate_tokens(text: str) -> int:
+    """Estimate the number of tokens in a text."""
+    return -(-len(text) // CHARS_PER_TOKEN)
+
+
+def expand_file_patterns(patterns: list[str] | tuple[str, ...]) -> list[Path]:
+    """Expand file paths and glob patterns, `**` included, into a list of files.
+
+    Args:
+        patterns: Paths or glob patterns. A directory stands for every file below it.
+
+    Returns:
+        The matching files, in pattern order and sorted within each pattern, without repetitions
+
+    Raises:
+        FileNotFoundError: If a pattern matches no file
+    """
+    paths: dict[Path, None] = {}
+    for pattern in patterns:
+        if Path(pattern).is_dir():
+            pattern = str(Path(pattern) / "**" / "*")
+        # Path.glob only accepts relative patterns, while users pass absolute ones too
+        matches = sorted(
+            Path(match)
+            for match in glob.glob(pattern, recursive=True)  # noqa: PTH207
+            if Path(match).is_file()
+        )
+        if not matches:
+            raise FileNotFoundError(f"No files match '{pattern}'")
+        paths.update(dict.fromkeys(matches))
+    return list(paths)
+
+
+def _map_files(function: Callable[[Any], Any], items: list[Any]) -> list[Any]:
+    """Apply a function to files concurrently, keeping their order."""
+    if not items:
+        return []
+    with ThreadPoolExecutor(max_workers=min(MAX_READ_WORKERS, len(items))) as executor:
+        return list(executor.map(function, items))
+
+
+def scan_file(path: Path) -> FileInfo | None:
+    """Hash a text file and record its size, without keeping its content.
+
+    Large files are memory-mapped, so they are hashed without being copied into memory.
+
+    Args:
+        path: The file to scan
+
+    Returns:
+        The digest and size of the file, or None if it looks binary
+    """
+    with path.open("rb") as f:
+        size = path.stat().st_size
+        if size >= MMAP_THRESHOLD:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                if b"\0" in mapped[:BINARY_SNIFF_BYTES]:
+                    return None
+                digest = hashlib.sha256(mapped).hexdigest()
+        else:
+            data = f.read()
+            if b"\0" in data[:BINARY_SNIFF_BYTES]:
+                return None
+            digest = hashlib.sha256(data).hexdigest()
+    return FileInfo(path=path, digest=digest, size=size)
+
+
+def scan_files(paths: list[Path]) -> list[FileInfo]:
+    """Scan files concurrently, skipping binary files.
+
+    Args:
+        paths: The files to scan
+
+    Returns:
+        The digests and sizes of the text files, in the order of `paths`
+    """
+    infos = _map_files(scan_file, paths)
+    for path, info in zip(paths, infos, strict=True):
+        if info is None:
+            logger.warning("Skipping binary file {}", path)
+    return [info for info in infos if info is not None]
+
+
+def read_file(info: FileInfo, max_chars: int) -> FileContent:
+    """Read at most `max_chars` characters of a scanned file.
+
+    Only the bytes that can hold those characters are read, so memory use does not depend on the
+    size of the file.
+
+    Args:
+        info: The scanned file
+        max_chars: The maximum number of characters to keep
+
+    Returns:
+        The beginning of the file
+    """
+    # UTF-8 uses at most 4 bytes per character
+    with info.path.open("rb") as f:
+        data = f.read(max_chars * 4)
+
+    text = data.decode("utf-8", errors="replace")
+    truncated = len(data) < info.size or len(text) > max_chars
+    return FileContent(path=info.path, text=text[:max_chars], digest=info.digest, size=info.size, truncated=truncated)
+
+
+def _header(path: Path, aliases: list[Path]) -> str:
+    """Describe a file in the packed prompt."""
+    same_as = f" (same content as {', '.join(str(alias) for alias in aliases)})" if aliases else ""
+    return f"--- {path}{same_as} ---\n"
+
+
+def _truncation_marker(size: int) -> str:
+    """Mark the end of a truncated file in the packed prompt."""
+    return f"\n[... truncated, {size:,} bytes in total]"
+
+
+def pack_files(infos: list[FileInfo], budget_tokens: int) -> PackedContext:
+    """Read scanned files into a prompt that fits in a token budget.
+
+    Files with identical content are included once. The budget is shared fairly before any file is
+    read: files smaller than an equal share are included in full, and what they leave unused is split
+    between the larger files, of which only their share is read. File sizes in bytes bound their
+    lengths in characters, so no file gets more than its share.
+
+    Args:
+        infos: The scanned files, in the order they should appear
+        budget_tokens: The maximum number of tokens for all files together
+
+    Returns:
+        The packed files and statistics about them
+    """
+    unique: dict[str, FileInfo] = {}
+    aliases: dict[str, list[Path]] = {}
+    for info in infos:
+        if info.digest in unique:
+            aliases[info.digest].append(info.path)
+        else:
+            unique[info.digest] = info
+            aliases[info.digest] = []
+
+    files = list(unique.values())
+    headers = [_header(info.path, aliases[info.digest]) for info in files]
+    # Reserve room for each header, the separators and a possible truncation marker
+    overhead = sum(
+        len(header) + len(_truncation_marker(info.size)) + 2 for info, header in zip(files, headers, strict=True)
+    )
+    remaining = max(budget_tokens * CHARS_PER_TOKEN - overhead, 0)
+
+    # Hand out equal shares, smallest files first, so unused space flows to the larger files
+    shares = [0] * len(files)
+    order = sorted(range(len(files)), key=lambda i: files[i].size)
+    for position, i in enumerate(order):
+        shares[i] = min(files[i].size, remaining // (len(files) - position))
+        remaining -= shares[i]
+
+    contents = _map_files(lambda i: read_file(files[i], shares[i]), list(range(len(files))))
+
+    parts: list[str] = []
+    truncated = 0
+    for content, header in zip(contents, headers, strict=True):
+        text = content.text
+        if content.truncated:
+            truncated += 1
+            text += _truncation_marker(content.size)
+        parts.append(f"{header}{text}\n")
+
+    packed = "\n".join(parts)
+    logger.debug("Packed {} files ({} duplicates, {} truncated)", len(files), len(infos) - len(files), truncated)
+    return PackedContext(
+        text=packed,
+        files=len(files),
+        duplicates=len(infos) - len(files),
+        truncated=truncated,
+        tokens=estimate_tokens(packed),
+    )
+
+
+def load_context(patterns: list[str] | tuple[str, ...], budget_tokens: int) -> PackedContext:
+    """Read the files matching some patterns and pack them into a token budget.
+
+    Files are scanned for their size and digest first, and only the share of each file that fits in
+    the budget is read, so memory use does not grow with the number or the size of the files.
+
+    Args:
+        patterns: Paths or glob patterns
+        budget_tokens: The maximum number of tokens for all files together
+
+    Returns:
+        The packed files and statistics about them
+
+    Raises:
+        FileNotFoundError: If a pattern matches no file
+    """
+    paths = expand_file_patterns(patterns)
+    return pack_files(scan_files(paths), budget_tokens)
@@ -0,0 +1,255 @@
+import json
+import math
+import threading
+import time
+from collections.abc import Iterator
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any
+
+from .llm_utils import CANCEL_POLL_INTERVAL, GenerationCancelledError
+from .locking import locked, temp_path
+from .logging import logger
+
+# HTTP statuses with which a server says it is overloaded
+OVERLOAD_STATUSES = frozenset({429, 503})
+# Stored limiter states older than this are ignored, as the load on the server has likely changed, in seconds
+STATE_MAX_AGE = 24 * 3600.0
+
+
+def is_overload_error(error: BaseException) -> bool:
+    """Return whether an error means the server is overloaded or unreachable.
+
+    Connection errors, and errors carrying a 429 or 503 status as `status_code` (OpenAI, Ollama) or
+    `response.status_code` (httpx), count, including when they are the cause of the error.
+    """
+    while error is not None:
+        if isinstance(error, ConnectionError):
+            return True
+        status = getattr(error, "status_code", None) or getattr(getattr(error, "response", None), "status_code", None)
+        if status in OVERLOAD_STATUSES:
+            return True
+        error = error.__cause__
+    return False
+
+
+class Slot:
+    """A request admitted by an `AdaptiveLimiter`."""
+
+    def __init__(self, key: str):
+        """Initialize the slot.
+
+        Args:
+            key: What the request's latency is compared with, e.g. the model, as larger models are slower
+        """
+        self.key = key
+        self.started = time.perf_counter()
+        self.latency: float | None = None
+        self.sample = True
+
+    def first_token(self) -> None:
+        """Record the arrival of the first token, the latency compared instead of the total duration.
+
+        The time to the first token covers queueing and prompt processing on the server, which
+        contention inflates, but not the length of the answer, which varies from one prompt to another.
+        """
+        if self.latency is None:
+            self.latency = time.perf_counter() - self.started
+
+
+class AdaptiveLimiter:
+    """Limit the number of concurrent requests to a server, adapting the limit to how it copes.
+
+    The limit follows an additive-increase/multiplicative-decrease (AIMD) scheme: each request
+    that completes without a latency rise raises the limit by one over the current limit, i.e. by
+    about one per round of requests, while an overload error or a latency above `tolerance` times
+    the baseline multiplies it by `backoff`. The baseline per key tracks the lowest recent latency,
+    drifting up slowly so that it follows a server that got slower for good. Requests that started
+    before the last decrease do not cause another one, so a burst of slow responses to requests
+    sent under the old limit backs off once.
+    """
+
+    def __init__(
+        self,
+        initial_limit: int = 4,
+        max_limit: int = 16,
+        min_limit: int = 1,
+        backoff: float = 0.5,
+        tolerance: float = 2.0,
+        smoothing: float = 0.1,
+    ):
+        """Initialize the limiter.
+
+        Args:
+            initial_limit: Number of concurrent requests allowed at first
+            max_limit: Highest number of concurrent requests the limit may grow to
+            min_limit: Lowest number of concurrent requests the limit may shrink to
+            backoff: Factor by which the limit is multiplied when the server is overloaded
+            tolerance: Ratio of the latency to its baseline above which the server counts as overloaded
+            smoothing: Weight of each latency in the baseline, when it is higher than the baseline
+        """
+        self.max_limit = max_limit
+        self.min_limit = min_limit
+        self.backoff = backoff
+        self.tolerance = tolerance
+        self.smoothing = smoothing
+        self._limit = float(max(min_limit, min(initial_limit, max_limit)))
+        self._in_flight = 0
+        self._waiting = 0
+        self._baselines: dict[str, float] = {}
+        self._last_decrease = float("-inf")
+        self._condition = threading.Condition()
+
+    @property
+    def limit(self) -> int:
+        """The number of requests currently allowed to run concurrently."""
+        return math.floor(self._limit)
+
+    @property
+    def in_flight(self) -> int:
+        """The number of requests running."""
+        return self._in_flight
+
+    @property
+    def queue_depth(self) -> int:
+        """The number of requests waiting for a slot."""
+        return self._waiting
+
+    @contextmanager
+    def acquire(self, key: str = "", cancel_event: threading.Event | None = None) -> Iterator[Slot]:
+        """Wait for a slot and hold it while the request runs.
+
+        The limit is adjusted from the outcome of the block: its latency (see `Slot.first_token`)
+        when it succeeds, or a decrease when it raises an overload error. Set `Slot.sample` to
+        False for requests whose latency says nothing about the load, e.g. cold starts.
+
+        Args:
+            key: What the request's latency is compared with
+            cancel_event: Event that, when set, stops waiting for a slot
+
+        Yields:
+            The slot of the request
+
+        Raises:
+            GenerationCancelledError: If `cancel_event` is set while waiting for a slot
+        """
+        with self._condition:
+            self._waiting += 1
+            try:
+                while self._in_flight >= self.limit:
+                    if cancel_event is not None and cancel_event.is_set():
+                        raise GenerationCancelledError("Cancelled while waiting for a request slot")
+                    self._condition.wait(CANCEL_POLL_INTERVAL if cancel_event is not None else None)
+            finally:
+                self._waiting -= 1
+            self._in_flight += 1
+
+        slot = Slot(key)
+        # Whether the server coped with the request, or None if the request says nothing about it
+        coped: bool | None = None
+        try:
+            yield slot
+        except Exception as e:
+            if is_overload_error(e):
+                coped = False
+            raise
+        else:
+            if slot.sample:
+                coped = self._observe(slot)
+        finally:
+            with self._condition:
+                self._in_flight -= 1
+                if coped is False:
+                    self._decrease(slot)
+                elif coped:
+                    self._limit = min(self._limit + 1 / self._limit, self.max_limit)
+                self._condition.notify_all()
+
+    def state(self) -> dict[str, Any]:
+        """Return the limit and latency baselines, to carry them over to a later run, see `restore`."""
+        with self._condition:
+            return {"limit": self._limit, "baselines": dict(self._baselines)}
+
+    def restore(self, state: dict[str, Any]) -> None:
+        """Resume from the limit and latency baselines of an earlier run, see `state`.
+
+        Without them, the first latency of each key becomes its baseline, so a server that is
+        already overloaded when a run starts, or that serves each key once per run, is never backed
+        off from.
+        """
+        with self._condition:
+            self._limit = float(max(self.min_limit, min(state["limit"], self.max_limit)))
+            self._baselines.update(state["baselines"])
+
+    def _observe(self, slot: Slot) -> bool:
+        """Update the baseline of the slot's key, returning whether the latency stayed within the tolerance."""
+        latency = slot.latency if slot.latency is not None else time.perf_counter() - slot.started
+        with self._condition:
+            baseline = self._baselines.get(slot.key, latency)
+            self._baselines[slot.key] = min(latency, baseline + (latency - baseline) * self.smoothing)
+        return latency <= baseline * self.tolerance
+
+    def _decrease(self, slot: Slot) -> None:
+        """Back off, unless the request was sent before the last decrease. Called with the lock held."""
+        if slot.started <= self._last_decrease:
+            return
+        self._last_decrease = time.perf_counter()
+        self._limit = max(self._limit * self.backoff, self.min_limit)
+        logger.bind(limit=self.limit, queue_depth=self._waiting).info(
+            "Server overloaded, lowering the concurrency limit to {}", self.limit
+        )
+
+
+class LimiterStore:
+    """The states of the limiters of each server, carried over from one run to the next.
+
+    The states are stored in a JSON file keyed by server. Updates read, modify and replace the
+    file while holding an exclusive lock on `<path>.lock`, so concurrent processes never lose each
+    other's states.
+    """
+
+    def __init__(self, path: Path):
+        """Initialize the store.
+
+        Args:
+            path: The JSON file holding the states
+        """
+        self.path = path
+        self._lock_file = path.with_suffix(f"{path.suffix}.lock")
+
+    def _read(self) -> dict[str, dict[str, Any]]:
+        """Read the states from disk, or return no states if there are none yet."""
+        try:
+            with self.path.open(encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+        except json.JSONDecodeError as e:
+            logger.warning("Ignoring unreadable limiter states {}: {}", self.path, e)
+            return {}
+
+    def restore(self, server: str, limiter: AdaptiveLimiter) -> None:
+        """Resume a limiter from the state stored for a server, unless it is missing or outdated.
+
+        Args:
+            server: The server the limiter is for, e.g. its API base URL
+            limiter: The limiter to restore
+        """
+        state = self._read().get(server)
+        if state is not None and time.time() - state["updated"] < STATE_MAX_AGE:
+            limiter.restore(state)
+
+    def save(self, server: str, limiter: AdaptiveLimiter) -> None:
+        """Store the state of a limiter for a server.
+
+        Args:
+            server: The server the limiter is for, e.g. its API base URL
+            limiter: The limiter to store
+        """
+        with locked(self._lock_file):
+            states = self._read()
+            states[server] = {**limiter.state(), "updated": time.time()}
+            temp_file = temp_path(self.path)
+            with temp_file.open("w", encoding="utf-8") as f:
+                json.dump(states, f, indent=2)
+            temp_file.replace(self.path)
@@ -1,56 +1,290 @@
-from collections.abc import Iterator
+import asyncio
+import threading
+import time
+from collections.abc import AsyncIterator, Callable
+from functools import partial
+from uuid import uuid4
 
-from any_llm import completion
+from any_llm import acompletion, embedding
 from any_llm.provider import ProviderFactory
-from any_llm.types.completion import ChatCompletion, ChatCompletionChunk
+from any_llm.types.completion import ChatCompletion, ChatCompletionChunk, CompletionUsage
 from halo import Halo
 
+from .cassette import Cassette
 from .logging import logger
+from .single_flight import SingleFlight
 
+# How often an in-flight request checks whether it has been cancelled from another thread, in seconds
+CANCEL_POLL_INTERVAL = 0.1
 
-def get_llm_response(prompt: str, model: str, api_base: str) -> str | None:
+
+class GenerationCancelledError(Exception):
+    """Raised when a request is cancelled through its cancel event."""
+
+
+def get_llm_response(
+    prompt: str,
+    model: str,
+    api_base: str,
+    show_spinner: bool = True,
+    on_token: Callable[[str], None] | None = None,
+    on_usage: Callable[[CompletionUsage], None] | None = None,
+    timeout: float | None = None,
+    cancel_event: threading.Event | None = None,
+    context: list[dict[str, str]] | None = None,
+    cassette: Cassette | None = None,
+    single_flight: SingleFlight | None = None,
+    on_shared: Callable[[], None] | None = None,
+) -> str | None:
     """Get a response from the LLM.
 
     This function sends a prompt to the specified LLM model, at the given API base URL, and returns the response.
     The response of the LLM should adhere to OpenAI's API specifications.
     Then, the function returns the LLM's response as a string, or None if no response is received.
 
+    The request runs in its own event loop. When it times out, is cancelled through `cancel_event`, or is interrupted
+    with Ctrl-C, the in-flight HTTP request is closed, so the server stops generating. Whatever was streamed to
+    `on_token` until then is all that was generated.
+
     Args:
         prompt (str): The prompt to send to the LLM.
         model (str): The LLM model to use.
         api_base (str): The provider's API base URL.
+        show_spinner (bool): Whether to display a spinner while waiting. Disable it when several requests run
+            concurrently.
+        on_token (Callable[[str], None] | None): If given, the response is streamed and this callback receives each
+            chunk of text as soon as it arrives.
+        on_usage (Callable[[CompletionUsage], None] | None): If given, receives the token usage of the request, when
+            the provider reports it.
+        timeout (float | None): Deadline for the whole request in seconds, also passed to the provider's client.
+        cancel_event (threading.Event | None): If given, setting it from another thread cancels the request.
+        context (list[dict[str, str]] | None): Earlier messages of the conversation, as `role` and `content`
+            dictionaries, sent before the prompt.
+        cassette (Cassette | None): If given, the response is recorded to it, or replayed from it instead of querying
+            the provider.
+        single_flight (SingleFlight | None): If given, an identical request already in flight, in this or another
+            process, is waited on instead of sent again. Its response is returned without calling `on_token` and
+            `on_usage`, as the tokens were generated, and are accounted for, by the other request. It is recorded to
+            the cassette all the same.
+        on_shared (Callable[[], None] | None): If given, called when the response is that of an identical request in
+            flight, e.g. to leave its latency out of measurements of the provider.
 
     Returns:
         str: The LLM's response.
 
     Raises:
         ConnectionError: If the connection to the LLM fails.
+        TimeoutError: If the response is not complete within `timeout` seconds.
+        GenerationCancelledError: If `cancel_event` is set before the response is complete.
         RuntimeError: The LLM response should be a valid ChatCompletion object. Otherwise, an error is raised.
     """
     provider, _ = ProviderFactory.split_model_provider(model)
 
-    spinner = Halo(text="🤖 Thinking...", spinner="dots", color="cyan")
+    with logger.contextualize(request_id=uuid4().hex[:12]):
+        logger.debug("Sending request to {} at {}", model, api_base)
+        start = time.perf_counter()
+        sent_at = time.time()
+
+        spinner = Halo(text="🤖 Thinking...", spinner="dots", color="cyan", enabled=show_spinner)
+
+        messages = [*(context or []), {"role": "user", "content": prompt}]
+        usages: list[CompletionUsage] = []
+
+        def send() -> str | None:
+            content, usage = asyncio.run(
+                _complete(
+                    model=model,
+                    messages=messages,
+                    api_base=api_base,
+                    on_token=on_token,
+                    spinner=spinner,
+                    timeout=timeout,
+                    cancel_event=cancel_event,
+                    cassette=cassette,
+                )
+            )
+            if usage is not None:
+                usages.append(usage)
+            return content
+
+        def check() -> None:
+            if cancel_event is not None and cancel_event.is_set():
+                raise GenerationCancelledError(f"The request to {model} was cancelled")
+            if timeout is not None and time.perf_counter() - start > timeout:
+                raise TimeoutError(f"The identical request in flight did not complete within {timeout:g} seconds")
+
+        spinner.start()
+        try:
+            if single_flight is None:
+                content = send()
+            else:
+                content, shared = single_flight.do(SingleFlight.key(model, api_base, messages), send, check)
+                if shared:
+                    logger.info("Received the response of an identical request in flight")
+                    if cassette is not None and cassette.mode == "record" and content is not None:
+                        cassette.record_shared(
+                            model,
+                            messages,
+                            api_base,
+                            on_token is not None,
+                            content,
+                            time.perf_counter() - start,
+                            sent_at,
+                        )
+                    if on_shared is not None:
+                        on_shared()
+            usage = usages[-1] if usages else None
+        except ConnectionError as e:
+            error_message = (
+                f"Failed to connect to {provider.capitalize()} at {api_base}. Please check your `.env` file."
+            )
+            logger.error(error_message)
+            raise ConnectionError(error_message) from e
+        except TimeoutError as e:
+            logger.warning("Request to {} timed out after {} s", model, timeout)
+            raise TimeoutError(f"No complete response from {model} within {timeout:g} seconds") from e
+        except GenerationCancelledError:
+            logger.info("Request to {} was cancelled", model)
+            raise
+        except Exception as e:
+            logger.error("An error occurred while communicating with {}: {}", provider.capitalize(), e)
+            raise
+        finally:
+            # Also reached on Ctrl-C, so the terminal is never left with a running spinner
+            spinner.stop()
+
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        logger.bind(
+            elapsed_ms=round(elapsed_ms, 1),
+            prompt_tokens=usage.prompt_tokens if usage else None,
+            completion_tokens=usage.completion_tokens if usage else None,
+        ).info("Received response from {} in {:.0f} ms", model, elapsed_ms)
+
+        if usage is not None and on_usage is not None:
+            on_usage(usage)
+        return content
 
-    spinner.start()
 
+async def _complete(
+    model: str,
+    messages: list[dict[str, str]],
+    api_base: str,
+    on_token: Callable[[str], None] | None,
+    spinner: Halo,
+    timeout: float | None,
+    cancel_event: threading.Event | None,
+    cassette: Cassette | None,
+) -> tuple[str | None, CompletionUsage | None]:
+    """Run a request, cancelling it when the cancel event is set.
+
+    Cancelling the request task, here or because the event loop is interrupted, closes the stream
+    and the HTTP connection behind it.
+    """
+    request = asyncio.create_task(_request(model, messages, api_base, on_token, spinner, timeout, cassette))
     try:
-        response: ChatCompletion | Iterator[ChatCompletionChunk] = completion(
-            model=model, messages=[{"role": "user", "content": prompt}], api_base=api_base
+        while True:
+            done, _ = await asyncio.wait({request}, timeout=CANCEL_POLL_INTERVAL)
+            if done:
+                return request.result()
+            if cancel_event is not None and cancel_event.is_set():
+                raise GenerationCancelledError(f"The request to {model} was cancelled")
+    finally:
+        if not request.done():
+            request.cancel()
+            await asyncio.gather(request, return_exceptions=True)
+
+
+async def _request(
+    model: str,
+    messages: list[dict[str, str]],
+    api_base: str,
+    on_token: Callable[[str], None] | None,
+    spinner: Halo,
+    timeout: float | None,
+    cassette: Cassette | None,
+) -> tuple[str | None, CompletionUsage | None]:
+    """Send a request and read the response, within the deadline.
+
+    Returns:
+        The response text and the token usage, if the provider reported it.
+    """
+    # `timeout` is passed on to the provider's HTTP client; the deadline below also covers streaming
+    kwargs = {"timeout": timeout} if timeout is not None else {}
+    complete = acompletion if cassette is None else partial(cassette.complete, acompletion)
+    async with asyncio.timeout(timeout):
+        response: ChatCompletion | AsyncIterator[ChatCompletionChunk] = await complete(
+            model=model,
+            messages=messages,
+            api_base=api_base,
+            stream=on_token is not None,
+            **kwargs,
         )
+        if isinstance(response, ChatCompletion):
+            return response.choices[0].message.content, response.usage
+        if on_token is None or not isinstance(response, AsyncIterator):
+            raise RuntimeError("Response type not supported")
+
+        try:
+            return await _consume_stream(response, on_token, spinner)
+        finally:
+            # Closing the stream closes the connection, which makes the server stop generating
+            aclose = getattr(response, "aclose", None)
+            if aclose is not None:
+                await aclose()
+
+
+async def _consume_stream(
+    chunks: AsyncIterator[ChatCompletionChunk], on_token: Callable[[str], None], spinner: Halo
+) -> tuple[str | None, CompletionUsage | None]:
+    """Forward streamed chunks to a callback and assemble the full response.
+
+    Args:
+        chunks: The streamed completion chunks.
+        on_token: Callback receiving each piece of text.
+        spinner: The spinner to stop once the first token arrives.
+
+    Returns:
+        The full response text, or None if nothing was generated, and the token usage if a chunk reported it.
+    """
+    parts: list[str] = []
+    usage: CompletionUsage | None = None
+    async for chunk in chunks:
+        # Providers report the usage once, usually on the last chunk
+        usage = chunk.usage or usage
+        if not chunk.choices:
+            continue
+        token = chunk.choices[0].delta.content
+        if token:
+            if not parts:
+                spinner.stop()
+            parts.append(token)
+            on_token(token)
+
+    return "".join(parts) or None, usage
+
+
+def get_embeddings(texts: list[str], model: str, api_base: str) -> list[list[float]]:
+    """Embed texts with the provider's embedding endpoint.
+
+    Args:
+        texts (list[str]): The texts to embed.
+        model (str): The embedding model to use, e.g. 'ollama:nomic-embed-text'.
+        api_base (str): The provider's API base URL.
+
+    Returns:
+        list[list[float]]: One embedding vector per text, in input order.
+
+    Raises:
+        ConnectionError: If the connection to the provider fails.
+    """
+    provider, _ = ProviderFactory.split_model_provider(model)
+
+    try:
+        response = embedding(model=model, inputs=texts, api_base=api_base)
     except ConnectionError as e:
-        spinner.stop()
         error_message = f"Failed to connect to {provider.capitalize()} at {api_base}. Please check your `.env` file."
         logger.error(error_message)
         raise ConnectionError(error_message) from e
-    except Exception as e:
-        spinner.stop()
-        logger.error(f"An error occurred while communicating with {provider.capitalize()}: {e}")
-        raise
-
-    if isinstance(response, ChatCompletion):
-        spinner.stop()
-        return response.choices[0].message.content
-    else:
-        spinner.stop()
-        logger.error("Response type not supported")
-        raise RuntimeError("Response type not supported")
+
+    logger.debug("Embedded {} texts with {}", len(texts), model)
+    return [item.embedding for item in sorted(response.data, key=lambda item: item.index)]
@@ -0,0 +1,50 @@
+import os
+import threading
+from collections.abc import Iterator
+from contextlib import contextmanager
+from pathlib import Path
+
+try:
+    import fcntl
+except ImportError:  # Windows: writes are only serialized within a process
+    fcntl = None
+
+# One lock per lock file, so threads of this process wait for each other even without `fcntl`
+_thread_locks: dict[Path, threading.Lock] = {}
+_thread_locks_guard = threading.Lock()
+# The lock files held by the current thread, so that nested writes do not wait for themselves
+_held = threading.local()
+
+
+@contextmanager
+def locked(lock_file: Path) -> Iterator[None]:
+    """Hold an exclusive lock on a file, across threads and processes.
+
+    Used around the read-modify-write cycles of files shared by concurrent processes, so none of
+    them loses the others' updates. The lock is reentrant within a thread.
+
+    Args:
+        lock_file: The file to lock, created if it does not exist
+    """
+    held: set[Path] = _held.__dict__.setdefault("paths", set())
+    if lock_file in held:
+        yield
+        return
+
+    with _thread_locks_guard:
+        thread_lock = _thread_locks.setdefault(lock_file, threading.Lock())
+    with thread_lock:
+        lock_file.parent.mkdir(parents=True, exist_ok=True)
+        with lock_file.open("a") as f:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_EX)
+            held.add(lock_file)
+            try:
+                yield  # closing the file releases the lock
+            finally:
+                held.discard(lock_file)
+
+
+def temp_path(path: Path) -> Path:
+    """Return a temporary file name for a new version of `path`, unique to this process and thread."""
+    return path.with_name(f"{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
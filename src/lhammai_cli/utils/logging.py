@@ -2,5 +2,22 @@ from loguru import logger
 
 from lhammai_cli.settings import settings
 
+TEXT_FORMAT = (
+    "{time:YYYY-MM-DD HH:mm:ss.SSS} | {level: <8} | {extra[request_id]} | {name}:{function}:{line} - {message}"
+)
+
 logger.remove()
-logger.add(settings.log_file, level=settings.log_level, retention=settings.log_retention)
+logger.configure(extra={"request_id": "-"})
+
+if settings.log_file is not None:
+    # `delay` opens the file on the first record that passes the level filter and `enqueue` moves
+    # formatting and I/O to loguru's writer thread, so disabled levels cost a single comparison.
+    logger.add(
+        settings.log_file,
+        level=settings.log_level,
+        retention=settings.log_retention,
+        format=TEXT_FORMAT,
+        serialize=settings.log_format == "json",
+        enqueue=settings.log_enqueue,
+        delay=True,
+    )
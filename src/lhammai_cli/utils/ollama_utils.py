@@ -0,0 +1,95 @@
+from any_llm.provider import ProviderFactory, ProviderName
+
+from .logging import logger
+
+PROBE_TIMEOUT = 2.0
+# A model that just answered is resident, so refreshing its keep-alive returns at once
+REFRESH_TIMEOUT = 10.0
+# Loading a large model from disk can take minutes, but an endpoint that hangs must not hold a thread forever
+PRELOAD_TIMEOUT = 300.0
+
+
+def _ollama_model_name(model: str) -> str | None:
+    """Return the Ollama model name with an explicit tag, or None if the model is not served by Ollama."""
+    provider, model_name = ProviderFactory.split_model_provider(model)
+    if provider != ProviderName.OLLAMA:
+        return None
+    return model_name if ":" in model_name else f"{model_name}:latest"
+
+
+def parse_keep_alive(keep_alive: str | None) -> float | str | None:
+    """Convert a keep-alive value to the form Ollama expects.
+
+    Plain numbers are seconds (`-1` keeps the model loaded indefinitely), anything else is a duration
+    string such as `30m`.
+    """
+    if keep_alive is None:
+        return None
+    try:
+        return float(keep_alive)
+    except ValueError:
+        return keep_alive
+
+
+def is_model_loaded(model: str, api_base: str) -> bool | None:
+    """Check whether a model is currently resident on an Ollama endpoint.
+
+    Args:
+        model: The LLM model in `<provider>:<model>` format.
+        api_base: The provider's API base URL.
+
+    Returns:
+        True if the model is loaded, False if it is not, and None if the state cannot be determined,
+        for example because the provider is not Ollama or the endpoint is unreachable.
+    """
+    model_name = _ollama_model_name(model)
+    if model_name is None:
+        return None
+
+    try:
+        from ollama import Client
+
+        running = Client(host=str(api_base), timeout=PROBE_TIMEOUT).ps()
+    except Exception as e:
+        logger.debug("Could not query loaded models at {}: {}", api_base, e)
+        return None
+
+    return any(loaded.model == model_name or loaded.name == model_name for loaded in running.models)
+
+
+def preload_model(
+    model: str, api_base: str, keep_alive: str | None = None, timeout: float | None = None
+) -> float | None:
+    """Load a model on an Ollama endpoint and keep it resident.
+
+    Sending a request without a prompt makes Ollama load the model, or refresh its expiry if it is
+    already loaded, without generating anything.
+
+    Args:
+        model: The LLM model in `<provider>:<model>` format.
+        api_base: The provider's API base URL.
+        keep_alive: How long to keep the model loaded, e.g. `30m` or `-1`. Uses the server default if None.
+        timeout: Timeout of the request in seconds, None to wait as long as loading takes.
+
+    Returns:
+        The time spent loading the model in seconds, or None if the provider is not Ollama.
+
+    Raises:
+        ConnectionError: If the endpoint cannot be reached.
+    """
+    model_name = _ollama_model_name(model)
+    if model_name is None:
+        return None
+
+    from ollama import Client
+
+    try:
+        response = Client(host=str(api_base), timeout=timeout).generate(
+            model=model_name, keep_alive=parse_keep_alive(keep_alive)
+        )
+    except ConnectionError as e:
+        raise ConnectionError(f"Failed to connect to Ollama at {api_base}. Please check your `.env` file.") from e
+
+    load_seconds = (response.load_duration or 0) / 1e9
+    logger.debug("Preloaded {} at {} in {:.2f} s (keep_alive={})", model_name, api_base, load_seconds, keep_alive)
+    return load_seconds
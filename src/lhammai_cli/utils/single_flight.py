@@ -0,0 +1,197 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from collections.abc import Callable
+from concurrent.futures import Future, wait
+from pathlib import Path
+from typing import Any
+
+from .logging import logger
+
+try:
+    import fcntl
+except ImportError:  # Windows: requests are only coalesced within a process
+    fcntl = None
+
+# How often a waiting request checks whether the leader is done, or whether it should stop waiting, in seconds
+POLL_INTERVAL = 0.1
+# How long a leader waits for the requests waiting on it to read its response before removing it, in seconds
+READ_GRACE = 2.0
+# Lock and result files untouched for this long are removed, in seconds
+PRUNE_AGE = 3600.0
+
+
+class SingleFlight:
+    """Coalesce identical in-flight requests, so that only one of them reaches the endpoint.
+
+    The first caller for a key, the leader, runs the request; callers in the same process wait on
+    it in memory, and callers in other processes wait on an exclusive lock on
+    `<directory>/<key>.lock`. When the leader succeeds, it writes the response to
+    `<directory>/<key>.json` and every waiting caller receives it. When it fails, the next caller
+    runs the request itself, so errors and timeouts are never shared.
+
+    Callers in other processes hold a shared lock on `<directory>/<key>.readers` until they have
+    read the response, and the leader removes the response once it can take that lock
+    exclusively, or after `READ_GRACE` seconds, so responses do not linger on disk.
+    """
+
+    def __init__(self, directory: Path | None = None):
+        """Initialize the coalescer.
+
+        Args:
+            directory: Directory holding the lock and result files, or None to coalesce requests
+                within the process only
+        """
+        self.directory = directory
+        self._lock = threading.Lock()
+        self._calls: dict[str, Future[str | None]] = {}
+
+    @staticmethod
+    def key(model: str, api_base: str, messages: list[dict[str, str]]) -> str:
+        """Identify a request by what determines its response."""
+        request = json.dumps({"model": model, "api_base": api_base, "messages": messages}, sort_keys=True)
+        return hashlib.sha256(request.encode("utf-8")).hexdigest()[:32]
+
+    def do(
+        self, key: str, send: Callable[[], str | None], check: Callable[[], None] | None = None
+    ) -> tuple[str | None, bool]:
+        """Send a request, unless an identical one is in flight, and return its response.
+
+        Args:
+            key: The key of the request, see `key`
+            send: Sends the request and returns its response
+            check: Called while waiting for another caller's request, raising to stop waiting, e.g.
+                on a deadline or a cancellation
+
+        Returns:
+            The response, and whether it was received by another caller
+        """
+        while True:
+            with self._lock:
+                call = self._calls.get(key)
+                leader = call is None
+                if leader:
+                    call = self._calls[key] = Future()
+            if leader:
+                break
+
+            while not wait([call], timeout=POLL_INTERVAL).done:
+                if check is not None:
+                    check()
+            if call.exception() is None:
+                logger.debug("Coalesced request {} with one in flight in this process", key)
+                return call.result(), True
+
+        try:
+            response, shared = self._do_across_processes(key, send, check)
+        except BaseException as e:
+            call.set_exception(e)
+            raise
+        else:
+            call.set_result(response)
+            return response, shared
+        finally:
+            with self._lock:
+                del self._calls[key]
+
+    def _do_across_processes(
+        self, key: str, send: Callable[[], str | None], check: Callable[[], None] | None
+    ) -> tuple[str | None, bool]:
+        """Send a request, unless another process is sending an identical one, and return its response."""
+        if self.directory is None or fcntl is None:
+            return send(), False
+
+        self.directory.mkdir(parents=True, exist_ok=True)
+        result_file = self.directory / f"{key}.json"
+        started = time.time()
+        with (
+            (self.directory / f"{key}.lock").open("a") as lock_file,
+            (self.directory / f"{key}.readers").open("a") as readers_file,
+        ):
+            # Taken before the request lock, so a leader never removes a response this caller may still read
+            fcntl.flock(readers_file, fcntl.LOCK_SH)
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                logger.debug("Waiting for another process sending request {}", key)
+                self._wait_for_lock(lock_file, check)
+                result = self._read_result(result_file, started)
+                if result is not None:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+                    logger.debug("Coalesced request {} with one in flight in another process", key)
+                    return result["response"], True  # closing the readers file releases its lock
+                # The other process failed, so this one sends the request itself
+            fcntl.flock(readers_file, fcntl.LOCK_UN)
+
+            try:
+                os.utime(lock_file.fileno())  # keeps the lock file from being pruned
+                response = send()
+                self._write_result(result_file, response)
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+            self._remove_result(result_file, readers_file)
+
+        self._prune()
+        return response, False
+
+    @staticmethod
+    def _wait_for_lock(lock_file: Any, check: Callable[[], None] | None) -> None:
+        """Take the lock on a file, calling `check` between attempts."""
+        while True:
+            if check is not None:
+                check()
+            time.sleep(POLL_INTERVAL)
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                return
+            except BlockingIOError:
+                continue
+
+    @staticmethod
+    def _read_result(result_file: Path, since: float) -> dict[str, Any] | None:
+        """Read the response written by another process, if it was written after `since`."""
+        try:
+            if result_file.stat().st_mtime < since:
+                return None
+            with result_file.open(encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    @staticmethod
+    def _remove_result(result_file: Path, readers_file: Any) -> None:
+        """Remove a response once the processes waiting on it have read it, or after `READ_GRACE` seconds."""
+        deadline = time.monotonic() + READ_GRACE
+        while True:
+            try:
+                fcntl.flock(readers_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                break
+            except BlockingIOError:
+                if time.monotonic() > deadline:
+                    logger.debug("Removing response {} before every waiting process read it", result_file.stem)
+                    break
+                time.sleep(POLL_INTERVAL / 10)
+        try:
+            result_file.unlink(missing_ok=True)
+        finally:
+            fcntl.flock(readers_file, fcntl.LOCK_UN)
+
+    @staticmethod
+    def _write_result(result_file: Path, response: str | None) -> None:
+        """Write a response for the processes waiting on it."""
+        temp_file = result_file.with_name(f"{result_file.name}.{os.getpid()}.tmp")
+        with temp_file.open("w", encoding="utf-8") as f:
+            json.dump({"response": response}, f, ensure_ascii=False)
+        temp_file.replace(result_file)
+
+    def _prune(self) -> None:
+        """Remove the lock and result files of requests that were last sent long ago."""
+        cutoff = time.time() - PRUNE_AGE
+        for path in self.directory.iterdir():
+            try:
+                if path.stat().st_mtime < cutoff:
+                    path.unlink()
+            except OSError:
+                continue
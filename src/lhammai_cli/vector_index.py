@@ -0,0 +1,238 @@
+import json
+from pathlib import Path
+
+try:
+    import numpy as np
+
+    PACKAGES_INSTALLED = True
+except ImportError:
+    PACKAGES_INSTALLED = False
+
+from lhammai_cli.schema import Conversation
+from lhammai_cli.utils import get_embeddings, locked, logger
+
+MessageKey = tuple[str, int]
+
+EMBEDDING_BATCH_SIZE = 64
+
+
+class VectorIndex:
+    """Append-only on-disk index of message embeddings, searched with cosine similarity.
+
+    The index directory holds three files:
+
+    - `vectors.f32`: a row-major float32 matrix of L2-normalized embeddings, one row per message
+    - `keys.jsonl`: the `[conversation_uuid, message_index]` key of each row, in the same order
+    - `meta.json`: the embedding model and vector dimension
+
+    New rows are appended to both files, so saving a conversation never rewrites the index. Writes
+    hold an exclusive lock on `index.lock`, so concurrent processes never interleave their appends,
+    and first truncate both files to the rows they have in common, so a write that was interrupted
+    between the two files never pairs later keys with the wrong vectors. Readers ignore the rows
+    that are only in one of the files.
+
+    Removing messages replaces their keys with `null` rather than deleting their rows, so that only
+    the keys file is rewritten, atomically, and the remaining rows keep their vectors.
+    """
+
+    def __init__(self, directory: Path, model: str):
+        """Initialize the index.
+
+        Args:
+            directory: Directory holding the index files
+            model: The embedding model the vectors are produced with
+
+        Raises:
+            ImportError: If NumPy is not installed
+        """
+        if not PACKAGES_INSTALLED:
+            raise ImportError('Semantic search requires NumPy. Install it with `pip install "lhammai-cli[semantic]"`.')
+
+        self.directory = directory
+        self.model = model
+        self._vectors_file = directory / "vectors.f32"
+        self._keys_file = directory / "keys.jsonl"
+        self._meta_file = directory / "meta.json"
+        self._lock_file = directory / "index.lock"
+
+    def _read_meta(self) -> dict | None:
+        """Read the index metadata, or None if the index is empty."""
+        if not self._meta_file.exists():
+            return None
+        with self._meta_file.open(encoding="utf-8") as f:
+            return json.load(f)
+
+    def _check_model(self, meta: dict | None) -> None:
+        """Make sure the stored vectors were produced by the configured embedding model."""
+        if meta is not None and meta["model"] != self.model:
+            raise ValueError(
+                f"The index was built with '{meta['model']}', not '{self.model}'. "
+                "Run `lhammai history index --rebuild` to re-embed the history."
+            )
+
+    @staticmethod
+    def _parse_key(line: str | bytes) -> MessageKey | None:
+        """Parse a line of the keys file, None for a removed message."""
+        key = json.loads(line)
+        return tuple(key) if key is not None else None  # type: ignore[return-value]
+
+    def _read_keys(self) -> list[MessageKey | None]:
+        """Read the keys of the indexed messages, None for the rows of removed messages."""
+        if not self._keys_file.exists():
+            return []
+        with self._keys_file.open(encoding="utf-8") as f:
+            return [self._parse_key(line) for line in f if line.strip()]
+
+    def _load(self) -> tuple[list[MessageKey | None], "np.ndarray"]:
+        """Memory-map the stored vectors together with their keys."""
+        meta = self._read_meta()
+        self._check_model(meta)
+        keys = self._read_keys()
+        if meta is None or not keys or not self._vectors_file.exists() or self._vectors_file.stat().st_size == 0:
+            return [], np.empty((0, 0), dtype=np.float32)
+
+        dim = meta["dim"]
+        matrix = np.memmap(self._vectors_file, dtype=np.float32, mode="r")
+        rows = min(len(keys), matrix.shape[0] // dim)
+        return keys[:rows], matrix[: rows * dim].reshape(rows, dim)
+
+    def _repair(self, dim: int) -> list[MessageKey | None]:
+        """Truncate the vectors and keys files to the rows they have in common. Called with the lock held.
+
+        Returns:
+            The keys of the rows that are kept
+        """
+        data = self._keys_file.read_bytes() if self._keys_file.exists() else b""
+        lines = data.split(b"\n")[:-1]  # the last item is an incomplete line, if any
+        vectors_size = self._vectors_file.stat().st_size if self._vectors_file.exists() else 0
+        row_size = dim * np.dtype(np.float32).itemsize
+        rows = min(len(lines), vectors_size // row_size)
+
+        keys_size = sum(len(line) + 1 for line in lines[:rows])
+        if keys_size != len(data) or rows * row_size != vectors_size:
+            logger.warning("Repairing the semantic index after an interrupted write, keeping {} rows", rows)
+            with self._keys_file.open("ab") as f:
+                f.truncate(keys_size)
+            with self._vectors_file.open("ab") as f:
+                f.truncate(rows * row_size)
+        return [self._parse_key(line) for line in lines[:rows]]
+
+    def indexed_keys(self) -> set[MessageKey]:
+        """Return the keys of all indexed messages."""
+        return {key for key in self._read_keys() if key is not None}
+
+    def add(self, keys: list[MessageKey], vectors: list[list[float]]) -> None:
+        """Append embeddings to the index.
+
+        Args:
+            keys: The `(conversation_uuid, message_index)` key of each vector
+            vectors: The embedding vectors
+        """
+        if not keys:
+            return
+
+        matrix = np.asarray(vectors, dtype=np.float32)
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        matrix /= np.where(norms == 0, 1, norms)
+
+        with locked(self._lock_file):
+            meta = self._read_meta()
+            self._check_model(meta)
+            if meta is None:
+                with self._meta_file.open("w", encoding="utf-8") as f:
+                    json.dump({"model": self.model, "dim": matrix.shape[1]}, f)
+            elif meta["dim"] != matrix.shape[1]:
+                raise ValueError(f"Expected {meta['dim']}-dimensional embeddings, got {matrix.shape[1]}")
+
+            # Another process may have indexed the same messages since the caller looked
+            indexed = set(self._repair(matrix.shape[1]))
+            new = [i for i, key in enumerate(keys) if key not in indexed]
+            with self._vectors_file.open("ab") as f:
+                f.write(matrix[new].tobytes())
+            with self._keys_file.open("a", encoding="utf-8") as f:
+                f.writelines(json.dumps(list(keys[i])) + "\n" for i in new)
+
+        logger.debug("Indexed {} messages", len(new))
+
+    def search(self, query: list[float], top_k: int = 5) -> list[tuple[MessageKey, float]]:
+        """Find the messages most similar to a query embedding.
+
+        Args:
+            query: The query embedding
+            top_k: The maximum number of results
+
+        Returns:
+            `(key, score)` pairs sorted by decreasing cosine similarity
+        """
+        keys, matrix = self._load()
+        live = [i for i, key in enumerate(keys) if key is not None]
+        if not live:
+            return []
+
+        vector = np.asarray(query, dtype=np.float32)
+        vector /= np.linalg.norm(vector) or 1
+        scores = np.full(len(keys), -np.inf, dtype=np.float32)
+        scores[live] = matrix[live] @ vector
+
+        top_k = min(top_k, len(live))
+        best = np.argpartition(-scores, top_k - 1)[:top_k]
+        best = best[np.argsort(-scores[best])]
+        return [(keys[i], float(scores[i])) for i in best]
+
+    def remove(self, conversation_uuids: set[str]) -> int:
+        """Remove the messages of conversations from the index.
+
+        Args:
+            conversation_uuids: UUIDs of the conversations whose messages to remove
+
+        Returns:
+            The number of removed messages
+        """
+        if not self._keys_file.exists():
+            return 0
+
+        with locked(self._lock_file):
+            meta = self._read_meta()
+            keys = self._repair(meta["dim"]) if meta is not None else self._read_keys()
+            removed = sum(1 for key in keys if key is not None and key[0] in conversation_uuids)
+            if removed:
+                temp_file = self._keys_file.with_suffix(".jsonl.tmp")
+                with temp_file.open("w", encoding="utf-8") as f:
+                    f.writelines(
+                        json.dumps(list(key) if key is not None and key[0] not in conversation_uuids else None) + "\n"
+                        for key in keys
+                    )
+                temp_file.replace(self._keys_file)
+
+        logger.debug("Removed {} messages from the index", removed)
+        return removed
+
+    def clear(self) -> None:
+        """Remove all indexed vectors."""
+        with locked(self._lock_file):
+            for path in (self._vectors_file, self._keys_file, self._meta_file):
+                path.unlink(missing_ok=True)
+
+    def index_conversations(self, conversations: dict[str, Conversation], api_base: str) -> int:
+        """Embed and index the messages that are not in the index yet.
+
+        Args:
+            conversations: Conversations keyed by UUID
+            api_base: The provider's API base URL
+
+        Returns:
+            The number of newly indexed messages
+        """
+        indexed = self.indexed_keys()
+        keys: list[MessageKey] = []
+        texts: list[str] = []
+        for uuid_str, conversation in conversations.items():
+            for i, message in enumerate(conversation.messages):
+                if (uuid_str, i) not in indexed and message.content.strip():
+                    keys.append((uuid_str, i))
+                    texts.append(message.content)
+
+        for start in range(0, len(texts), EMBEDDING_BATCH_SIZE):
+            batch = slice(start, start + EMBEDDING_BATCH_SIZE)
+            self.add(keys[batch], get_embeddings(texts[batch], self.model, api_base))
+        return len(keys)
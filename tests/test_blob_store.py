@@ -0,0 +1,71 @@
+import os
+import threading
+from collections import Counter
+
+import pytest
+
+from lhammai_cli.blob_store import BlobStore
+from lhammai_cli.utils import locked
+
+
+@pytest.fixture
+def blobs(tmp_path) -> BlobStore:
+    """Create an empty blob store in a temporary directory."""
+    return BlobStore(tmp_path / "blobs", threshold=16)
+
+
+def test_put_stores_identical_content_once(blobs):
+    """Test that blobs are addressed by content."""
+    digest = blobs.put("some large content")
+
+    assert blobs.put("some large content") == digest
+    assert blobs.get(digest) == "some large content"
+    assert len(list(blobs.directory.glob("??/*"))) == 1
+
+
+def test_get_missing_blob(blobs):
+    """Test that reading a blob that does not exist fails."""
+    with pytest.raises(FileNotFoundError):
+        blobs.get("0" * 64)
+
+
+def test_gc_removes_unreferenced_blobs(blobs):
+    """Test that only the blobs without references are removed."""
+    kept = blobs.put("referenced content")
+    dropped = blobs.put("unreferenced content")
+    blobs.set_refcounts(Counter({kept: 2}))
+
+    removed, freed = blobs.gc(min_age=0)
+
+    assert (removed, freed) == (1, len("unreferenced content"))
+    assert blobs.get(kept) == "referenced content"
+    with pytest.raises(FileNotFoundError):
+        blobs.get(dropped)
+
+
+def test_gc_spares_recent_blobs(blobs):
+    """Test that blobs stored recently survive, as their history may not be saved yet."""
+    recent = blobs.put("just stored content")
+    old = blobs.put("stored long ago content")
+    path = blobs.directory / old[:2] / old
+    os.utime(path, (0, 0))
+
+    assert blobs.gc(min_age=60) == (1, len("stored long ago content"))
+    assert blobs.get(recent) == "just stored content"
+
+
+def test_refcount_updates_wait_for_the_lock(tmp_path):
+    """Test that reference counts are not replaced while another writer holds the lock."""
+    lock_file = tmp_path / "history.json.lock"
+    blobs = BlobStore(tmp_path / "blobs", threshold=16, lock_file=lock_file)
+    digest = blobs.put("some large content")
+
+    with locked(lock_file):
+        writer = threading.Thread(target=blobs.set_refcounts, args=(Counter({digest: 1}),))
+        writer.start()
+        writer.join(0.2)
+        assert writer.is_alive()
+        assert blobs.refcounts() == {}
+    writer.join()
+
+    assert blobs.refcounts() == {digest: 1}
@@ -0,0 +1,92 @@
+import asyncio
+from collections.abc import AsyncIterator
+from pathlib import Path
+from unittest.mock import patch
+
+import pytest
+from any_llm.types.completion import ChatCompletion, ChatCompletionChunk, ChoiceDelta, ChunkChoice
+
+from lhammai_cli.utils import Cassette, get_llm_response
+
+
+async def _stream(tokens: list[str]) -> AsyncIterator[ChatCompletionChunk]:
+    """Stream tokens the way a provider does."""
+    for token in tokens:
+        yield ChatCompletionChunk(
+            id="chunk",
+            choices=[ChunkChoice(delta=ChoiceDelta(content=token), index=0)],
+            created=1677652288,
+            model="gemma3:4b",
+            object="chat.completion.chunk",
+        )
+
+
+def test_replay_recorded_stream(tmp_path: Path) -> None:
+    """Test that a recorded stream is replayed token by token without querying the provider."""
+    recorded: list[str] = []
+    with patch("lhammai_cli.utils.llm_utils.acompletion", return_value=_stream(["Hello", " world"])):
+        response = get_llm_response(
+            "Hello!",
+            "ollama:gemma3:4b",
+            "http://localhost:11434",
+            on_token=recorded.append,
+            cassette=Cassette(tmp_path, "record"),
+        )
+    assert response == "Hello world"
+    assert len(list(tmp_path.glob("*.json"))) == 1
+
+    replayed: list[str] = []
+    with patch("lhammai_cli.utils.llm_utils.acompletion") as mock_completion:
+        response = get_llm_response(
+            "Hello!",
+            "ollama:gemma3:4b",
+            "http://remote:11434",
+            on_token=replayed.append,
+            cassette=Cassette(tmp_path, "replay", speed=0),
+        )
+
+    assert response == "Hello world"
+    assert replayed == recorded == ["Hello", " world"]
+    mock_completion.assert_not_called()
+
+
+def test_replay_recorded_completion(tmp_path: Path, mock_llm_response: ChatCompletion) -> None:
+    """Test that a recorded non-streamed response is replayed."""
+    with patch("lhammai_cli.utils.llm_utils.acompletion", return_value=mock_llm_response):
+        get_llm_response("Hello!", "ollama:gemma3:4b", "http://localhost:11434", cassette=Cassette(tmp_path, "record"))
+
+    response = get_llm_response(
+        "Hello!", "ollama:gemma3:4b", "http://localhost:11434", cassette=Cassette(tmp_path, "replay", speed=0)
+    )
+
+    assert response == "This is a mock response!"
+
+
+def test_interrupted_stream_not_recorded(tmp_path: Path) -> None:
+    """Test that a stream that was not read to the end is not recorded."""
+
+    async def stalled() -> AsyncIterator[ChatCompletionChunk]:
+        async for chunk in _stream(["Hello"]):
+            yield chunk
+        await asyncio.sleep(60)
+
+    with patch("lhammai_cli.utils.llm_utils.acompletion", return_value=stalled()):
+        with pytest.raises(TimeoutError):
+            get_llm_response(
+                "Hello!",
+                "ollama:gemma3:4b",
+                "http://localhost:11434",
+                on_token=lambda _: None,
+                timeout=0.2,
+                cassette=Cassette(tmp_path, "record"),
+            )
+
+    assert list(tmp_path.glob("*.json")) == []
+
+
+def test_replay_unrecorded_request(tmp_path: Path) -> None:
+    """Test that replaying a request that was never recorded fails."""
+    with pytest.raises(FileNotFoundError, match="No response to this request was recorded"):
+        get_llm_response(
+            "Something else", "ollama:gemma3:4b", "http://localhost:11434", cassette=Cassette(tmp_path, "replay")
+        )
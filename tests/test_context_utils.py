@@ -0,0 +1,83 @@
+import pytest
+
+from lhammai_cli.utils import context_utils
+from lhammai_cli.utils.context_utils import CHARS_PER_TOKEN, expand_file_patterns, load_context, read_file, scan_files
+
+
+@pytest.fixture
+def tree(tmp_path):
+    """Create a small source tree."""
+    (tmp_path / "pkg").mkdir()
+    (tmp_path / "pkg" / "a.py").write_text("print('a')\n", encoding="utf-8")
+    (tmp_path / "pkg" / "b.py").write_text("print('b')\n", encoding="utf-8")
+    (tmp_path / "pkg" / "copy.py").write_text("print('a')\n", encoding="utf-8")
+    (tmp_path / "notes.md").write_text("# Notes\n", encoding="utf-8")
+    return tmp_path
+
+
+def test_expand_file_patterns(tree):
+    """Test that globs, directories and plain paths expand to unique files in order."""
+    paths = expand_file_patterns([str(tree / "notes.md"), str(tree / "**" / "*.py"), str(tree / "pkg")])
+
+    assert [path.name for path in paths] == ["notes.md", "a.py", "b.py", "copy.py"]
+
+
+def test_expand_file_patterns_without_match(tree):
+    """Test that a pattern matching nothing is an error rather than silently ignored."""
+    with pytest.raises(FileNotFoundError):
+        expand_file_patterns([str(tree / "*.rs")])
+
+
+def test_load_context_deduplicates_identical_files(tree):
+    """Test that files with identical content are included once."""
+    context = load_context([str(tree / "pkg")], budget_tokens=1000)
+
+    assert (context.files, context.duplicates, context.truncated) == (2, 1, 0)
+    assert context.text.count("print('a')") == 1
+    assert "same content as" in context.text
+
+
+def test_load_context_shares_the_budget(tmp_path):
+    """Test that small files are kept whole and large ones are truncated to fit the budget."""
+    (tmp_path / "small.txt").write_text("tiny", encoding="utf-8")
+    (tmp_path / "large1.txt").write_text("@" * 10_000, encoding="utf-8")
+    (tmp_path / "large2.txt").write_text("%" * 10_000, encoding="utf-8")
+
+    context = load_context([str(tmp_path / "*.txt")], budget_tokens=500)
+
+    assert "tiny" in context.text
+    assert context.truncated == 2
+    assert len(context.text) <= 500 * CHARS_PER_TOKEN
+    assert abs(context.text.count("@") - context.text.count("%")) <= 1
+
+
+def test_scan_files_memory_maps_large_files(tmp_path, monkeypatch):
+    """Test that large files are hashed through a memory map, and only read up to the requested size."""
+    monkeypatch.setattr(context_utils, "MMAP_THRESHOLD", 16)
+    (tmp_path / "big.log").write_text("line\n" * 100, encoding="utf-8")
+    (tmp_path / "image.png").write_bytes(b"\x89PNG\0\0\0")
+
+    [info] = scan_files([tmp_path / "big.log", tmp_path / "image.png"])
+    content = read_file(info, max_chars=12)
+
+    assert info.size == 500
+    assert content.text == "line\nline\nli"
+    assert content.truncated
+
+
+def test_load_context_reads_only_the_shares(tmp_path, monkeypatch):
+    """Test that no more of a file is read than its share of the budget."""
+    (tmp_path / "large1.txt").write_text("@" * 100_000, encoding="utf-8")
+    (tmp_path / "large2.txt").write_text("%" * 100_000, encoding="utf-8")
+    requested: list[int] = []
+    original_read_file = context_utils.read_file
+
+    def spy(info, max_chars):
+        requested.append(max_chars)
+        return original_read_file(info, max_chars)
+
+    monkeypatch.setattr(context_utils, "read_file", spy)
+    load_context([str(tmp_path / "*.txt")], budget_tokens=500)
+
+    assert len(requested) == 2
+    assert sum(requested) <= 500 * CHARS_PER_TOKEN
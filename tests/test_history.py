@@ -1,13 +1,18 @@
 import json
+import subprocess
+import sys
 import threading
+import time
 from datetime import datetime
+from unittest.mock import patch
 from uuid import UUID, uuid4
 
 import pytest
+from pydantic import ValidationError
 
 from lhammai_cli import history
 from lhammai_cli.history import ConversationHistory
-from lhammai_cli.schema import Conversation, ConversationMetadata, Role
+from lhammai_cli.schema import Conversation, ConversationMetadata, Role, TokenUsage
 
 
 class TestConversationHistory:
@@ -88,8 +93,8 @@ class TestConversationHistory:
         assert metadata["message_count"] == 0
         assert "start_time" in metadata
 
-    def test_save_to_disk_and_load_from_disk_bug(self, temp_history_file, monkeypatch):
-        """Test saving conversation to disk and demonstrate load bug."""
+    def test_save_to_disk_and_load_from_disk(self, temp_history_file, monkeypatch):
+        """Test saving conversation to disk and loading it back."""
         monkeypatch.setattr(history, "HISTORY_FILE", temp_history_file)
 
         # Create and save a conversation
@@ -100,12 +105,9 @@ class TestConversationHistory:
         uuid_str = str(history_instance.get_current_uuid())
         history_instance.save_to_disk()
 
-        # Load the conversation back - this will fail due to bug in history.py line 145
-        # The bug is that `uuid not in history` should be `str(uuid) not in history`
-        # Let's verify the bug exists
-        assert uuid_str is not None
-        with pytest.raises(ValueError, match=f"Conversation {uuid_str} not found in history"):
-            ConversationHistory.load_from_disk(UUID(uuid_str))
+        loaded = ConversationHistory.load_from_disk(UUID(uuid_str))
+        assert loaded.get_current_uuid() == UUID(uuid_str)
+        assert [message.content for message in loaded.get_thread()] == ["Hello", "Hi there!"]
 
         # Verify that the conversation was actually saved by checking it directly
         all_history = ConversationHistory.load_history_from_disk()
@@ -156,7 +158,7 @@ class TestConversationHistory:
         # Verify file is deleted
         with temp_history_file.open(mode="r", encoding="utf-8") as f:
             content = f.read()
-        
+
         assert content == "{}"
 
     def test_delete_conversation(self, temp_history_file, monkeypatch):
@@ -310,3 +312,392 @@ class TestConversationHistory:
         conversation = history.get_current_conversation()
         assert len(conversation.messages) == 50
         assert conversation.metadata.message_count == 50
+
+    def test_save_to_disk_indexes_new_messages(self, monkeypatch, tmp_path):
+        """Test that saving a conversation adds its new messages to the semantic index."""
+        pytest.importorskip("numpy")
+        monkeypatch.setattr(history, "HISTORY_FILE", tmp_path / "history.json")
+        monkeypatch.setattr(history.settings, "semantic_index", True)
+
+        history_instance = ConversationHistory.start_new(self.model, self.api_base)
+        history_instance.add_message(Role.USER, "Hello")
+        uuid_str = str(history_instance.get_current_uuid())
+
+        with patch("lhammai_cli.vector_index.get_embeddings", side_effect=lambda texts, *_: [[1.0, 0.0]] * len(texts)):
+            history_instance.save_to_disk()
+            history_instance.add_message(Role.ASSISTANT, "Hi there!")
+            history_instance.save_to_disk()
+
+        assert ConversationHistory.get_vector_index().indexed_keys() == {(uuid_str, 0), (uuid_str, 1)}
+
+    def test_save_to_disk_survives_indexing_failure(self, monkeypatch, tmp_path):
+        """Test that an unreachable embedding endpoint does not prevent saving."""
+        pytest.importorskip("numpy")
+        monkeypatch.setattr(history, "HISTORY_FILE", tmp_path / "history.json")
+        monkeypatch.setattr(history.settings, "semantic_index", True)
+
+        history_instance = ConversationHistory.start_new(self.model, self.api_base)
+        history_instance.add_message(Role.USER, "Hello")
+
+        with patch("lhammai_cli.vector_index.get_embeddings", side_effect=ConnectionError("refused")):
+            history_instance.save_to_disk()
+
+        assert str(history_instance.get_current_uuid()) in ConversationHistory.load_history_from_disk()
+
+
+def test_iter_history_from_disk_streams_in_small_chunks(temp_history_file, monkeypatch):
+    """Test that streaming the history yields the same conversations as loading it at once."""
+    monkeypatch.setattr(history, "HISTORY_FILE", temp_history_file)
+    monkeypatch.setattr(history, "READ_CHUNK_SIZE", 7)
+
+    for content in ("first", 'with "quotes", {braces} and ünïcode', "third"):
+        conversation = ConversationHistory.start_new(model="ollama:gemma3:4b", api_base="http://localhost:11434")
+        conversation.add_message(Role.USER, content)
+        conversation.save_to_disk()
+
+    streamed = dict(ConversationHistory.iter_history_from_disk())
+
+    assert streamed == ConversationHistory.load_history_from_disk()
+    assert [c.messages[0].content for c in streamed.values()][1] == 'with "quotes", {braces} and ünïcode'
+
+
+def test_iter_history_from_disk_filters_by_uuid(conversation_history_with_data):
+    """Test that only the requested conversations are yielded."""
+    conversation_history_with_data.save_to_disk()
+    other = ConversationHistory.start_new(model="ollama:gemma3:4b", api_base="http://localhost:11434")
+    other.save_to_disk()
+
+    uuid_str = str(other.get_current_uuid())
+    assert [key for key, _ in ConversationHistory.iter_history_from_disk([uuid_str])] == [uuid_str]
+
+
+def test_iter_history_from_disk_rejects_invalid_json(temp_history_file, monkeypatch):
+    """Test that a truncated history file raises a JSON error."""
+    monkeypatch.setattr(history, "HISTORY_FILE", temp_history_file)
+    temp_history_file.write_text('{"a": {"metadata": {}', encoding="utf-8")
+
+    with pytest.raises(json.JSONDecodeError):
+        list(ConversationHistory.iter_history_from_disk())
+
+
+def test_import_conversations_skips_existing(conversation_history_with_data):
+    """Test that importing merges new conversations and keeps the existing ones untouched."""
+    conversation_history_with_data.save_to_disk()
+    existing_uuid = str(conversation_history_with_data.get_current_uuid())
+    existing = conversation_history_with_data.get_current_conversation()
+    new = ConversationHistory.start_new(model="ollama:llama3.2:3b", api_base="http://localhost:11434")
+    new.add_message(Role.USER, "Imported")
+    new_uuid = str(new.get_current_uuid())
+
+    imported, skipped = ConversationHistory.import_conversations(
+        [(existing_uuid, new.get_current_conversation()), (new_uuid, new.get_current_conversation())]
+    )
+
+    assert (imported, skipped) == (1, 1)
+    loaded = ConversationHistory.load_history_from_disk()
+    assert loaded[existing_uuid].messages == existing.messages
+    assert loaded[new_uuid].messages[0].content == "Imported"
+
+
+def _wait_for(condition, timeout: float = 2.0) -> bool:
+    """Poll a condition until it holds or the timeout expires."""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition():
+            return True
+        time.sleep(0.01)
+    return condition()
+
+
+def _stored_message_count(uuid: UUID) -> int:
+    """Return the number of messages of a conversation on disk."""
+    conversation = ConversationHistory.load_history_from_disk().get(str(uuid))
+    return len(conversation.messages) if conversation else 0
+
+
+def test_write_behind_coalesces_messages(temp_history_file, monkeypatch):
+    """Test that write-behind mode writes once per batch of messages instead of once per message."""
+    monkeypatch.setattr(history, "HISTORY_FILE", temp_history_file)
+    monkeypatch.setattr(history.settings, "history_flush_interval", 60.0)
+    monkeypatch.setattr(history.settings, "history_flush_messages", 3)
+
+    with patch.object(
+        ConversationHistory,
+        "_save_conversation_to_disk",
+        autospec=True,
+        side_effect=ConversationHistory._save_conversation_to_disk,
+    ) as mock_save:
+        with ConversationHistory.start_new(
+            "ollama:gemma3:4b", "http://localhost:11434", write_behind=True
+        ) as conversation:
+            uuid = conversation.get_current_uuid()
+            conversation.add_message(Role.USER, "one")
+            conversation.add_message(Role.ASSISTANT, "two")
+            time.sleep(0.05)
+            assert _stored_message_count(uuid) == 0
+
+            conversation.add_message(Role.USER, "three")
+            assert _wait_for(lambda: _stored_message_count(uuid) == 3)
+
+            conversation.add_message(Role.ASSISTANT, "four")
+
+    assert _stored_message_count(uuid) == 4
+    assert mock_save.call_count == 2
+
+
+def test_write_behind_flushes_on_interval(temp_history_file, monkeypatch):
+    """Test that pending messages are written after the flush interval even if the batch is not full."""
+    monkeypatch.setattr(history, "HISTORY_FILE", temp_history_file)
+    monkeypatch.setattr(history.settings, "history_flush_interval", 0.05)
+
+    conversation = ConversationHistory.start_new("ollama:gemma3:4b", "http://localhost:11434", write_behind=True)
+    conversation.add_message(Role.USER, "Hello")
+
+    assert _wait_for(lambda: _stored_message_count(conversation.get_current_uuid()) == 1)
+    conversation.close()
+
+
+def test_write_behind_fsyncs_on_close(temp_history_file, monkeypatch):
+    """Test that the 'close' fsync policy only syncs the final flush."""
+    monkeypatch.setattr(history, "HISTORY_FILE", temp_history_file)
+    monkeypatch.setattr(history.settings, "history_flush_interval", 60.0)
+    monkeypatch.setattr(history.settings, "history_fsync", "close")
+
+    with patch("lhammai_cli.history.os.fsync") as mock_fsync:
+        conversation = ConversationHistory.start_new("ollama:gemma3:4b", "http://localhost:11434", write_behind=True)
+        conversation.add_message(Role.USER, "Hello")
+        conversation.flush()
+        mock_fsync.assert_not_called()
+
+        conversation.add_message(Role.ASSISTANT, "Hi")
+        conversation.close()
+        conversation.close()
+
+    mock_fsync.assert_called_once()
+    assert _stored_message_count(conversation.get_current_uuid()) == 2
+
+
+def test_add_message_records_usage(monkeypatch, tmp_path):
+    """Test that the usage of a message is stored with it and added to the rollups."""
+    monkeypatch.setattr(history, "HISTORY_FILE", tmp_path / "history.json")
+
+    conversation = ConversationHistory.start_new(model="ollama:gemma3:4b", api_base="http://localhost:11434")
+    conversation.add_message(Role.USER, "Hi")
+    conversation.add_message(Role.ASSISTANT, "Hello", usage=TokenUsage(prompt_tokens=4, completion_tokens=2))
+    conversation.save_to_disk()
+
+    stored = ConversationHistory.load_history_from_disk()[str(conversation.get_current_uuid())]
+    assert stored.messages[1].usage == TokenUsage(prompt_tokens=4, completion_tokens=2)
+    [(_, model, totals)] = ConversationHistory.get_usage_rollups().query()
+    assert (model, totals.requests, totals.prompt_tokens) == ("ollama:gemma3:4b", 1, 4)
+
+
+def test_snapshots_are_immutable_and_lock_free():
+    """Test that a snapshot does not see later messages and is readable while a writer holds the lock."""
+    conversation = ConversationHistory.start_new(model="ollama:gemma3:4b", api_base="http://localhost:11434")
+    conversation.add_message(Role.USER, "first")
+    snapshot = conversation.get_current_conversation()
+
+    conversation.add_message(Role.ASSISTANT, "second")
+
+    assert [message.content for message in snapshot.messages] == ["first"]
+    assert snapshot.metadata.message_count == 1
+    with pytest.raises(ValidationError):
+        snapshot.messages[0].content = "changed"
+    with pytest.raises(ValidationError):
+        snapshot.metadata.model = "changed"
+
+    with conversation._lock:
+        latest = conversation.get_current_conversation()
+    assert [message.content for message in latest.messages] == ["first", "second"]
+    assert latest.messages[-1:] == [latest.messages[1]]
+
+
+def test_snapshots_while_appending_concurrently():
+    """Test that readers always see a consistent prefix of the messages while another thread appends."""
+    conversation = ConversationHistory.start_new(model="ollama:gemma3:4b", api_base="http://localhost:11434")
+    done = threading.Event()
+
+    def append() -> None:
+        for i in range(500):
+            conversation.add_message(Role.USER, str(i))
+        done.set()
+
+    writer = threading.Thread(target=append)
+    writer.start()
+    while not done.is_set():
+        snapshot = conversation.get_current_conversation()
+        contents = [message.content for message in snapshot.messages]
+        assert contents == [str(i) for i in range(len(contents))]
+        assert snapshot.metadata.message_count == len(contents)
+    writer.join()
+
+    assert len(conversation.get_current_conversation().messages) == 500
+
+
+def _save_conversation(*contents: str) -> ConversationHistory:
+    """Store a conversation alternating user and assistant messages."""
+    conversation = ConversationHistory.start_new(model="ollama:gemma3:4b", api_base="http://localhost:11434")
+    for i, content in enumerate(contents):
+        conversation.add_message(Role.USER if i % 2 == 0 else Role.ASSISTANT, content)
+    conversation.save_to_disk()
+    return conversation
+
+
+def test_fork_shares_the_prefix_on_disk(temp_history_file, monkeypatch):
+    """Test that a fork stores a reference to its parent instead of the inherited messages."""
+    monkeypatch.setattr(history, "HISTORY_FILE", temp_history_file)
+    root = _save_conversation("Hi", "Hello!", "Tell a joke", "No.")
+
+    fork = ConversationHistory.fork(root.get_current_uuid(), 2, "ollama:gemma3:4b", "http://localhost:11434")
+    fork.add_message(Role.USER, "Tell a poem")
+    fork.save_to_disk()
+
+    stored = ConversationHistory.load_history_from_disk()[str(fork.get_current_uuid())]
+    assert [message.content for message in stored.messages] == ["Tell a poem"]
+    assert stored.parent.uuid == str(root.get_current_uuid())
+    assert stored.parent.message_count == 2
+
+    expected = ["Hi", "Hello!", "Tell a poem"]
+    assert [message.content for message in fork.get_thread()] == expected
+    assert [message.content for message in ConversationHistory.load_thread(fork.get_current_uuid())] == expected
+    loaded = ConversationHistory.load_from_disk(fork.get_current_uuid())
+    assert [message.content for message in loaded.get_thread()] == expected
+
+
+def test_fork_of_a_fork(temp_history_file, monkeypatch):
+    """Test that forks can be forked again, inheriting from every ancestor."""
+    monkeypatch.setattr(history, "HISTORY_FILE", temp_history_file)
+    root = _save_conversation("a", "b", "c")
+    child = ConversationHistory.fork(root.get_current_uuid(), 2, "ollama:gemma3:4b", "http://localhost:11434")
+    child.add_message(Role.USER, "d")
+    child.save_to_disk()
+
+    grandchild = ConversationHistory.fork(child.get_current_uuid(), 3, "ollama:gemma3:4b", "http://localhost:11434")
+    grandchild.add_message(Role.ASSISTANT, "e")
+    grandchild.save_to_disk()
+
+    thread = ConversationHistory.load_thread(grandchild.get_current_uuid())
+    assert [message.content for message in thread] == ["a", "b", "d", "e"]
+
+
+def test_fork_beyond_the_end_is_rejected(temp_history_file, monkeypatch):
+    """Test that a conversation cannot be forked after its last message."""
+    monkeypatch.setattr(history, "HISTORY_FILE", temp_history_file)
+    root = _save_conversation("Hi", "Hello!")
+
+    with pytest.raises(ValueError, match="it has 2 messages"):
+        ConversationHistory.fork(root.get_current_uuid(), 3, "ollama:gemma3:4b", "http://localhost:11434")
+
+
+def test_delete_conversation_keeps_its_forks(temp_history_file, monkeypatch):
+    """Test that deleting a conversation moves the messages its forks inherit into them."""
+    monkeypatch.setattr(history, "HISTORY_FILE", temp_history_file)
+    root = _save_conversation("a", "b", "c")
+    fork = ConversationHistory.fork(root.get_current_uuid(), 2, "ollama:gemma3:4b", "http://localhost:11434")
+    fork.add_message(Role.USER, "d")
+    fork.save_to_disk()
+
+    assert ConversationHistory.delete_conversation(str(root.get_current_uuid()))
+
+    stored = ConversationHistory.load_history_from_disk()[str(fork.get_current_uuid())]
+    assert stored.parent is None
+    assert [message.content for message in stored.messages] == ["a", "b", "d"]
+    assert stored.metadata.message_count == 3
+
+
+def test_delete_conversation_reindexes_its_forks(monkeypatch, tmp_path):
+    """Test that the forks of a deleted conversation are indexed under their new message positions."""
+    pytest.importorskip("numpy")
+    monkeypatch.setattr(history, "HISTORY_FILE", tmp_path / "history.json")
+    monkeypatch.setattr(history.settings, "semantic_index", True)
+    embeddings = {"a": [1.0, 0.0, 0.0], "b": [0.0, 1.0, 0.0], "d": [0.0, 0.0, 1.0]}
+
+    with patch("lhammai_cli.vector_index.get_embeddings", side_effect=lambda texts, *_: [embeddings[t] for t in texts]):
+        root = _save_conversation("a", "b")
+        fork = ConversationHistory.fork(root.get_current_uuid(), 1, "ollama:gemma3:4b", "http://localhost:11434")
+        fork.add_message(Role.USER, "d")
+        fork.save_to_disk()
+        ConversationHistory.delete_conversation(str(root.get_current_uuid()))
+
+    fork_uuid = str(fork.get_current_uuid())
+    vector_index = ConversationHistory.get_vector_index()
+    assert vector_index.indexed_keys() == {(fork_uuid, 0), (fork_uuid, 1)}
+    assert vector_index.search(embeddings["d"], top_k=1) == [((fork_uuid, 1), pytest.approx(1.0))]
+
+
+def test_concurrent_saves_keep_every_conversation(monkeypatch, tmp_path):
+    """Test that simultaneous saves neither fail nor lose conversations, nor leave temporary files behind."""
+    monkeypatch.setattr(history, "HISTORY_FILE", tmp_path / "history.json")
+
+    def save() -> None:
+        _save_conversation("Hi", "Hello!")
+
+    threads = [threading.Thread(target=save) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(ConversationHistory.load_history_from_disk()) == 8
+    assert not list(tmp_path.glob("*.tmp"))
+
+
+SAVE_IN_PROCESS = """
+import sys
+from pathlib import Path
+from lhammai_cli import history
+from lhammai_cli.schema import Role
+history.HISTORY_FILE = Path(sys.argv[1])
+conversation = history.ConversationHistory.start_new("ollama:gemma3:4b", "http://localhost:11434")
+conversation.add_message(Role.USER, "Hi")
+conversation.add_message(Role.ASSISTANT, "Hello " * 2000)
+conversation.save_to_disk()
+"""
+
+
+def test_concurrent_processes_keep_every_conversation(tmp_path):
+    """Test that processes saving at the same moment, like coalesced requests do, lose no conversation."""
+    history_file = tmp_path / "history.json"
+    processes = [
+        subprocess.Popen([sys.executable, "-c", SAVE_IN_PROCESS, str(history_file)], stderr=subprocess.PIPE)
+        for _ in range(6)
+    ]
+    for process in processes:
+        _, stderr = process.communicate(timeout=60)
+        assert process.returncode == 0, stderr.decode()
+
+    assert len(json.loads(history_file.read_text(encoding="utf-8"))) == 6
+
+
+def test_large_messages_are_stored_once_as_blobs(monkeypatch, tmp_path):
+    """Test that large message bodies are replaced by references and shared between conversations."""
+    monkeypatch.setattr(history, "HISTORY_FILE", tmp_path / "history.json")
+    monkeypatch.setattr(history.settings, "blob_threshold", 100)
+    large = "log line\n" * 50
+
+    uuids = [_save_conversation(large, "Looks fine.").get_current_uuid() for _ in range(3)]
+
+    raw = json.loads((tmp_path / "history.json").read_text(encoding="utf-8"))
+    stored = raw[str(uuids[0])]["messages"]
+    assert "content" not in stored[0]
+    assert stored[1]["content"] == "Looks fine."
+    blobs = ConversationHistory.get_blob_store()
+    assert blobs.refcounts() == {stored[0]["content_ref"]: 3}
+
+    loaded = ConversationHistory.load_history_from_disk()[str(uuids[0])]
+    assert loaded.messages[0].content == large
+
+
+def test_collect_garbage_after_deleting_conversations(monkeypatch, tmp_path):
+    """Test that blobs are removed once the last conversation referencing them is deleted."""
+    monkeypatch.setattr(history, "HISTORY_FILE", tmp_path / "history.json")
+    monkeypatch.setattr(history.settings, "blob_threshold", 100)
+    first = _save_conversation("a" * 200)
+    second = _save_conversation("a" * 200)
+
+    ConversationHistory.delete_conversation(str(first.get_current_uuid()))
+    assert ConversationHistory.collect_garbage(min_age=0) == (0, 0)
+
+    ConversationHistory.delete_conversation(str(second.get_current_uuid()))
+    assert ConversationHistory.collect_garbage(min_age=0) == (1, 200)
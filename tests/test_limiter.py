@@ -0,0 +1,148 @@
+import threading
+import time
+from unittest.mock import patch
+
+import pytest
+
+from lhammai_cli.utils import AdaptiveLimiter, GenerationCancelledError, LimiterStore
+from lhammai_cli.utils.limiter import STATE_MAX_AGE, is_overload_error
+
+
+class StatusError(Exception):
+    """An error carrying an HTTP status, like the provider SDKs raise."""
+
+    def __init__(self, status_code: int):
+        """Initialize the error with its status."""
+        super().__init__(f"HTTP {status_code}")
+        self.status_code = status_code
+
+
+def _request(limiter: AdaptiveLimiter, latency: float, key: str = "gemma3:4b") -> None:
+    """Run a request with the given time to the first token."""
+    with limiter.acquire(key) as slot:
+        slot.latency = latency
+
+
+def test_limits_concurrent_requests() -> None:
+    """Test that no more requests run at once than the limit allows."""
+    limiter = AdaptiveLimiter(initial_limit=2)
+    running = peak = 0
+    lock = threading.Lock()
+
+    def request() -> None:
+        nonlocal running, peak
+        with limiter.acquire() as slot:
+            slot.sample = False
+            with lock:
+                running += 1
+                peak = max(peak, running)
+            time.sleep(0.05)
+            with lock:
+                running -= 1
+
+    threads = [threading.Thread(target=request) for _ in range(6)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert peak == 2
+    assert limiter.in_flight == limiter.queue_depth == 0
+
+
+def test_increases_while_latency_is_stable() -> None:
+    """Test that the limit grows by about one per round of requests with a stable latency."""
+    limiter = AdaptiveLimiter(initial_limit=2, max_limit=3)
+    for _ in range(3):
+        _request(limiter, 0.1)
+    assert limiter.limit == 3
+
+    for _ in range(10):
+        _request(limiter, 0.1)
+    assert limiter.limit == 3
+
+
+def test_backs_off_on_rising_latency() -> None:
+    """Test that a latency well above the baseline halves the limit, per key."""
+    limiter = AdaptiveLimiter(initial_limit=8)
+    _request(limiter, 0.1)
+    _request(limiter, 0.5, key="llama3.3:70b")
+    assert limiter.limit == 8
+
+    _request(limiter, 0.5)
+    assert limiter.limit == 4
+
+
+def test_backs_off_once_per_overload() -> None:
+    """Test that overload errors halve the limit, once for the requests sent before the backoff."""
+    limiter = AdaptiveLimiter(initial_limit=8)
+    with limiter.acquire():
+        with pytest.raises(ConnectionError):
+            with limiter.acquire():
+                raise ConnectionError("refused")
+        assert limiter.limit == 4
+        with pytest.raises(StatusError):
+            raise StatusError(503)
+    assert limiter.limit == 4
+
+    with pytest.raises(StatusError):
+        with limiter.acquire():
+            raise StatusError(429)
+    assert limiter.limit == 2
+
+    with pytest.raises(ValueError):
+        with limiter.acquire():
+            raise ValueError("not an overload")
+    assert limiter.limit == 2
+
+
+def test_backs_off_across_runs(tmp_path) -> None:
+    """Test that a latency rise is noticed when each run sends a model a single request."""
+    store = LimiterStore(tmp_path / "limits.json")
+    first = AdaptiveLimiter(initial_limit=4)
+    _request(first, 0.1)
+    store.save("http://localhost:11434", first)
+
+    second = AdaptiveLimiter(initial_limit=4)
+    store.restore("http://localhost:11434", second)
+    assert second.limit == 4
+    _request(second, 0.5)
+
+    assert second.limit == 2
+
+
+def test_ignores_outdated_states(tmp_path) -> None:
+    """Test that the state of a run long ago is not restored."""
+    store = LimiterStore(tmp_path / "limits.json")
+    limiter = AdaptiveLimiter(initial_limit=8)
+    store.save("http://localhost:11434", limiter)
+    with patch("lhammai_cli.utils.limiter.time.time", return_value=time.time() + STATE_MAX_AGE):
+        restored = AdaptiveLimiter(initial_limit=2)
+        store.restore("http://localhost:11434", restored)
+
+    assert restored.limit == 2
+
+
+def test_cancel_while_waiting() -> None:
+    """Test that a request waiting for a slot gives up when it is cancelled."""
+    limiter = AdaptiveLimiter(initial_limit=1)
+    cancel_event = threading.Event()
+    threading.Timer(0.1, cancel_event.set).start()
+
+    with limiter.acquire():
+        with pytest.raises(GenerationCancelledError):
+            with limiter.acquire(cancel_event=cancel_event):
+                pass
+
+    assert limiter.queue_depth == 0
+
+
+def test_is_overload_error() -> None:
+    """Test which errors count as overload signals."""
+    wrapped = RuntimeError("Request failed")
+    wrapped.__cause__ = StatusError(429)
+
+    assert is_overload_error(ConnectionError())
+    assert is_overload_error(wrapped)
+    assert not is_overload_error(StatusError(404))
+    assert not is_overload_error(TimeoutError())
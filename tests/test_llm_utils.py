@@ -1,15 +1,39 @@
+import asyncio
+import threading
+from collections.abc import AsyncIterator
 from unittest.mock import MagicMock, patch
 
 import pytest
-from any_llm.types.completion import ChatCompletion
+from any_llm.types.completion import ChatCompletion, ChatCompletionChunk, ChoiceDelta, ChunkChoice, CompletionUsage
 from ollama._types import ResponseError
 
-from lhammai_cli.utils.llm_utils import get_llm_response
+from lhammai_cli.utils.llm_utils import GenerationCancelledError, get_llm_response
+
+
+async def _stream(chunks: list[ChatCompletionChunk]) -> AsyncIterator[ChatCompletionChunk]:
+    """Stream chunks the way a provider does."""
+    for chunk in chunks:
+        yield chunk
+
+
+async def _stalled_stream(closed: list[bool]) -> AsyncIterator[ChatCompletionChunk]:
+    """Stream one chunk and then stall, recording whether the stream was closed."""
+    try:
+        yield ChatCompletionChunk(
+            id="chunk",
+            choices=[ChunkChoice(delta=ChoiceDelta(content="Hello"), index=0)],
+            created=1677652288,
+            model="gemma3:4b",
+            object="chat.completion.chunk",
+        )
+        await asyncio.sleep(60)
+    finally:
+        closed.append(True)
 
 
 def test_get_llm_response_success(mock_llm_response: ChatCompletion) -> None:
     """Test successful response from the LLM."""
-    with patch("lhammai_cli.utils.llm_utils.completion") as mock_completion:
+    with patch("lhammai_cli.utils.llm_utils.acompletion") as mock_completion:
         mock_completion.return_value = mock_llm_response
 
         model = "ollama:test_model"
@@ -22,13 +46,14 @@ def test_get_llm_response_success(mock_llm_response: ChatCompletion) -> None:
         mock_completion.assert_called_once_with(
             model=model,
             messages=[{"role": "user", "content": prompt}],
-            api_base=api_base
+            api_base=api_base,
+            stream=False,
         )
 
 
 def test_get_llm_response_connection_error() -> None:
     """Test connection error when communicating with the LLM."""
-    with patch("lhammai_cli.utils.llm_utils.completion", side_effect=ConnectionError("Test error")) as mock_completion:
+    with patch("lhammai_cli.utils.llm_utils.acompletion", side_effect=ConnectionError("Test error")) as mock_completion:
         model = "ollama:test_model"
         api_base = "http://localhost:11434"
         prompt = "Hello!"
@@ -39,15 +64,16 @@ def test_get_llm_response_connection_error() -> None:
         mock_completion.assert_called_once_with(
             model=model,
             messages=[{"role": "user", "content": prompt}],
-            api_base=api_base
+            api_base=api_base,
+            stream=False,
         )
 
 
 def test_get_llm_response_streaming_not_implemented() -> None:
     """Test model not found error."""
     with patch(
-        "lhammai_cli.utils.llm_utils.completion",
-        side_effect=ResponseError("model \"test_model\" not found, try pulling it first (status code: 404)")
+        "lhammai_cli.utils.llm_utils.acompletion",
+        side_effect=ResponseError('model "test_model" not found, try pulling it first (status code: 404)'),
     ) as mock_completion:
         model = "ollama:test_model"
         api_base = "http://localhost:11434"
@@ -59,13 +85,14 @@ def test_get_llm_response_streaming_not_implemented() -> None:
     mock_completion.assert_called_once_with(
         model=model,
         messages=[{"role": "user", "content": prompt}],
-        api_base=api_base
+        api_base=api_base,
+        stream=False,
     )
 
 
 def test_get_llm_response_invalid_response() -> None:
     """Test invalid response from the LLM."""
-    with patch("lhammai_cli.utils.llm_utils.completion") as mock_completion:
+    with patch("lhammai_cli.utils.llm_utils.acompletion") as mock_completion:
         mock_completion.return_value = MagicMock()
 
         model = "ollama:test_model"
@@ -78,5 +105,99 @@ def test_get_llm_response_invalid_response() -> None:
     mock_completion.assert_called_once_with(
         model=model,
         messages=[{"role": "user", "content": prompt}],
-        api_base=api_base
+        api_base=api_base,
+        stream=False,
     )
+
+
+def test_get_llm_response_streaming() -> None:
+    """Test that streamed chunks are forwarded to the callback and assembled."""
+    chunks = [
+        ChatCompletionChunk(
+            id="chunk",
+            choices=[ChunkChoice(delta=ChoiceDelta(content=token), index=0)],
+            created=1677652288,
+            model="gemma3:4b",
+            object="chat.completion.chunk",
+        )
+        for token in ["Hello", " world", "!"]
+    ]
+    received: list[str] = []
+
+    with patch("lhammai_cli.utils.llm_utils.acompletion", return_value=_stream(chunks)) as mock_completion:
+        response = get_llm_response("Hello!", "ollama:test_model", "http://localhost:11434", on_token=received.append)
+
+    assert response == "Hello world!"
+    assert received == ["Hello", " world", "!"]
+    assert mock_completion.call_args.kwargs["stream"] is True
+
+
+def test_get_llm_response_reports_usage(mock_llm_response: ChatCompletion) -> None:
+    """Test that the token usage of the completion is passed to the callback."""
+    usages: list[CompletionUsage] = []
+
+    with patch("lhammai_cli.utils.llm_utils.acompletion", return_value=mock_llm_response):
+        get_llm_response("Hello!", "ollama:test_model", "http://localhost:11434", on_usage=usages.append)
+
+    assert [(usage.prompt_tokens, usage.completion_tokens) for usage in usages] == [(3, 7)]
+
+
+def test_get_llm_response_streaming_reports_usage() -> None:
+    """Test that the usage reported on the last streamed chunk is passed to the callback."""
+    chunks = [
+        ChatCompletionChunk(
+            id="chunk",
+            choices=[ChunkChoice(delta=ChoiceDelta(content=token), index=0)],
+            created=1677652288,
+            model="gemma3:4b",
+            object="chat.completion.chunk",
+            usage=usage,
+        )
+        for token, usage in [
+            ("Hello", None),
+            ("!", CompletionUsage(prompt_tokens=5, completion_tokens=2, total_tokens=7)),
+        ]
+    ]
+    usages: list[CompletionUsage] = []
+
+    with patch("lhammai_cli.utils.llm_utils.acompletion", return_value=_stream(chunks)):
+        get_llm_response(
+            "Hello!", "ollama:test_model", "http://localhost:11434", on_token=lambda _: None, on_usage=usages.append
+        )
+
+    assert [(usage.prompt_tokens, usage.completion_tokens) for usage in usages] == [(5, 2)]
+
+
+def test_get_llm_response_timeout_closes_stream() -> None:
+    """Test that a timeout closes the stream after forwarding what was generated."""
+    closed: list[bool] = []
+    received: list[str] = []
+
+    with patch("lhammai_cli.utils.llm_utils.acompletion", return_value=_stalled_stream(closed)) as mock_completion:
+        with pytest.raises(TimeoutError):
+            get_llm_response(
+                "Hello!", "ollama:test_model", "http://localhost:11434", on_token=received.append, timeout=0.2
+            )
+
+    assert received == ["Hello"]
+    assert closed == [True]
+    assert mock_completion.call_args.kwargs["timeout"] == 0.2
+
+
+def test_get_llm_response_cancel_event() -> None:
+    """Test that setting the cancel event from another thread cancels the request."""
+    closed: list[bool] = []
+    cancel_event = threading.Event()
+    threading.Timer(0.2, cancel_event.set).start()
+
+    with patch("lhammai_cli.utils.llm_utils.acompletion", return_value=_stalled_stream(closed)):
+        with pytest.raises(GenerationCancelledError):
+            get_llm_response(
+                "Hello!",
+                "ollama:test_model",
+                "http://localhost:11434",
+                on_token=lambda _: None,
+                cancel_event=cancel_event,
+            )
+
+    assert closed == [True]
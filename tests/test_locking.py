@@ -0,0 +1,44 @@
+import threading
+import time
+from pathlib import Path
+
+from lhammai_cli.utils import locked, temp_path
+
+
+def test_locked_serializes_threads(tmp_path: Path) -> None:
+    """Test that only one thread at a time holds the lock on a file."""
+    lock_file = tmp_path / "state.json.lock"
+    running = peak = 0
+    guard = threading.Lock()
+
+    def hold() -> None:
+        nonlocal running, peak
+        with locked(lock_file):
+            with guard:
+                running += 1
+                peak = max(peak, running)
+            time.sleep(0.02)
+            with guard:
+                running -= 1
+
+    threads = [threading.Thread(target=hold) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert peak == 1
+
+
+def test_locked_is_reentrant(tmp_path: Path) -> None:
+    """Test that a thread holding the lock can take it again, as nested writes do."""
+    lock_file = tmp_path / "state.json.lock"
+    with locked(lock_file), locked(lock_file):
+        pass
+
+
+def test_temp_path_is_next_to_the_file(tmp_path: Path) -> None:
+    """Test that temporary files are created in the directory of the file they replace."""
+    path = tmp_path / "state.json"
+    assert temp_path(path).parent == tmp_path
+    assert temp_path(path).name.startswith("state.json.")
@@ -1,9 +1,17 @@
-from unittest.mock import patch
+import io
+import json
+import threading
+import time
+from unittest.mock import ANY, call, patch
 
+import pytest
+from any_llm.types.completion import CompletionUsage
 from click.testing import CliRunner
 
 from lhammai_cli import history
 from lhammai_cli.main import main
+from lhammai_cli.schema import Role
+from lhammai_cli.utils import LimiterStore
 
 
 def test_main_with_prompt_option(temp_history_file, monkeypatch):
@@ -19,7 +27,18 @@ def test_main_with_prompt_option(temp_history_file, monkeypatch):
 
     assert result.exit_code == 0
     assert return_value in result.output
-    mock_get.assert_called_once_with(prompt, "ollama:gemma3:4b", "http://localhost:11434/")
+    mock_get.assert_called_once_with(
+        prompt,
+        "ollama:gemma3:4b",
+        "http://localhost:11434/",
+        show_spinner=False,
+        on_token=ANY,
+        on_usage=ANY,
+        timeout=None,
+        context=None,
+        cassette=None,
+        single_flight=ANY,
+    )
 
     temp_history_file.unlink()
 
@@ -37,7 +56,18 @@ def test_main_with_stdin_input(temp_history_file, monkeypatch):
 
     assert result.exit_code == 0
     assert return_value in result.output
-    mock_get.assert_called_once_with(stdin_content, "ollama:gemma3:4b", "http://localhost:11434/")
+    mock_get.assert_called_once_with(
+        stdin_content,
+        "ollama:gemma3:4b",
+        "http://localhost:11434/",
+        show_spinner=False,
+        on_token=ANY,
+        on_usage=ANY,
+        timeout=None,
+        context=None,
+        cassette=None,
+        single_flight=ANY,
+    )
 
     temp_history_file.unlink()
 
@@ -56,7 +86,18 @@ def test_main_with_stdin_and_prompt(temp_history_file, monkeypatch):
 
     assert result.exit_code == 0
     assert return_value in result.output
-    mock_get.assert_called_once_with(f"{prompt} {stdin_content}", "ollama:gemma3:4b", "http://localhost:11434/")
+    mock_get.assert_called_once_with(
+        f"{prompt} {stdin_content}",
+        "ollama:gemma3:4b",
+        "http://localhost:11434/",
+        show_spinner=False,
+        on_token=ANY,
+        on_usage=ANY,
+        timeout=None,
+        context=None,
+        cassette=None,
+        single_flight=ANY,
+    )
 
     temp_history_file.unlink()
 
@@ -90,3 +131,553 @@ def test_main_no_response_received(mock_llm_response):
 
     assert result.exit_code == 0
     assert "No response received" in result.output
+
+
+def test_main_fan_out_to_multiple_models(temp_history_file, monkeypatch, tmp_path):
+    """Test that a repeated --model sends the prompt to every model and stores each answer."""
+    monkeypatch.setattr(history, "HISTORY_FILE", temp_history_file)
+
+    runner = CliRunner()
+    prompt = "Hello world!"
+
+    def fake_response(prompt, model, api_base, show_spinner=True, on_usage=None, **kwargs):
+        return f"Answer from {model}"
+
+    with (
+        patch("lhammai_cli.main.get_llm_response", side_effect=fake_response) as mock_get,
+        patch("lhammai_cli.main.limiter_store", LimiterStore(tmp_path / "limits.json")),
+    ):
+        result = runner.invoke(main, ["-p", prompt, "-m", "ollama:gemma3:4b", "-m", "ollama:llama3.2:3b"])
+
+    assert result.exit_code == 0
+    assert "Answer from ollama:gemma3:4b" in result.output
+    assert "Answer from ollama:llama3.2:3b" in result.output
+    assert mock_get.call_count == 2
+
+    conversations = history.ConversationHistory.load_history_from_disk()
+    models = sorted(conversation.metadata.model for conversation in conversations.values())
+    assert models == ["ollama:gemma3:4b", "ollama:llama3.2:3b"]
+    limits = json.loads((tmp_path / "limits.json").read_text(encoding="utf-8"))
+    [state] = limits.values()
+    assert set(state["baselines"]) == {"ollama:gemma3:4b", "ollama:llama3.2:3b"}
+
+    temp_history_file.unlink()
+
+
+def test_main_fan_out_reports_failures_per_model(temp_history_file, monkeypatch, tmp_path):
+    """Test that one failing model does not prevent the others from answering."""
+    monkeypatch.setattr(history, "HISTORY_FILE", temp_history_file)
+
+    runner = CliRunner()
+
+    def fake_response(prompt, model, api_base, show_spinner=True, on_usage=None, **kwargs):
+        if model == "ollama:broken":
+            raise ConnectionError("Connection failed")
+        return "Working answer"
+
+    with (
+        patch("lhammai_cli.main.get_llm_response", side_effect=fake_response),
+        patch("lhammai_cli.main.limiter_store", LimiterStore(tmp_path / "limits.json")),
+    ):
+        result = runner.invoke(main, ["-p", "Hello", "-m", "ollama:broken", "-m", "ollama:gemma3:4b"])
+
+    assert result.exit_code == 0
+    assert "Working answer" in result.output
+    assert "Connection failed" in result.output
+
+    temp_history_file.unlink()
+
+
+def test_main_mismatched_models_and_api_bases():
+    """Test that models and endpoints that cannot be paired are rejected."""
+    runner = CliRunner()
+    args = ["-p", "Hello", "-m", "ollama:a", "-m", "ollama:b", "-m", "ollama:c"]
+    args += ["--api-base", "http://host-a:11434", "--api-base", "http://host-b:11434"]
+
+    result = runner.invoke(main, args)
+
+    assert result.exit_code == 2
+    assert "same number of each" in result.output
+
+
+def test_main_raw_output_streams_tokens(temp_history_file, monkeypatch):
+    """Test that raw mode writes streamed tokens straight to stdout without decorations."""
+    monkeypatch.setattr(history, "HISTORY_FILE", temp_history_file)
+
+    runner = CliRunner()
+
+    def fake_response(prompt, model, api_base, show_spinner=True, on_token=None, on_usage=None, **kwargs):
+        for token in ["Hello", " there", "!"]:
+            on_token(token)
+        return "Hello there!"
+
+    with patch("lhammai_cli.main.get_llm_response", side_effect=fake_response):
+        result = runner.invoke(main, ["-p", "Hi", "--raw"])
+
+    assert result.exit_code == 0
+    assert result.stdout == "Hello there!\n"
+
+    temp_history_file.unlink()
+
+
+def test_main_json_output(temp_history_file, monkeypatch):
+    """Test that JSON mode writes a single JSON object with the response."""
+    monkeypatch.setattr(history, "HISTORY_FILE", temp_history_file)
+
+    runner = CliRunner()
+
+    with patch("lhammai_cli.main.get_llm_response", return_value="Test response."):
+        result = runner.invoke(main, ["-p", "Hi", "--json"])
+
+    assert result.exit_code == 0
+    record = json.loads(result.stdout)
+    assert record["content"] == "Test response."
+    assert record["model"] == "ollama:gemma3:4b"
+    assert record["conversation_uuid"] in history.ConversationHistory.list_conversation_uuids()
+
+    temp_history_file.unlink()
+
+
+def test_main_raw_output_keeps_errors_off_stdout():
+    """Test that errors in raw mode go to stderr so they do not pollute pipelines."""
+    runner = CliRunner()
+
+    with patch("lhammai_cli.main.get_llm_response", side_effect=ConnectionError("Connection failed")):
+        result = runner.invoke(main, ["-p", "Hello", "--raw"])
+
+    assert result.stdout == ""
+    assert "Connection failed" in result.stderr
+
+
+def test_main_records_cold_start(temp_history_file, monkeypatch):
+    """Test that the cold/warm state of the model is stored and reported."""
+    monkeypatch.setattr(history, "HISTORY_FILE", temp_history_file)
+
+    runner = CliRunner()
+
+    with (
+        patch("lhammai_cli.main.get_llm_response", return_value="Test response."),
+        patch("lhammai_cli.main.is_model_loaded", return_value=False),
+        patch("lhammai_cli.main.preload_model") as mock_preload,
+    ):
+        result = runner.invoke(main, ["-p", "Hi", "--json", "--keep-alive", "30m"])
+
+    assert result.exit_code == 0
+    assert json.loads(result.stdout)["cold_start"] is True
+    # Once to load the cold model while stdin was read, once to refresh its keep-alive after answering
+    assert mock_preload.call_args_list == [
+        call("ollama:gemma3:4b", "http://localhost:11434/", "30m", timeout=300.0),
+        call("ollama:gemma3:4b", "http://localhost:11434/", "30m", timeout=10.0),
+    ]
+
+    conversation = next(iter(history.ConversationHistory.load_history_from_disk().values()))
+    assert conversation.metadata.cold_start is True
+
+    temp_history_file.unlink()
+
+
+def test_warm_command():
+    """Test that the warm command preloads the model with the requested keep-alive."""
+    runner = CliRunner()
+
+    with (
+        patch("lhammai_cli.main.is_model_loaded", return_value=False),
+        patch("lhammai_cli.main.preload_model", return_value=2.5) as mock_preload,
+    ):
+        result = runner.invoke(main, ["warm", "--keep-alive", "-1"])
+
+    assert result.exit_code == 0
+    assert "is loaded" in result.output
+    assert "2.50s" in result.output
+    mock_preload.assert_called_once_with("ollama:gemma3:4b", "http://localhost:11434/", "-1")
+
+
+def test_warm_command_failure():
+    """Test that the warm command fails when the endpoint is unreachable."""
+    runner = CliRunner()
+
+    with (
+        patch("lhammai_cli.main.is_model_loaded", return_value=None),
+        patch("lhammai_cli.main.preload_model", side_effect=ConnectionError("refused")),
+    ):
+        result = runner.invoke(main, ["warm"])
+
+    assert result.exit_code == 1
+    assert "refused" in result.output
+
+
+def test_history_find_keyword(temp_history_file, monkeypatch):
+    """Test that keyword search lists the matching messages."""
+    monkeypatch.setattr(history, "HISTORY_FILE", temp_history_file)
+
+    conversation = history.ConversationHistory.start_new("ollama:gemma3:4b", "http://localhost:11434")
+    conversation.add_message(Role.USER, "How do I parse TOML in Python?")
+    conversation.add_message(Role.ASSISTANT, "Use the tomllib module.")
+    conversation.save_to_disk()
+
+    runner = CliRunner()
+    result = runner.invoke(main, ["history", "find", "tomllib"])
+
+    assert result.exit_code == 0
+    assert "module." in result.output
+    assert "parse" not in result.output
+
+    temp_history_file.unlink()
+
+
+def test_history_find_semantic(monkeypatch, tmp_path):
+    """Test that semantic search ranks messages with the vector index."""
+    pytest.importorskip("numpy")
+    monkeypatch.setattr(history, "HISTORY_FILE", tmp_path / "history.json")
+
+    conversation = history.ConversationHistory.start_new("ollama:gemma3:4b", "http://localhost:11434")
+    conversation.add_message(Role.USER, "My build keeps failing")
+    conversation.add_message(Role.ASSISTANT, "Check the compiler flags.")
+    conversation.save_to_disk()
+    uuid_str = str(conversation.get_current_uuid())
+
+    history.ConversationHistory.get_vector_index().add([(uuid_str, 0), (uuid_str, 1)], [[1.0, 0.0], [0.0, 1.0]])
+
+    runner = CliRunner()
+    with patch("lhammai_cli.main.get_embeddings", return_value=[[0.9, 0.1]]):
+        result = runner.invoke(main, ["history", "find", "--semantic", "compilation errors", "-k", "1"])
+
+    assert result.exit_code == 0
+    assert "failing" in result.output
+    assert "flags" not in result.output
+
+
+def test_main_serves_cached_response(monkeypatch, tmp_path):
+    """Test that a cached answer is returned without querying the model."""
+    pytest.importorskip("numpy")
+    monkeypatch.setattr(history, "HISTORY_FILE", tmp_path / "history.json")
+
+    runner = CliRunner()
+    with (
+        patch("lhammai_cli.main.APP_DIR", tmp_path),
+        patch("lhammai_cli.response_cache.get_embeddings", return_value=[[1.0, 0.0]]),
+        patch("lhammai_cli.main.get_llm_response", return_value="Paris.") as mock_get,
+    ):
+        runner.invoke(main, ["-p", "Capital of France?", "--json", "--cache"])
+        result = runner.invoke(main, ["-p", "Capital of  France?", "--json", "--cache"])
+
+    assert result.exit_code == 0
+    record = json.loads(result.stdout)
+    assert record["content"] == "Paris."
+    assert record["cached"] is True
+    mock_get.assert_called_once()
+
+
+def test_history_export_and_import(monkeypatch, tmp_path):
+    """Test that exported conversations can be filtered and imported into another history."""
+    monkeypatch.setattr(history, "HISTORY_FILE", tmp_path / "history.json")
+    for model in ("ollama:gemma3:4b", "ollama:llama3.2:3b"):
+        conversation = history.ConversationHistory.start_new(model, "http://localhost:11434")
+        conversation.add_message(Role.USER, f"Hello {model}")
+        conversation.save_to_disk()
+
+    runner = CliRunner()
+    export_file = tmp_path / "export.jsonl"
+    result = runner.invoke(main, ["history", "export", "-m", "ollama:llama3.2:3b", "-o", str(export_file)])
+
+    assert result.exit_code == 0
+    records = [json.loads(line) for line in export_file.read_text(encoding="utf-8").splitlines()]
+    assert [record["metadata"]["model"] for record in records] == ["ollama:llama3.2:3b"]
+
+    monkeypatch.setattr(history, "HISTORY_FILE", tmp_path / "other.json")
+    result = runner.invoke(main, ["history", "import", str(export_file)])
+
+    assert result.exit_code == 0
+    assert history.ConversationHistory.list_conversation_uuids() == [records[0]["uuid"]]
+
+
+def test_history_export_csv(monkeypatch, tmp_path):
+    """Test that the CSV export writes one row per message."""
+    monkeypatch.setattr(history, "HISTORY_FILE", tmp_path / "history.json")
+    conversation = history.ConversationHistory.start_new("ollama:gemma3:4b", "http://localhost:11434")
+    conversation.add_message(Role.USER, "Hi")
+    conversation.add_message(Role.ASSISTANT, "Hello, there")
+    conversation.save_to_disk()
+
+    runner = CliRunner()
+    result = runner.invoke(main, ["history", "export", "--format", "csv", "--since", "2000-01-01"])
+
+    assert result.exit_code == 0
+    lines = result.stdout.splitlines()
+    assert lines[0].startswith("conversation_uuid,model")
+    assert lines[2].endswith('assistant,"Hello, there"')
+
+
+def test_history_export_csv_numbers_fork_messages_within_the_thread(monkeypatch, tmp_path):
+    """Test that the CSV export numbers a fork's messages after those it inherits, as `--fork` does."""
+    monkeypatch.setattr(history, "HISTORY_FILE", tmp_path / "history.json")
+    conversation = history.ConversationHistory.start_new("ollama:gemma3:4b", "http://localhost:11434")
+    conversation.add_message(Role.USER, "Hi")
+    conversation.add_message(Role.ASSISTANT, "Hello")
+    conversation.save_to_disk()
+    fork = history.ConversationHistory.fork(
+        conversation.get_current_uuid(), 2, "ollama:gemma3:4b", "http://localhost:11434"
+    )
+    fork.add_message(Role.USER, "Bye")
+    fork.save_to_disk()
+
+    runner = CliRunner()
+    result = runner.invoke(main, ["history", "export", "--format", "csv", "--uuid", str(fork.get_current_uuid())])
+
+    assert result.exit_code == 0
+    assert result.stdout.splitlines()[1].endswith(",2,user,Bye")
+
+
+def test_main_records_token_usage(monkeypatch, tmp_path):
+    """Test that the reported token usage is printed, stored and summarized by the usage command."""
+    monkeypatch.setattr(history, "HISTORY_FILE", tmp_path / "history.json")
+
+    def fake_response(prompt, model, api_base, show_spinner=True, on_token=None, on_usage=None, **kwargs):
+        on_usage(CompletionUsage(prompt_tokens=12, completion_tokens=3, total_tokens=15))
+        return "Test response."
+
+    runner = CliRunner()
+    with patch("lhammai_cli.main.get_llm_response", side_effect=fake_response):
+        result = runner.invoke(main, ["-p", "Hi", "--json"])
+
+    assert result.exit_code == 0
+    assert json.loads(result.stdout)["usage"] == {"prompt_tokens": 12, "completion_tokens": 3}
+
+    result = runner.invoke(main, ["usage"])
+
+    assert result.exit_code == 0
+    assert "ollama" in result.output
+    assert "15" in result.output
+
+
+def test_main_with_files(monkeypatch, tmp_path):
+    """Test that files passed with --file are appended to the prompt."""
+    monkeypatch.setattr(history, "HISTORY_FILE", tmp_path / "history.json")
+    (tmp_path / "app.py").write_text("def main(): ...\n", encoding="utf-8")
+
+    runner = CliRunner()
+    with patch("lhammai_cli.main.get_llm_response", return_value="Looks fine.") as mock_get:
+        result = runner.invoke(main, ["-p", "Review:", "-f", str(tmp_path / "*.py")], input="")
+
+    assert result.exit_code == 0
+    sent_prompt = mock_get.call_args.args[0]
+    assert sent_prompt.startswith("Review:\n\n")
+    assert "app.py" in sent_prompt
+    assert "def main(): ..." in sent_prompt
+
+
+def test_main_with_missing_files():
+    """Test that a file pattern matching nothing is reported as an error."""
+    runner = CliRunner()
+    result = runner.invoke(main, ["-p", "Review:", "-f", "does-not-exist/*.py"], input="")
+
+    assert result.exit_code == 1
+    assert "No files match" in result.output
+
+
+def test_main_timeout_keeps_partial_response(monkeypatch, tmp_path):
+    """Test that a response cut short by the timeout is stored and marked as truncated."""
+    monkeypatch.setattr(history, "HISTORY_FILE", tmp_path / "history.json")
+
+    def fake_response(prompt, model, api_base, show_spinner=True, on_token=None, on_usage=None, **kwargs):
+        on_token("Once upon")
+        raise TimeoutError("No complete response")
+
+    runner = CliRunner()
+    with patch("lhammai_cli.main.get_llm_response", side_effect=fake_response) as mock_get:
+        result = runner.invoke(main, ["-p", "Tell a story", "--json", "--timeout", "5"])
+
+    assert result.exit_code == 0
+    record = json.loads(result.stdout)
+    assert record["content"] == "Once upon"
+    assert record["truncated"] is True
+    assert mock_get.call_args.kwargs["timeout"] == 5
+
+    (conversation,) = history.ConversationHistory.load_history_from_disk().values()
+    assert conversation.messages[-1].content == "Once upon"
+    assert conversation.messages[-1].truncated
+
+
+def test_main_interrupt_keeps_partial_response(monkeypatch, tmp_path):
+    """Test that Ctrl-C stores the partial response and exits with the interrupt status."""
+    monkeypatch.setattr(history, "HISTORY_FILE", tmp_path / "history.json")
+
+    def fake_response(prompt, model, api_base, show_spinner=True, on_token=None, on_usage=None, **kwargs):
+        on_token("Once upon")
+        raise KeyboardInterrupt
+
+    runner = CliRunner()
+    with patch("lhammai_cli.main.get_llm_response", side_effect=fake_response):
+        result = runner.invoke(main, ["-p", "Tell a story", "--raw"])
+
+    assert result.exit_code == 130
+    assert result.stdout == "Once upon\n"
+
+    (conversation,) = history.ConversationHistory.load_history_from_disk().values()
+    assert conversation.messages[-1].truncated
+
+
+def test_main_fork_continues_a_stored_conversation(monkeypatch, tmp_path):
+    """Test that --fork sends the kept messages before the prompt and stores only the new ones."""
+    monkeypatch.setattr(history, "HISTORY_FILE", tmp_path / "history.json")
+    parent = history.ConversationHistory.start_new("ollama:gemma3:4b", "http://localhost:11434")
+    for role, content in [(Role.USER, "Hi"), (Role.ASSISTANT, "Hello!"), (Role.USER, "Joke?"), (Role.ASSISTANT, "No.")]:
+        parent.add_message(role, content)
+    parent.save_to_disk()
+
+    runner = CliRunner()
+    with patch("lhammai_cli.main.get_llm_response", return_value="A poem.") as mock_get:
+        result = runner.invoke(main, ["-p", "Poem?", "--json", "--fork", f"{parent.get_current_uuid()}:2"])
+
+    assert result.exit_code == 0
+    assert mock_get.call_args.kwargs["context"] == [
+        {"role": "user", "content": "Hi"},
+        {"role": "assistant", "content": "Hello!"},
+    ]
+    record = json.loads(result.stdout)
+    assert record["parent"] == {"uuid": str(parent.get_current_uuid()), "message_count": 2}
+
+    stored = history.ConversationHistory.load_history_from_disk()[record["conversation_uuid"]]
+    assert [message.content for message in stored.messages] == ["Poem?", "A poem."]
+
+
+def test_main_fork_rejects_unknown_conversation(monkeypatch, tmp_path):
+    """Test that forking a conversation that does not exist is reported as an error."""
+    monkeypatch.setattr(history, "HISTORY_FILE", tmp_path / "history.json")
+
+    runner = CliRunner()
+    result = runner.invoke(main, ["-p", "Hi", "--fork", "0b6f1c4e-8d6a-4a53-9b0e-1f7f3c2d9a10:1"], input="")
+
+    assert result.exit_code == 1
+    assert "not found" in result.output
+
+
+def test_history_gc(monkeypatch, tmp_path):
+    """Test that the gc command removes message bodies no conversation references."""
+    monkeypatch.setattr(history, "HISTORY_FILE", tmp_path / "history.json")
+    history.ConversationHistory.get_blob_store().put("an orphaned message body")
+
+    runner = CliRunner()
+    result = runner.invoke(main, ["history", "gc", "--min-age", "0"])
+
+    assert result.exit_code == 0
+    assert "Removed 1 unreferenced" in result.output
+
+
+def test_main_replay_does_not_contact_the_endpoint(monkeypatch, tmp_path):
+    """Test that replaying skips the cold-start probe and the keep-alive refresh."""
+    monkeypatch.setattr(history, "HISTORY_FILE", tmp_path / "history.json")
+
+    runner = CliRunner()
+    with (
+        patch("lhammai_cli.main.get_llm_response", return_value="Test response.") as mock_get,
+        patch("lhammai_cli.main.is_model_loaded") as mock_loaded,
+        patch("lhammai_cli.main.preload_model") as mock_preload,
+    ):
+        result = runner.invoke(
+            main, ["-p", "Hi", "--json", "--keep-alive", "30m", "--replay", str(tmp_path), "--replay-speed", "0"]
+        )
+
+    assert result.exit_code == 0
+    cassette = mock_get.call_args.kwargs["cassette"]
+    assert cassette.mode == "replay"
+    assert cassette.speed == 0
+    mock_loaded.assert_not_called()
+    mock_preload.assert_not_called()
+
+
+def test_main_record_and_replay_are_exclusive(tmp_path):
+    """Test that recording and replaying at once is rejected."""
+    runner = CliRunner()
+    result = runner.invoke(main, ["-p", "Hi", "--record", str(tmp_path), "--replay", str(tmp_path)])
+
+    assert result.exit_code == 2
+    assert "not both" in result.output
+
+
+class _SlowStdin(io.RawIOBase):
+    """Standard input whose producer only finishes once an event is set."""
+
+    def __init__(self, data: bytes, done: threading.Event):
+        """Initialize the stream with the data written once `done` is set."""
+        self._data = data
+        self._done = done
+
+    def readable(self) -> bool:
+        """Return that the stream is readable."""
+        return True
+
+    def readinto(self, buffer) -> int:
+        """Block until the producer is done, then return its data."""
+        if not self._data or not len(buffer):
+            return 0
+        if not self._done.wait(5):
+            raise TimeoutError("The producer never finished")
+        size = min(len(buffer), len(self._data))
+        buffer[:size], self._data = self._data[:size], self._data[size:]
+        return size
+
+
+def test_main_preloads_model_while_reading_stdin(monkeypatch, tmp_path):
+    """Test that a cold model starts loading before stdin is fully read."""
+    monkeypatch.setattr(history, "HISTORY_FILE", tmp_path / "history.json")
+    preloaded = threading.Event()
+
+    runner = CliRunner()
+    with (
+        patch("lhammai_cli.main.get_llm_response", return_value="Test response."),
+        patch("lhammai_cli.main.is_model_loaded", return_value=False),
+        patch("lhammai_cli.main.preload_model", side_effect=lambda *args, **kwargs: preloaded.set()) as mock_preload,
+    ):
+        result = runner.invoke(
+            main, ["-p", "why did this fail", "--json"], input=_SlowStdin(b"make: *** [all] Error 1", preloaded)
+        )
+
+    assert result.exit_code == 0
+    assert preloaded.is_set()
+    assert json.loads(result.stdout)["content"] == "Test response."
+    mock_preload.assert_called_once_with("ollama:gemma3:4b", "http://localhost:11434/", None, timeout=300.0)
+
+
+def test_main_timeout_skips_keep_alive_refresh(monkeypatch, tmp_path):
+    """Test that the model is not kept resident after a request that timed out."""
+    monkeypatch.setattr(history, "HISTORY_FILE", tmp_path / "history.json")
+
+    def fake_response(prompt, model, api_base, show_spinner=True, on_token=None, on_usage=None, **kwargs):
+        on_token("Once upon")
+        raise TimeoutError("No complete response")
+
+    runner = CliRunner()
+    with (
+        patch("lhammai_cli.main.get_llm_response", side_effect=fake_response),
+        patch("lhammai_cli.main.is_model_loaded", return_value=True),
+        patch("lhammai_cli.main.preload_model") as mock_preload,
+    ):
+        result = runner.invoke(main, ["-p", "Tell a story", "--json", "--timeout", "5", "--keep-alive", "30m"])
+
+    assert result.exit_code == 0
+    mock_preload.assert_not_called()
+
+
+def test_main_timeout_does_not_wait_for_warm_up(monkeypatch, tmp_path):
+    """Test that a timed-out request exits without waiting for the model to finish loading."""
+    monkeypatch.setattr(history, "HISTORY_FILE", tmp_path / "history.json")
+    release = threading.Event()
+
+    def fake_response(prompt, model, api_base, show_spinner=True, on_token=None, on_usage=None, **kwargs):
+        on_token("Once upon")
+        raise TimeoutError("No complete response")
+
+    runner = CliRunner()
+    with (
+        patch("lhammai_cli.main.get_llm_response", side_effect=fake_response),
+        patch("lhammai_cli.main.is_model_loaded", return_value=False),
+        patch("lhammai_cli.main.preload_model", side_effect=lambda *args, **kwargs: release.wait(5)),
+    ):
+        started = time.monotonic()
+        result = runner.invoke(main, ["-p", "Tell a story", "--json", "--timeout", "5", "--keep-alive", "30m"])
+        elapsed = time.monotonic() - started
+        release.set()
+
+    assert result.exit_code == 0
+    assert elapsed < 2
@@ -0,0 +1,74 @@
+from unittest.mock import MagicMock, patch
+
+import pytest
+from ollama._types import GenerateResponse, ProcessResponse
+
+from lhammai_cli.utils.ollama_utils import is_model_loaded, parse_keep_alive, preload_model
+
+API_BASE = "http://localhost:11434"
+
+
+def _running(*names: str) -> ProcessResponse:
+    """Build an Ollama `ps` response listing the given models."""
+    return ProcessResponse(models=[ProcessResponse.Model(model=name, name=name) for name in names])
+
+
+def test_is_model_loaded_true() -> None:
+    """Test that a resident model is reported as loaded."""
+    with patch("ollama.Client") as mock_client:
+        mock_client.return_value.ps.return_value = _running("gemma3:4b")
+        assert is_model_loaded("ollama:gemma3:4b", API_BASE) is True
+
+
+def test_is_model_loaded_adds_default_tag() -> None:
+    """Test that untagged model names match the `latest` tag Ollama reports."""
+    with patch("ollama.Client") as mock_client:
+        mock_client.return_value.ps.return_value = _running("llama3.2:latest")
+        assert is_model_loaded("ollama:llama3.2", API_BASE) is True
+
+
+def test_is_model_loaded_false() -> None:
+    """Test that a model missing from the running list is reported as not loaded."""
+    with patch("ollama.Client") as mock_client:
+        mock_client.return_value.ps.return_value = _running("qwen3:4b")
+        assert is_model_loaded("ollama:gemma3:4b", API_BASE) is False
+
+
+def test_is_model_loaded_unreachable_endpoint() -> None:
+    """Test that an unreachable endpoint leaves the state unknown."""
+    with patch("ollama.Client") as mock_client:
+        mock_client.return_value.ps.side_effect = ConnectionError("refused")
+        assert is_model_loaded("ollama:gemma3:4b", API_BASE) is None
+
+
+def test_is_model_loaded_other_provider() -> None:
+    """Test that providers other than Ollama are not probed."""
+    with patch("ollama.Client") as mock_client:
+        assert is_model_loaded("openai:gpt-4o", API_BASE) is None
+    mock_client.assert_not_called()
+
+
+def test_preload_model() -> None:
+    """Test that preloading sends an empty request with the requested keep-alive."""
+    with patch("ollama.Client") as mock_client:
+        mock_client.return_value.generate.return_value = GenerateResponse(
+            model="gemma3:4b", response="", load_duration=1_500_000_000
+        )
+        load_seconds = preload_model("ollama:gemma3:4b", API_BASE, keep_alive="30m")
+
+    assert load_seconds == pytest.approx(1.5)
+    mock_client.return_value.generate.assert_called_once_with(model="gemma3:4b", keep_alive="30m")
+
+
+def test_preload_model_connection_error() -> None:
+    """Test that connection failures are reported as ConnectionError."""
+    with patch("ollama.Client", return_value=MagicMock()) as mock_client:
+        mock_client.return_value.generate.side_effect = ConnectionError("refused")
+        with pytest.raises(ConnectionError, match="Failed to connect to Ollama"):
+            preload_model("ollama:gemma3:4b", API_BASE)
+
+
+@pytest.mark.parametrize(("value", "expected"), [(None, None), ("-1", -1.0), ("300", 300.0), ("30m", "30m")])
+def test_parse_keep_alive(value, expected) -> None:
+    """Test that numeric keep-alive values are sent as seconds and durations as strings."""
+    assert parse_keep_alive(value) == expected
@@ -0,0 +1,129 @@
+from unittest.mock import patch
+
+import pytest
+
+from lhammai_cli.response_cache import ResponseCache, normalize_prompt
+
+pytest.importorskip("numpy")
+
+MODEL = "ollama:gemma3:4b"
+
+
+@pytest.fixture
+def cache(tmp_path) -> ResponseCache:
+    """Create an empty response cache in a temporary directory."""
+    return ResponseCache(
+        tmp_path / "cache", "ollama:nomic-embed-text", "http://localhost:11434", threshold=0.9, max_entries=2
+    )
+
+
+def test_normalize_prompt_masks_volatile_parts():
+    """Test that identifiers, timestamps and whitespace do not distinguish prompts."""
+    first = normalize_prompt("Explain  request 3f2b8c9e-1d2a-4b5c-9e8f-0a1b2c3d4e5f at 2026-01-02T10:11:12Z", mask=True)
+    second = normalize_prompt(
+        "Explain request 00000000-1111-2222-3333-444444444444 at 2025-12-31 23:59:59\n", mask=True
+    )
+
+    assert first == second == "Explain request <uuid> at <timestamp>"
+
+
+def test_normalize_prompt_keeps_numbers():
+    """Test that numbers are never masked, and that nothing is masked unless requested."""
+    assert normalize_prompt("Refund order 48213 for customer 99120", mask=True) == (
+        "Refund order 48213 for customer 99120"
+    )
+    assert normalize_prompt("Explain  request 3f2b8c9e-1d2a-4b5c-9e8f-0a1b2c3d4e5f") == (
+        "Explain request 3f2b8c9e-1d2a-4b5c-9e8f-0a1b2c3d4e5f"
+    )
+
+
+def test_exact_match_skips_embedding(cache):
+    """Test that a previously seen normalized prompt is a hit without calling the embedding endpoint."""
+    with patch("lhammai_cli.response_cache.get_embeddings", return_value=[[1.0, 0.0]]):
+        cache.put("What is 2 + 2?", MODEL, "4")
+
+    with patch("lhammai_cli.response_cache.get_embeddings") as mock_embed:
+        assert cache.get("What is  2 + 2?", MODEL) == "4"
+
+    mock_embed.assert_not_called()
+
+
+def test_similarity_threshold(cache):
+    """Test that only prompts similar enough to a cached one, for the same model, are hits."""
+    with patch("lhammai_cli.response_cache.get_embeddings", return_value=[[1.0, 0.0]]):
+        cache.put("What is 2 + 2?", MODEL, "4")
+
+    with patch("lhammai_cli.response_cache.get_embeddings", return_value=[[0.95, 0.05]]):
+        assert cache.get("what's two plus two", MODEL) == "4"
+        assert cache.get("what's two plus two", "ollama:llama3.2:3b") is None
+
+    with patch("lhammai_cli.response_cache.get_embeddings", return_value=[[0.5, 0.5]]):
+        assert cache.get("What is 2 * 2?", MODEL) is None
+
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"]) == (1, 2)
+
+
+def test_evicts_least_recently_used(cache):
+    """Test that a full cache drops the entry that was used the longest time ago."""
+    with patch("lhammai_cli.response_cache.get_embeddings", side_effect=[[[1.0, 0.0]], [[0.0, 1.0]], [[1.0, 1.0]]]):
+        cache.put("first", MODEL, "1")
+        cache.put("second", MODEL, "2")
+        assert cache.get("first", MODEL) == "1"
+        cache.put("third", MODEL, "3")
+
+    reopened = ResponseCache(cache.directory, cache.embedding_model, cache.api_base, threshold=0.9, max_entries=2)
+    with patch("lhammai_cli.response_cache.get_embeddings", return_value=[[-1.0, 0.0]]):
+        assert reopened.get("first", MODEL) == "1"
+        assert reopened.get("third", MODEL) == "3"
+        assert reopened.get("second", MODEL) is None
+
+
+def test_put_merges_entries_of_other_processes(cache):
+    """Test that caches opened at the same time, as in separate processes, keep each other's entries."""
+    other = ResponseCache(cache.directory, cache.embedding_model, cache.api_base, threshold=0.9, max_entries=2)
+    with patch("lhammai_cli.response_cache.get_embeddings", side_effect=[[[1.0, 0.0]], [[0.0, 1.0]]]):
+        assert cache.get("first", MODEL) is None
+        assert other.get("second", MODEL) is None
+        cache.put("first", MODEL, "1")
+        other.put("second", MODEL, "2")
+
+    reopened = ResponseCache(cache.directory, cache.embedding_model, cache.api_base, threshold=0.9, max_entries=2)
+    assert reopened.get("first", MODEL) == "1"
+    assert reopened.get("second", MODEL) == "2"
+    assert reopened.stats()["misses"] == 2
+
+
+def test_hit_does_not_rewrite_the_vectors(cache):
+    """Test that a cache hit only updates the small bookkeeping files."""
+    with patch("lhammai_cli.response_cache.get_embeddings", return_value=[[1.0, 0.0]]):
+        cache.put("What is 2 + 2?", MODEL, "4")
+    vectors = cache.directory / "vectors.npy"
+    before = vectors.stat().st_mtime_ns
+
+    assert cache.get("What is 2 + 2?", MODEL) == "4"
+
+    assert vectors.stat().st_mtime_ns == before
+    assert cache.stats()["hits"] == 1
+
+
+def test_clear(cache):
+    """Test that clearing the cache removes the entries and the counters."""
+    with patch("lhammai_cli.response_cache.get_embeddings", return_value=[[1.0, 0.0]]):
+        cache.put("What is 2 + 2?", MODEL, "4")
+        cache.get("What is 2 + 2?", MODEL)
+
+    cache.clear()
+
+    assert cache.stats()["entries"] == 0
+    assert cache.stats()["hits"] == 0
+
+
+def test_threshold_applies_to_masked_prompts(tmp_path):
+    """Test that prompts that only match after masking go through the similarity threshold."""
+    cache = ResponseCache(
+        tmp_path / "cache", "ollama:nomic-embed-text", "http://localhost:11434", threshold=1.0, max_entries=2
+    )
+    with patch("lhammai_cli.response_cache.get_embeddings", side_effect=[[[1.0, 0.0]], [[0.99, 0.1]]]):
+        cache.put("What is 12345 * 67890?", MODEL, "838102050")
+        assert cache.get("What is 99999 * 11111?", MODEL) is None
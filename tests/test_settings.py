@@ -1,8 +1,11 @@
+from unittest.mock import patch
+
 import pytest
 from any_llm.exceptions import UnsupportedProviderError
 from pydantic import ValidationError
 
-from lhammai_cli.settings import Settings
+from lhammai_cli import settings as settings_module
+from lhammai_cli.settings import APP_DIR, Settings
 
 
 def test_settings_valid_model(monkeypatch):
@@ -41,3 +44,81 @@ def test_settings_unsupported_api_base(monkeypatch):
     error_message = ("URL scheme should be 'http' or 'https' "
                      "[type=url_scheme, input_value='ftp://localhost:11434', input_type=str]")
     assert error_message in str(excinfo.value)
+
+
+def test_settings_relative_log_file_is_placed_in_app_dir(monkeypatch):
+    """Test that a relative log file is resolved under the application directory."""
+    monkeypatch.setenv("LOG_FILE", "debug.log")
+    settings = Settings()  # type: ignore
+    assert settings.log_file == APP_DIR / "debug.log"
+
+
+def test_settings_empty_log_file_disables_logging(monkeypatch):
+    """Test that an empty log file disables file logging."""
+    monkeypatch.setenv("LOG_FILE", "")
+    settings = Settings()  # type: ignore
+    assert settings.log_file is None
+
+
+def test_load_settings_reuses_snapshot(monkeypatch, tmp_path):
+    """Test that a valid snapshot is reused without resolving the settings again."""
+    monkeypatch.setattr(settings_module, "SETTINGS_SNAPSHOT", tmp_path / "settings.snapshot.json")
+    monkeypatch.setattr(settings_module, "_snapshot", None)
+
+    resolved = settings_module.load_settings()
+    snapshot = settings_module._read_snapshot()
+    assert snapshot is not None
+
+    monkeypatch.setattr(settings_module, "_snapshot", snapshot)
+    with patch.object(Settings, "model_construct", wraps=Settings.model_construct) as mock_construct:
+        cached = settings_module.load_settings()
+
+    mock_construct.assert_called_once()
+    assert cached.model_dump() == resolved.model_dump()
+
+
+def test_load_settings_invalidated_by_environment(monkeypatch, tmp_path):
+    """Test that a change in the relevant environment variables invalidates the snapshot."""
+    monkeypatch.setattr(settings_module, "SETTINGS_SNAPSHOT", tmp_path / "settings.snapshot.json")
+    monkeypatch.setattr(settings_module, "_snapshot", None)
+
+    settings_module.load_settings()
+    monkeypatch.setattr(settings_module, "_snapshot", settings_module._read_snapshot())
+
+    model = "ollama:another-model:latest"
+    monkeypatch.setenv("MODEL", model)
+    monkeypatch.setitem(settings_module._process_environ, "MODEL", model)
+
+    assert settings_module.load_settings().model == model
+
+
+def test_snapshot_invalidated_by_dotenv_in_parent_directory(monkeypatch, tmp_path):
+    """Test that a dotenv file created in a parent of the working directory invalidates the snapshot."""
+    monkeypatch.setattr(settings_module, "SETTINGS_SNAPSHOT", tmp_path / "settings.snapshot.json")
+    monkeypatch.setattr(settings_module, "_snapshot", None)
+    monkeypatch.setenv("SNAPSHOT_TEST", "")
+    (tmp_path / "a" / "b").mkdir(parents=True)
+    monkeypatch.chdir(tmp_path / "a" / "b")
+
+    settings_module.load_settings()
+    (tmp_path / "a" / ".env").write_text('SNAPSHOT_TEST="parent"\n')
+    paths, snapshot = settings_module._load_dotenv_files()
+
+    assert snapshot is None
+    assert str(tmp_path / "a" / ".env") in paths
+
+
+def test_load_settings_invalidated_by_module_change(monkeypatch, tmp_path):
+    """Test that a snapshot written by another version of the settings module is not reused."""
+    monkeypatch.setattr(settings_module, "SETTINGS_SNAPSHOT", tmp_path / "settings.snapshot.json")
+    monkeypatch.setattr(settings_module, "_snapshot", None)
+
+    settings_module.load_settings()
+    snapshot = settings_module._read_snapshot()
+    snapshot["module"] = "an older version"
+    monkeypatch.setattr(settings_module, "_snapshot", snapshot)
+
+    with patch.object(Settings, "model_construct") as mock_construct:
+        settings_module.load_settings()
+
+    mock_construct.assert_not_called()
@@ -0,0 +1,147 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from unittest.mock import patch
+
+import pytest
+from any_llm.types.completion import ChatCompletion
+
+from lhammai_cli.utils import Cassette, SingleFlight, get_llm_response
+
+
+def _slow_send(calls: list[str], response: str = "42") -> str:
+    """Send a request that takes a while."""
+    calls.append(response)
+    time.sleep(0.3)
+    return response
+
+
+def test_coalesces_requests_within_a_process() -> None:
+    """Test that identical requests from several threads are sent once."""
+    single_flight = SingleFlight()
+    calls: list[str] = []
+
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        results = list(executor.map(lambda _: single_flight.do("key", lambda: _slow_send(calls)), range(4)))
+
+    assert calls == ["42"]
+    assert sorted(results) == [("42", False)] + [("42", True)] * 3
+
+
+def test_coalesces_requests_across_processes(tmp_path: Path) -> None:
+    """Test that identical requests coordinated through the lock file are sent once."""
+    # Separate instances share no memory, like separate processes
+    calls: list[str] = []
+
+    with ThreadPoolExecutor(max_workers=3) as executor:
+        results = list(executor.map(lambda _: SingleFlight(tmp_path).do("key", lambda: _slow_send(calls)), range(3)))
+
+    assert calls == ["42"]
+    assert sorted(results) == [("42", False)] + [("42", True)] * 2
+    # The response is removed once every waiting caller has read it
+    assert not list(tmp_path.glob("*.json"))
+
+
+def test_failed_request_is_not_shared(tmp_path: Path) -> None:
+    """Test that a caller waiting on a request that fails sends the request itself."""
+    started = threading.Event()
+
+    def fail() -> str:
+        started.set()
+        time.sleep(0.3)
+        raise ConnectionError("refused")
+
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        leader = executor.submit(SingleFlight(tmp_path).do, "key", fail)
+        started.wait()
+        result = SingleFlight(tmp_path).do("key", lambda: "42")
+
+        with pytest.raises(ConnectionError):
+            leader.result()
+
+    assert result == ("42", False)
+
+
+def test_check_stops_waiting() -> None:
+    """Test that a waiting caller stops when its check raises."""
+    single_flight = SingleFlight()
+    release = threading.Event()
+    deadline = time.perf_counter() + 0.2
+
+    def check() -> None:
+        if time.perf_counter() > deadline:
+            raise TimeoutError("deadline")
+
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        leader = executor.submit(single_flight.do, "key", lambda: release.wait(5) and "42")
+        time.sleep(0.05)
+        with pytest.raises(TimeoutError):
+            single_flight.do("key", lambda: "never sent", check)
+        release.set()
+        assert leader.result() == ("42", False)
+
+
+def test_get_llm_response_coalesces_identical_requests(mock_llm_response: ChatCompletion) -> None:
+    """Test that concurrent identical prompts reach the provider once."""
+    single_flight = SingleFlight()
+
+    async def slow_completion(**kwargs) -> ChatCompletion:
+        time.sleep(0.3)
+        return mock_llm_response
+
+    with patch("lhammai_cli.utils.llm_utils.acompletion", side_effect=slow_completion) as mock_completion:
+        with ThreadPoolExecutor(max_workers=3) as executor:
+            responses = list(
+                executor.map(
+                    lambda _: get_llm_response(
+                        "Hello!",
+                        "ollama:gemma3:4b",
+                        "http://localhost:11434",
+                        show_spinner=False,
+                        single_flight=single_flight,
+                    ),
+                    range(3),
+                )
+            )
+
+    assert responses == ["This is a mock response!"] * 3
+    mock_completion.assert_called_once()
+
+
+def test_get_llm_response_records_coalesced_responses(tmp_path: Path, mock_llm_response: ChatCompletion) -> None:
+    """Test that a response received from an identical request in flight is recorded and reported."""
+    single_flight = SingleFlight()
+    shared: list[bool] = []
+
+    async def slow_completion(**kwargs) -> ChatCompletion:
+        time.sleep(0.3)
+        return mock_llm_response
+
+    def ask(directory: Path, on_shared=None) -> str | None:
+        return get_llm_response(
+            "Hello!",
+            "ollama:gemma3:4b",
+            "http://localhost:11434",
+            show_spinner=False,
+            cassette=Cassette(directory, "record"),
+            single_flight=single_flight,
+            on_shared=on_shared,
+        )
+
+    with patch("lhammai_cli.utils.llm_utils.acompletion", side_effect=slow_completion):
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            leader = executor.submit(ask, tmp_path / "leader")
+            time.sleep(0.05)
+            ask(tmp_path / "follower", on_shared=lambda: shared.append(True))
+            leader.result()
+
+    assert shared == [True]
+    replayed = get_llm_response(
+        "Hello!",
+        "ollama:gemma3:4b",
+        "http://localhost:11434",
+        show_spinner=False,
+        cassette=Cassette(tmp_path / "follower", "replay", speed=0),
+    )
+    assert replayed == "This is a mock response!"
@@ -0,0 +1,75 @@
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime
+
+import pytest
+
+from lhammai_cli.schema import Conversation, ConversationMetadata, Message, Role, TokenUsage
+from lhammai_cli.usage import UsageRollups, UsageTotals
+
+
+@pytest.fixture
+def rollups(tmp_path) -> UsageRollups:
+    """Create empty usage rollups in a temporary directory."""
+    return UsageRollups(tmp_path / "usage.json")
+
+
+def test_record_accumulates_per_day_and_model(rollups):
+    """Test that requests are summed per day and model."""
+    rollups.record("ollama:gemma3:4b", TokenUsage(prompt_tokens=10, completion_tokens=5), day=date(2025, 1, 1))
+    rollups.record("ollama:gemma3:4b", TokenUsage(prompt_tokens=30, completion_tokens=1), day=date(2025, 1, 1))
+    rollups.record("ollama:qwen3:4b", TokenUsage(prompt_tokens=7, completion_tokens=7), day=date(2025, 1, 2))
+
+    rows = rollups.query()
+
+    assert rows == [
+        (
+            "2025-01-01",
+            "ollama:gemma3:4b",
+            UsageTotals(requests=2, prompt_tokens=40, completion_tokens=6, max_prompt_tokens=30),
+        ),
+        (
+            "2025-01-02",
+            "ollama:qwen3:4b",
+            UsageTotals(requests=1, prompt_tokens=7, completion_tokens=7, max_prompt_tokens=7),
+        ),
+    ]
+    assert [row[0] for row in rollups.query(since=date(2025, 1, 2))] == ["2025-01-02"]
+    assert rollups.query(model="ollama:llama3.2:3b") == []
+
+
+def test_rebuild_from_conversations(rollups):
+    """Test that rebuilding replaces the rollups with the usage stored in the conversations."""
+    rollups.record("ollama:gemma3:4b", TokenUsage(prompt_tokens=99, completion_tokens=99))
+    conversation = Conversation(
+        metadata=ConversationMetadata(
+            model="ollama:gemma3:4b", api_base="http://localhost:11434", start_time=datetime(2025, 3, 4, 12)
+        ),
+        messages=[
+            Message(role=Role.USER, content="Hi"),
+            Message(role=Role.ASSISTANT, content="Hello", usage=TokenUsage(prompt_tokens=4, completion_tokens=2)),
+        ],
+    )
+
+    assert rollups.rebuild([("uuid", conversation)]) == 1
+    assert rollups.query() == [
+        (
+            "2025-03-04",
+            "ollama:gemma3:4b",
+            UsageTotals(requests=1, prompt_tokens=4, completion_tokens=2, max_prompt_tokens=4),
+        )
+    ]
+
+
+def test_concurrent_records_are_not_lost(tmp_path):
+    """Test that concurrent updates through separate instances all count, as from separate processes."""
+    usage = TokenUsage(prompt_tokens=1, completion_tokens=1)
+
+    def record_many(_: int) -> None:
+        for _ in range(25):
+            UsageRollups(tmp_path / "usage.json").record("ollama:gemma3:4b", usage)
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        list(executor.map(record_many, range(8)))
+
+    ((_, _, totals),) = UsageRollups(tmp_path / "usage.json").query()
+    assert totals.requests == 200
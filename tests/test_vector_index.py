@@ -0,0 +1,106 @@
+from datetime import datetime
+from unittest.mock import patch
+
+import pytest
+
+from lhammai_cli.schema import Conversation, ConversationMetadata, Message, Role
+from lhammai_cli.vector_index import VectorIndex
+
+np = pytest.importorskip("numpy")
+
+MODEL = "ollama:nomic-embed-text"
+
+
+@pytest.fixture
+def vector_index(tmp_path) -> VectorIndex:
+    """Create an empty vector index in a temporary directory."""
+    return VectorIndex(tmp_path / "index", MODEL)
+
+
+def test_search_ranks_by_cosine_similarity(vector_index):
+    """Test that search returns the closest vectors first, regardless of their magnitude."""
+    vector_index.add([("a", 0), ("a", 1), ("b", 0)], [[1.0, 0.0], [0.0, 5.0], [3.0, 3.0]])
+
+    results = vector_index.search([0.1, 1.0], top_k=2)
+
+    assert [key for key, _ in results] == [("a", 1), ("b", 0)]
+    assert results[0][1] == pytest.approx(1.0 / np.sqrt(1.01), rel=1e-5)
+
+
+def test_add_appends_incrementally(vector_index):
+    """Test that successive additions extend the index instead of replacing it."""
+    vector_index.add([("a", 0)], [[1.0, 0.0]])
+    vector_index.add([("b", 0)], [[0.0, 1.0]])
+
+    assert vector_index.indexed_keys() == {("a", 0), ("b", 0)}
+    assert (vector_index.directory / "vectors.f32").stat().st_size == 2 * 2 * 4
+
+
+def test_search_ignores_rows_without_keys(vector_index):
+    """Test that an interrupted append does not misalign vectors and keys."""
+    vector_index.add([("a", 0)], [[1.0, 0.0]])
+    with (vector_index.directory / "vectors.f32").open("ab") as f:
+        f.write(np.asarray([0.0, 1.0], dtype=np.float32).tobytes())
+
+    assert vector_index.search([0.0, 1.0]) == [(("a", 0), pytest.approx(0.0))]
+
+
+def test_add_repairs_an_interrupted_append(vector_index):
+    """Test that an append after an interrupted one keeps every key paired with its own vector."""
+    vector_index.add([("a", 0)], [[1.0, 0.0]])
+    with (vector_index.directory / "vectors.f32").open("ab") as f:
+        f.write(np.asarray([0.0, 1.0], dtype=np.float32).tobytes())
+
+    vector_index.add([("c", 0)], [[0.6, 0.8]])
+
+    assert vector_index.search([0.6, 0.8], top_k=1) == [(("c", 0), pytest.approx(1.0))]
+    assert (vector_index.directory / "vectors.f32").stat().st_size == 2 * 2 * 4
+
+
+def test_remove_keeps_other_rows_paired(vector_index):
+    """Test that removing a conversation's messages leaves the others searchable with their own vectors."""
+    vector_index.add([("a", 0), ("b", 0), ("a", 1)], [[1.0, 0.0], [0.0, 1.0], [0.6, 0.8]])
+
+    assert vector_index.remove({"a"}) == 2
+
+    assert vector_index.indexed_keys() == {("b", 0)}
+    assert vector_index.search([1.0, 0.0]) == [(("b", 0), pytest.approx(0.0))]
+    vector_index.add([("a", 0)], [[1.0, 0.0]])
+    assert vector_index.search([1.0, 0.0], top_k=1) == [(("a", 0), pytest.approx(1.0))]
+
+
+def test_add_skips_indexed_keys(vector_index):
+    """Test that messages indexed concurrently by another process are not indexed twice."""
+    vector_index.add([("a", 0)], [[1.0, 0.0]])
+    vector_index.add([("a", 0), ("b", 0)], [[1.0, 0.0], [0.0, 1.0]])
+
+    assert vector_index._read_keys() == [("a", 0), ("b", 0)]
+    assert (vector_index.directory / "vectors.f32").stat().st_size == 2 * 2 * 4
+
+
+def test_model_mismatch(vector_index):
+    """Test that an index built with another embedding model is rejected."""
+    vector_index.add([("a", 0)], [[1.0, 0.0]])
+
+    other = VectorIndex(vector_index.directory, "ollama:mxbai-embed-large")
+    with pytest.raises(ValueError, match="--rebuild"):
+        other.search([1.0, 0.0])
+
+
+def test_index_conversations_embeds_only_new_messages(vector_index):
+    """Test that only messages missing from the index are embedded."""
+    metadata = ConversationMetadata(
+        model="ollama:gemma3:4b", api_base="http://localhost:11434", start_time=datetime.now()
+    )
+    conversation = Conversation(
+        metadata=metadata,
+        messages=[Message(role=Role.USER, content="Hello"), Message(role=Role.ASSISTANT, content="Hi!")],
+    )
+    vector_index.add([("conv", 0)], [[1.0, 0.0]])
+
+    with patch("lhammai_cli.vector_index.get_embeddings", return_value=[[0.0, 1.0]]) as mock_embeddings:
+        added = vector_index.index_conversations({"conv": conversation}, "http://localhost:11434")
+
+    assert added == 1
+    mock_embeddings.assert_called_once_with(["Hi!"], MODEL, "http://localhost:11434")
+    assert vector_index.indexed_keys() == {("conv", 0), ("conv", 1)}